@@ -0,0 +1,14 @@
+from django.utils.functional import SimpleLazyObject
+
+from .roles import get_roles, is_billing_owner, is_owner
+
+
+def roles(request):
+    """Expose the current user's roles to templates. Evaluated lazily and
+    backed by the per-request memo, so navigation checks cost no queries."""
+    user = getattr(request, 'user', None)
+    return {
+        'user_roles': SimpleLazyObject(lambda: get_roles(user)),
+        'user_is_owner': SimpleLazyObject(lambda: is_owner(user)),
+        'user_is_billing_owner': SimpleLazyObject(lambda: is_billing_owner(user)),
+    }
@@ -0,0 +1,110 @@
+"""
+Role lookups shared by the permission decorators.
+
+A user's roles are resolved at most once per request: the result is kept
+on the user object (Django builds a fresh one for every request) and in
+the cache for ``ROLES_CACHE_TIMEOUT`` seconds, so repeat checks and later
+requests cost no database queries. ``account.signals`` drops the cached
+roles when group membership, a group, or the user changes.
+
+Roles are the user's group names plus two derived ones: ``SUPERUSER`` and
+``BILLING_OWNER`` (the account named by ``settings.BILLING_OWNER_USERNAME``).
+"""
+
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
+from django.shortcuts import redirect
+
+OWNER_GROUP = 'Owner'
+SUPERUSER = 'superuser'
+BILLING_OWNER = 'billing_owner'
+
+GENERATION_KEY = 'account:roles:generation'
+
+# Attribute holding the roles on the request's user object.
+_MEMO_ATTR = '_legacygrid_roles'
+
+
+def roles_timeout():
+    return getattr(settings, 'ROLES_CACHE_TIMEOUT', 300)
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def roles_key(user_id, generation=None):
+    return f'account:roles:{generation or _generation()}:{user_id}'
+
+
+def get_roles(user):
+    """Return the user's roles as a frozenset (empty for anonymous users)."""
+    if not getattr(user, 'is_authenticated', False):
+        return frozenset()
+    roles = getattr(user, _MEMO_ATTR, None)
+    if roles is not None:
+        return roles
+    key = roles_key(user.pk)
+    roles = cache.get(key)
+    if roles is None:
+        roles = set(user.groups.values_list('name', flat=True))
+        if user.is_superuser:
+            roles.add(SUPERUSER)
+        if user.get_username() == settings.BILLING_OWNER_USERNAME:
+            roles.add(BILLING_OWNER)
+        roles = frozenset(roles)
+        cache.set(key, roles, roles_timeout())
+    setattr(user, _MEMO_ATTR, roles)
+    return roles
+
+
+def forget_roles(*user_ids, user=None):
+    """Drop cached roles for the given users (and the memo on ``user``)."""
+    if user is not None:
+        user.__dict__.pop(_MEMO_ATTR, None)
+        user_ids += (user.pk,)
+    if user_ids:
+        generation = _generation()
+        cache.delete_many([roles_key(user_id, generation) for user_id in user_ids])
+
+
+def forget_all_roles():
+    """Invalidate every cached role set, e.g. after a group is renamed."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, timeout=None)
+
+
+def has_role(user, role):
+    return role in get_roles(user)
+
+
+def is_owner(user):
+    roles = get_roles(user)
+    return SUPERUSER in roles or OWNER_GROUP in roles
+
+
+def is_billing_owner(user):
+    return BILLING_OWNER in get_roles(user)
+
+
+def role_required(test, redirect_to):
+    """Decorator: the view requires a login and ``test(user)`` to pass,
+    otherwise the user is redirected to ``redirect_to``."""
+    def decorator(view_func):
+        @wraps(view_func)
+        @login_required
+        def _wrapped_view(request, *args, **kwargs):
+            if test(request.user):
+                return view_func(request, *args, **kwargs)
+            return redirect(redirect_to)
+        return _wrapped_view
+    return decorator
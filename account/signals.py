@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .roles import forget_all_roles, forget_roles
+
+User = get_user_model()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def group_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # The affected users are only known before the rows go.
+        instance._cleared_user_ids = list(instance.user_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        forget_roles(user=instance)
+    elif action == 'post_clear':
+        forget_roles(*getattr(instance, '_cleared_user_ids', ()))
+    else:
+        forget_roles(*(pk_set or ()))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, **kwargs):
+    forget_all_roles()
+
+
+@receiver(post_save, sender=User)
+@receiver(pre_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # is_superuser and the username feed the derived roles.
+    forget_roles(user=instance)
@@ -0,0 +1,89 @@
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from unittest import mock
+
+from .roles import BILLING_OWNER, OWNER_GROUP, get_roles, is_billing_owner, is_owner, role_required
+
+
+def fresh(user):
+    """A new instance, as the next request would load it."""
+    return User.objects.get(pk=user.pk)
+
+
+class RoleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owners = Group.objects.create(name=OWNER_GROUP)
+        cls.user = User.objects.create_user('teacher', 'teacher@test.com', 'testpass')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_roles_are_resolved_once_and_then_cached(self):
+        user = fresh(self.user)
+        with self.assertNumQueries(1):
+            self.assertFalse(is_owner(user))
+            self.assertFalse(is_owner(user))
+            self.assertFalse(is_billing_owner(user))
+        # The next request's user object is served from the cache.
+        next_request_user = fresh(self.user)
+        with self.assertNumQueries(0):
+            self.assertFalse(is_owner(next_request_user))
+
+    def test_group_membership_changes_invalidate(self):
+        self.assertFalse(is_owner(fresh(self.user)))
+
+        self.user.groups.add(self.owners)
+        self.assertTrue(is_owner(fresh(self.user)))
+
+        self.owners.user_set.remove(self.user)
+        self.assertFalse(is_owner(fresh(self.user)))
+
+        self.owners.user_set.add(self.user)
+        self.assertTrue(is_owner(fresh(self.user)))
+        self.owners.user_set.clear()
+        self.assertFalse(is_owner(fresh(self.user)))
+
+    def test_group_rename_invalidates(self):
+        self.user.groups.add(self.owners)
+        self.assertTrue(is_owner(fresh(self.user)))
+        self.owners.name = 'Former owners'
+        self.owners.save()
+        self.assertFalse(is_owner(fresh(self.user)))
+
+    def test_superuser_and_anonymous(self):
+        self.assertTrue(is_owner(User.objects.create_superuser('admin', 'admin@test.com', 'testpass')))
+        self.assertEqual(get_roles(AnonymousUser()), frozenset())
+
+    @override_settings(BILLING_OWNER_USERNAME='teacher')
+    def test_billing_owner_role(self):
+        self.assertIn(BILLING_OWNER, get_roles(fresh(self.user)))
+
+    def test_role_required_redirects(self):
+        view = role_required(is_owner, 'billing:not_authorized')(lambda request: HttpResponse('ok'))
+        request = RequestFactory().get('/')
+        request.user = fresh(self.user)
+        response = view(request)
+        self.assertEqual((response.status_code, response.url), (302, '/billing/not-authorized/'))
+
+        self.user.groups.add(self.owners)
+        request.user = fresh(self.user)
+        self.assertEqual(view(request).content, b'ok')
+
+
+class ProfileTests(TestCase):
+
+    async def test_profile_requires_login_and_shows_the_user(self):
+        url = reverse('account:profile')
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 302)
+
+        user = await User.objects.acreate_user('teacher', 'teacher@test.com', 'testpass')
+        await self.async_client.aforce_login(user)
+        with mock.patch('account.views.render', lambda request, template, context: HttpResponse(context['user'].email)):
+            response = await self.async_client.get(url)
+        self.assertEqual(response.content, b'teacher@test.com')
@@ -1,6 +1,9 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 
 @login_required
-def profile(request):
-    return render(request, "account/profile.html", {"user": request.user})
+async def profile(request):
+    user = await request.auser()
+    # Rendered in a thread: the context processors query the user's roles.
+    return await sync_to_async(render)(request, "account/profile.html", {"user": user})
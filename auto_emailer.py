@@ -1,47 +1,178 @@
-import smtplib
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
-from string import Template
-import os
-import logging
+from functools import partial
+import threading
+import time
 
-# Logging setup
-logging.basicConfig(filename='email_error.log', level=logging.ERROR)
+from email_metrics import ensure_email_logging, logger, phase, track_send
+from rate_limit import send_rate_limited, throttle_code
+from smtp_pool import default_pool, is_connection_error, max_connections
+from template_cache import default_registry
+
+# Logging setup: errors go to email_error.log, written by a background thread.
+ensure_email_logging()
 
 # Map event types to templates
 TEMPLATE_MAP = {
     "payment_received": "templates/email_school_fees_receipt.txt",
-    "registration_confirmation": "templates/email_registration_confirmation.txt"
+    "registration_confirmation": "templates/email_registration_confirmation.txt",
+    "billing_receipt": "templates/email_billing_receipt.txt"
 }
 
 def load_template(template_path):
-    with open(template_path, 'r', encoding='utf-8') as f:
-        return Template(f.read())
+    return default_registry.get(template_path).source
 
-def send_event_email(event_type, data, to_email, from_email, smtp_cfg):
-    template_path = TEMPLATE_MAP.get(event_type)
-    if not template_path or not os.path.exists(template_path):
-        logging.error(f"Template for event '{event_type}' not found.")
-        return False
+def warm_up_templates():
+    """Preload every TEMPLATE_MAP entry, e.g. when a worker process starts.
+    Returns the template paths that could not be loaded."""
+    return default_registry.warm_up(TEMPLATE_MAP.values())
 
-    template = load_template(template_path)
-    message_text = template.safe_substitute(data)
-    subject_line = message_text.splitlines()[0].replace("Subject: ", "")
-    body = "\n".join(message_text.splitlines()[1:]).strip()
+def build_event_message(template, data, to_email, from_email):
+    subject_line, body = template.render(data)
 
     msg = MIMEText(body)
     msg['Subject'] = subject_line
     msg['From'] = from_email
     msg['To'] = to_email
+    return msg
 
+def get_event_template(event_type):
+    template_path = TEMPLATE_MAP.get(event_type)
     try:
-        with smtplib.SMTP(smtp_cfg['server'], smtp_cfg['port']) as server:
-            server.starttls()
-            server.login(smtp_cfg['user'], smtp_cfg['password'])
-            server.sendmail(from_email, [to_email], msg.as_string())
+        if template_path:
+            return default_registry.get(template_path)
+    except OSError:
+        pass
+    logger.error(f"Template for event '{event_type}' not found.")
+    return None
+
+def send_event_email(event_type, data, to_email, from_email, smtp_cfg, session=None):
+    """Render the template for ``event_type`` and send it to ``to_email``.
+
+    Sends go through the shared SMTP connection pool. Pass ``session`` (from
+    ``smtp_pool.smtp_session``) to send a whole batch over one session.
+    """
+    with track_send(smtp_cfg, event_type, to_email) as timings:
+        with timings.phase('render'):
+            template = get_event_template(event_type)
+            if template is None:
+                return False
+            message = build_event_message(template, data, to_email, from_email).as_string()
+
+        def send():
+            if session is None:
+                return default_pool.sendmail(smtp_cfg, from_email, [to_email], message)
+            with phase('send'):
+                return session.sendmail(from_email, [to_email], message)
+
+        try:
+            send_rate_limited(smtp_cfg, send)
+        except Exception as e:
+            log_send_failure(to_email, e)
+            return False
+        timings.ok = True
         return True
-    except Exception as e:
-        logging.error(f"Failed to send email: {e}")
-        return False
+
+async def asend_event_email(event_type, data, to_email, from_email, smtp_cfg):
+    """``send_event_email`` for async code. ``smtplib`` blocks, so the send
+    runs in a worker thread while the event loop serves other requests."""
+    return await asyncio.to_thread(send_event_email, event_type, data, to_email, from_email, smtp_cfg)
+
+def log_send_failure(to_email, error):
+    code = throttle_code(error)
+    if code is not None:
+        logger.error(f"SMTP server throttled email to {to_email} ({code}): {error}")
+    else:
+        logger.error(f"Failed to send email to {to_email}: {error}")
+
+def send_event_emails_bulk(event_type, rows, from_email, smtp_cfg, max_workers=None):
+    """Send ``event_type`` emails for every ``(data, to_email)`` row in parallel.
+
+    Each worker thread holds one pooled session and sends its share of the
+    rows over it. ``max_workers`` defaults to the per-server connection cap
+    (``smtp_cfg['max_connections']``); the pool never opens more sessions than
+    that cap against one server, whatever ``max_workers`` is.
+
+    Returns a dict with a ``results`` list (one ``{'to_email', 'sent',
+    'error', 'seconds'}`` entry per row, in input order) and the ``sent``/``failed``
+    counts, ``elapsed`` seconds and ``messages_per_second``.
+    """
+    started = time.perf_counter()
+    results = []
+    template = get_event_template(event_type)
+    if template is None:
+        for data, to_email in rows:
+            results.append({'to_email': to_email, 'sent': False, 'error': 'template not found', 'seconds': 0.0})
+        return _bulk_summary(results, started)
+
+    workers = max_workers or max_connections(smtp_cfg)
+    lock = threading.Lock()
+    pending = enumerate(rows)
+    indexed = []
+
+    def next_row():
+        with lock:
+            return next(pending, None)
+
+    def send_over(server, to_email, message):
+        with phase('send'):
+            return server.sendmail(from_email, [to_email], message)
+
+    def worker():
+        server = None
+        try:
+            while True:
+                item = next_row()
+                if item is None:
+                    return
+                index, (data, to_email) = item
+                error = None
+                row_started = time.perf_counter()
+                with track_send(smtp_cfg, event_type, to_email) as timings:
+                    try:
+                        with timings.phase('render'):
+                            message = build_event_message(template, data, to_email, from_email).as_string()
+                        if server is None:
+                            server = default_pool.acquire(smtp_cfg)
+                        send_rate_limited(smtp_cfg, partial(send_over, server, to_email, message))
+                        timings.ok = True
+                    except Exception as e:
+                        log_send_failure(to_email, e)
+                        error = str(e)
+                        if server is not None and is_connection_error(e):
+                            default_pool.release(smtp_cfg, server, discard=True)
+                            server = None
+                result = {
+                    'to_email': to_email,
+                    'sent': error is None,
+                    'error': error,
+                    'seconds': time.perf_counter() - row_started,
+                }
+                with lock:
+                    indexed.append((index, result))
+        finally:
+            if server is not None:
+                default_pool.release(smtp_cfg, server)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(worker) for _ in range(workers)]:
+            future.result()
+
+    indexed.sort(key=lambda item: item[0])
+    results = [result for _, result in indexed]
+    return _bulk_summary(results, started)
+
+def _bulk_summary(results, started):
+    elapsed = time.perf_counter() - started
+    sent = sum(1 for result in results if result['sent'])
+    return {
+        'results': results,
+        'sent': sent,
+        'failed': len(results) - sent,
+        'elapsed': elapsed,
+        'messages_per_second': sent / elapsed if elapsed > 0 else 0.0,
+    }
 
 # Example usage:
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+"""
+Email pipeline benchmark.
+
+Sends N templated "payment_received" emails to an in-process SMTP sink
+through each send path and reports messages per second, p50/p95/p99
+latency, SMTP connections opened and peak memory. Run from the repository
+root:
+
+    python -m benchmarks.bench_email --messages 500 --latency 0.002 --output bench_email.json
+
+Compare the JSON output between releases to catch regressions.
+"""
+
+import argparse
+import json
+import logging
+import platform
+import time
+import tracemalloc
+
+import auto_emailer
+from rate_limit import default_limiter
+from smtp_pool import default_pool, smtp_session
+
+from benchmarks.smtp_sink import SMTPSink
+from benchmarks.stats import format_ms, percentile, to_ms
+
+FROM_EMAIL = "bench@legacygrid.test"
+
+
+def make_rows(count):
+    return [
+        ({
+            "parent_name": f"Parent {i}",
+            "student_name": f"Student {i}",
+            "amount": "500",
+            "date": "2025-09-15",
+        }, f"parent{i}@legacygrid.test")
+        for i in range(count)
+    ]
+
+
+def run_unpooled(rows, smtp_cfg, workers):
+    """Baseline: a fresh connection for every message (the pre-pool behaviour)."""
+    latencies, sent = [], 0
+    for data, to_email in rows:
+        started = time.perf_counter()
+        sent += auto_emailer.send_event_email("payment_received", data, to_email, FROM_EMAIL, smtp_cfg)
+        default_pool.close_all()
+        latencies.append(time.perf_counter() - started)
+    return sent, latencies
+
+
+def run_pooled(rows, smtp_cfg, workers):
+    """send_event_email one message at a time, reusing pooled sessions."""
+    latencies, sent = [], 0
+    for data, to_email in rows:
+        started = time.perf_counter()
+        sent += auto_emailer.send_event_email("payment_received", data, to_email, FROM_EMAIL, smtp_cfg)
+        latencies.append(time.perf_counter() - started)
+    return sent, latencies
+
+
+def run_session(rows, smtp_cfg, workers):
+    """One explicit session for the whole batch."""
+    latencies, sent = [], 0
+    with smtp_session(smtp_cfg) as session:
+        for data, to_email in rows:
+            started = time.perf_counter()
+            sent += auto_emailer.send_event_email(
+                "payment_received", data, to_email, FROM_EMAIL, smtp_cfg, session=session
+            )
+            latencies.append(time.perf_counter() - started)
+    return sent, latencies
+
+
+def run_bulk(rows, smtp_cfg, workers):
+    """send_event_emails_bulk with ``workers`` parallel sessions."""
+    summary = auto_emailer.send_event_emails_bulk(
+        "payment_received", rows, FROM_EMAIL, dict(smtp_cfg, max_connections=workers)
+    )
+    return summary['sent'], [result['seconds'] for result in summary['results']]
+
+
+SCENARIOS = {
+    'unpooled': run_unpooled,
+    'pooled': run_pooled,
+    'session': run_session,
+    'bulk': run_bulk,
+}
+
+
+def run_scenario(name, sink, rows, workers, smtp_cfg):
+    default_pool.close_all()
+    default_limiter.reset()
+    sink.reset_counts()
+    tracemalloc.start()
+    started = time.perf_counter()
+    sent, latencies = SCENARIOS[name](rows, smtp_cfg, workers)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    default_pool.close_all()
+    return {
+        'scenario': name,
+        'messages': len(rows),
+        'sent': sent,
+        'failed': len(rows) - sent,
+        'elapsed_seconds': elapsed,
+        'messages_per_second': sent / elapsed if elapsed > 0 else 0.0,
+        'latency_p50_ms': to_ms(percentile(latencies, 0.50)),
+        'latency_p95_ms': to_ms(percentile(latencies, 0.95)),
+        'latency_p99_ms': to_ms(percentile(latencies, 0.99)),
+        'connections_opened': sink.counts['connections'],
+        'peak_memory_kb': peak / 1024,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds the sink waits per message.")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of messages the sink rejects.")
+    parser.add_argument('--workers', type=int, default=4, help="Parallel sessions for the bulk scenario.")
+    parser.add_argument('--rate-per-minute', type=float, default=None, help="Apply the send rate limiter.")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated scenarios to run.")
+    parser.add_argument('--output', help="Write results as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    # Injected failures would otherwise fill the error log.
+    logging.disable(logging.ERROR)
+    rows = make_rows(args.messages)
+    auto_emailer.warm_up_templates()
+    results = []
+    with SMTPSink(latency=args.latency, failure_rate=args.failure_rate) as sink:
+        smtp_cfg = dict(sink.smtp_cfg, rate_per_minute=args.rate_per_minute)
+        for name in args.scenarios.split(','):
+            result = run_scenario(name.strip(), sink, rows, args.workers, smtp_cfg)
+            results.append(result)
+            print(
+                f"{result['scenario']:>9}: {result['messages_per_second']:9.1f} msg/s  "
+                f"p50 {format_ms(result['latency_p50_ms'])}  p99 {format_ms(result['latency_p99_ms'])}  "
+                f"connections {result['connections_opened']}  failed {result['failed']}"
+            )
+
+    report = {
+        'benchmark': 'email',
+        'python': platform.python_version(),
+        'parameters': {
+            'messages': args.messages,
+            'latency': args.latency,
+            'failure_rate': args.failure_rate,
+            'workers': args.workers,
+            'rate_per_minute': args.rate_per_minute,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""
+WSGI vs ASGI serving benchmark.
+
+Drives the project's WSGI and ASGI applications in-process with
+``--concurrency`` clients that each send their next request as soon as the
+last one is answered, and reports requests per second and p50/p95/p99
+latency for each server and scenario:
+
+* ``directory``: ``/schools/list/json/`` pages (async ORM, page cache);
+* ``gateway``: a view that calls a payment gateway stub answering after
+  ``--latency`` seconds; the WSGI run uses a sync view, the ASGI run
+  awaits ``GatewayClient.aget``.
+
+The WSGI application gets ``--threads`` worker threads, like a threaded
+WSGI server worker; the ASGI application runs on one event loop, like an
+ASGI server worker. No sockets are involved between client and server, so
+the numbers show the cost of the request handling itself. Run from the
+repository root:
+
+    python -m benchmarks.bench_http --requests 2000 --concurrency 64 --threads 8 --output bench_http.json
+
+A temporary database is created and seeded with ``--schools`` schools.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+import django
+from django.http import JsonResponse
+
+from benchmarks.stats import format_ms, percentile, to_ms
+
+SERVERS = ('wsgi', 'asgi')
+SCENARIOS = ('directory', 'gateway')
+HOST = '127.0.0.1'
+
+# Filled in by ``setup_django``; the project's URLs cannot be imported
+# before the settings are adjusted.
+urlpatterns = []
+
+
+def gateway_sync(request):
+    from billing.gateways import get_client
+
+    return JsonResponse(get_client('bench').get('/charges').json())
+
+
+async def gateway_async(request):
+    from billing.gateways import get_client
+
+    response = await get_client('bench').aget('/charges')
+    return JsonResponse(response.json())
+
+
+def setup_django(tmp, gateway_url, concurrency):
+    """Point the project at a scratch database and the gateway stub."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'legacygrid_school_management.settings')
+    from django.conf import settings
+
+    from legacygrid_school_management.db import sqlite_database
+
+    path = os.path.join(tmp, 'bench.sqlite3')
+    settings.DATABASES = {'default': sqlite_database(path), 'replica': sqlite_database(path, read_only=True)}
+    settings.DEBUG = False  # DEBUG keeps every query in memory
+    settings.ROOT_URLCONF = __name__
+    # Enough connections that the pool never limits either server.
+    settings.PAYMENT_GATEWAYS = {'bench': {'api_url': gateway_url, 'max_connections': concurrency,
+                                           'max_idle': concurrency, 'retries': 0}}
+    django.setup()
+
+    from django.urls import include, path as url
+
+    urlpatterns.extend([
+        url('bench/gateway/sync/', gateway_sync),
+        url('bench/gateway/async/', gateway_async),
+        url('', include('legacygrid_school_management.urls')),
+    ])
+
+
+def seed(count):
+    """Create ``count`` schools; returns the directory page URLs."""
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.urls import reverse
+
+    from schools.models import School
+    from schools.pagination import DEFAULT_PAGE_SIZE, keyset_page
+
+    call_command('migrate', verbosity=0)
+    owner = User.objects.create_user('bench-owner')
+    School.objects.bulk_create(
+        [School(name=f'School {i:05d}', owner=owner, address=f'{i} Samora Machel Avenue') for i in range(count)],
+        batch_size=500,
+    )
+    url = reverse('schools:list_json')
+    urls, cursor = [url], None
+    while True:
+        _, cursor = keyset_page(School.objects.only('id', 'name'), cursor, DEFAULT_PAGE_SIZE)
+        if cursor is None:
+            return urls
+        urls.append(f'{url}?cursor={cursor}')
+
+
+def wsgi_request(application, url):
+    """Call the WSGI application for ``GET url``; returns the status code."""
+    path, _, query = url.partition('?')
+    environ = {}
+    setup_testing_defaults(environ)
+    environ.update(REQUEST_METHOD='GET', PATH_INFO=path, QUERY_STRING=query, HTTP_HOST=HOST)
+    status = []
+    body = application(environ, lambda line, headers, exc_info=None: status.append(line))
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return int(status[0].split()[0])
+
+
+async def asgi_request(application, url):
+    """Call the ASGI application for ``GET url``; returns the status code."""
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode('ascii'),
+        'query_string': query.encode('ascii'),
+        'root_path': '',
+        'headers': [(b'host', HOST.encode('ascii'))],
+        'client': (HOST, 50000),
+        'server': (HOST, 80),
+    }
+    received, done = [], asyncio.Event()
+    status = []
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client stays connected until the whole answer is sent.
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        elif message['type'] == 'http.response.body' and not message.get('more_body'):
+            done.set()
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+async def drive(call, urls, concurrency):
+    """Send ``urls`` through ``call`` from ``concurrency`` closed-loop
+    clients. Returns ``(latencies, failures, elapsed)``."""
+    pending = iter(urls)
+    latencies, failures = [], []
+
+    async def client():
+        for url in pending:
+            started = time.perf_counter()
+            try:
+                status = await call(url)
+            except Exception as e:
+                status = e
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                failures.append(status)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, failures, time.perf_counter() - started
+
+
+def run_wsgi(urls, concurrency, threads):
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi') as workers:
+        async def call(url):
+            return await asyncio.get_running_loop().run_in_executor(workers, wsgi_request, application, url)
+
+        return asyncio.run(drive(call, urls, concurrency))
+
+
+def run_asgi(urls, concurrency, threads):
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+    return asyncio.run(drive(lambda url: asgi_request(application, url), urls, concurrency))
+
+
+RUNNERS = {'wsgi': run_wsgi, 'asgi': run_asgi}
+
+
+def scenario_urls(scenario, server, pages, count, rng):
+    if scenario == 'directory':
+        return [rng.choice(pages) for _ in range(count)]
+    view = 'sync' if server == 'wsgi' else 'async'
+    return [f'/bench/gateway/{view}/'] * count
+
+
+def run_one(server, scenario, pages, args):
+    from schools.cache import get_cache
+
+    get_cache().clear()
+    urls = scenario_urls(scenario, server, pages, args.requests, random.Random(args.seed))
+    latencies, failures, elapsed = RUNNERS[server](urls, args.concurrency, args.threads)
+    served = len(urls) - len(failures)
+    return {
+        'server': server,
+        'scenario': scenario,
+        'requests': len(urls),
+        'failed': len(failures),
+        'errors': sorted({str(failure) for failure in failures})[:5],
+        'elapsed_seconds': elapsed,
+        'requests_per_second': served / elapsed if elapsed > 0 else 0.0,
+        'latency_p50_ms': to_ms(percentile(latencies, 0.50)),
+        'latency_p95_ms': to_ms(percentile(latencies, 0.95)),
+        'latency_p99_ms': to_ms(percentile(latencies, 0.99)),
+        'latency_max_ms': to_ms(max(latencies, default=None)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000, help="Requests per server and scenario.")
+    parser.add_argument('--concurrency', type=int, default=64, help="Clients sending requests at once.")
+    parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads.")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the gateway stub takes to answer.")
+    parser.add_argument('--schools', type=int, default=1000)
+    parser.add_argument('--servers', default=','.join(SERVERS), help="Comma-separated servers to run.")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated scenarios to run.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write results as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    from billing.testing import StubGateway
+
+    # Failed requests are counted; their tracebacks would drown the output.
+    logging.disable(logging.ERROR)
+    tmp = tempfile.mkdtemp(prefix='bench-http-')
+    results = []
+    try:
+        with StubGateway(latency=args.latency) as stub:
+            setup_django(tmp, stub.url, args.concurrency)
+            pages = seed(args.schools)
+            for scenario in args.scenarios.split(','):
+                for server in args.servers.split(','):
+                    result = run_one(server.strip(), scenario.strip(), pages, args)
+                    results.append(result)
+                    print(
+                        f"{result['scenario']:>9} {result['server']}: {result['requests_per_second']:8.1f} req/s  "
+                        f"p50 {format_ms(result['latency_p50_ms'], 1)}  p95 {format_ms(result['latency_p95_ms'], 1)}  "
+                        f"p99 {format_ms(result['latency_p99_ms'], 1)}  failed {result['failed']}"
+                    )
+            from billing.gateways import reset_clients
+            from django.db import connections
+
+            reset_clients()
+            connections.close_all()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        'benchmark': 'http',
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'parameters': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'threads': args.threads,
+            'latency': args.latency,
+            'schools': args.schools,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
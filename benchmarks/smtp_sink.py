@@ -0,0 +1,109 @@
+"""
+Minimal in-process SMTP sink for benchmarks.
+
+Speaks just enough SMTP for ``smtplib`` (EHLO/HELO, AUTH PLAIN, MAIL, RCPT,
+DATA, RSET, NOOP, QUIT), accepts every message and throws it away. It does
+not offer STARTTLS, so clients must use ``'starttls': False``.
+
+``latency`` (seconds) is added before answering each end of DATA, and
+``failure_rate`` is the fraction of messages answered with a 451, so slow
+and throttling providers can be simulated without touching the network.
+"""
+
+import random
+import socketserver
+import threading
+import time
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b"\r\n")
+
+    def handle(self):
+        sink = self.server.sink
+        sink._count('connections')
+        self.reply("220 sink ESMTP ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command[:4].upper()
+            if verb == 'EHLO':
+                self.reply("250-sink")
+                self.reply("250-AUTH PLAIN")
+                self.reply("250 8BITMIME")
+            elif verb == 'HELO':
+                self.reply("250 sink")
+            elif verb == 'AUTH':
+                self.reply("235 Authentication successful")
+            elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply("250 OK")
+            elif verb == 'DATA':
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                if sink.latency:
+                    time.sleep(sink.latency)
+                if sink.failure_rate and random.random() < sink.failure_rate:
+                    sink._count('rejected')
+                    self.reply("451 Rate limit exceeded, try again later")
+                else:
+                    sink._count('messages')
+                    self.reply("250 Message accepted")
+            elif verb == 'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class _SinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    """Run with ``with SMTPSink() as sink:``; ``sink.smtp_cfg`` points the
+    email functions at it."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, host='127.0.0.1'):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.counts = {'connections': 0, 'messages': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+        self._server = _SinkServer((host, 0), _SinkHandler)
+        self._server.sink = self
+        self._thread = None
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    @property
+    def smtp_cfg(self):
+        host, port = self._server.server_address
+        return {'server': host, 'port': port, 'user': 'bench', 'password': 'bench', 'starttls': False}
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts = dict.fromkeys(self.counts, 0)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,21 @@
+"""
+Latency figures shared by the benchmarks.
+"""
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values`` (seconds), or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def to_ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def format_ms(milliseconds, digits=2):
+    """``'1.25 ms'``, or ``'n/a'`` when nothing was measured."""
+    return 'n/a' if milliseconds is None else f"{milliseconds:.{digits}f} ms"
@@ -1,3 +1,56 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Invoice, Payment, ReconciliationRun, StatementLine, Subscription, WebhookEvent
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'event_type')
+    search_fields = ('event_id',)
+
+
+@admin.register(Subscription)
+class SubscriptionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'tier', 'status', 'current_period_end', 'updated_at')
+    list_filter = ('tier', 'status')
+    search_fields = ('user__username', 'stripe_customer_id')
+
+
+@admin.register(Payment)
+class PaymentAdmin(admin.ModelAdmin):
+    # Payments are added through billing.rollups.record_payment so the
+    # revenue rollups stay in step; the admin only shows them.
+    list_display = ('occurred_at', 'gateway', 'kind', 'amount', 'currency', 'tier', 'user')
+    list_filter = ('gateway', 'kind', 'currency')
+    search_fields = ('external_id', 'reference')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Invoice)
+class InvoiceAdmin(admin.ModelAdmin):
+    list_display = ('reference', 'school', 'amount', 'currency', 'due_date', 'status', 'paid_via', 'paid_at')
+    list_filter = ('status', 'currency', 'paid_via')
+    search_fields = ('reference', 'payer_name', 'payer_email', 'transaction_id')
+
+    def get_queryset(self, request):
+        return Invoice.all_objects.all()
+
+
+@admin.register(ReconciliationRun)
+class ReconciliationRunAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'gateway', 'source', 'rows', 'matched', 'unmatched', 'ambiguous', 'duplicate', 'invalid')
+    list_filter = ('gateway',)
+
+
+@admin.register(StatementLine)
+class StatementLineAdmin(admin.ModelAdmin):
+    list_display = ('run', 'row', 'transaction_id', 'occurred_at', 'amount', 'currency', 'reference', 'status', 'invoice')
+    list_filter = ('status', 'run__gateway')
+    search_fields = ('transaction_id', 'reference', 'payer')
+    raw_id_fields = ('run', 'invoice')
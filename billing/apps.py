@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class BillingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'billing'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .entitlements import compiled_tiers
+
+        # Compile the tier bitmasks once, at startup.
+        compiled_tiers()
@@ -0,0 +1,260 @@
+"""
+Currency conversion for ``SUPPORTED_CURRENCIES``.
+
+The whole rate table is fetched in one request from a pluggable source
+(``settings.CURRENCY_RATE_SOURCE``) and kept in memory:
+
+* younger than ``ttl``: used as is;
+* up to ``stale_ttl`` past that: still used, while one background thread
+  fetches a fresh table (stale-while-revalidate);
+* older: fetched before answering. If that fails, the last good table is
+  used however old it is. The table is kept in memory and in
+  ``CURRENCY_RATES_STORE``, so a restart without network still converts.
+
+Amounts are ``Decimal`` and converted as ``amount * to_rate / from_rate``
+with 34 significant digits, then rounded half-up to cents.
+``convert_many`` converts a whole list against one table lookup.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal, localcontext
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+DEFAULT_TTL = 15 * 60
+DEFAULT_STALE_TTL = 6 * 60 * 60
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'currency_rates_fixture.json')
+
+RateTable = namedtuple('RateTable', 'base rates fetched_at source')
+
+
+class RatesUnavailable(RuntimeError):
+    pass
+
+
+class UnsupportedCurrency(ValueError):
+    pass
+
+
+def parse_table(data, source):
+    """Build a ``RateTable`` from ``{'base': ..., 'rates': {...}}``."""
+    base = data['base'].upper()
+    rates = {code.upper(): Decimal(str(rate)) for code, rate in data['rates'].items()}
+    rates[base] = Decimal(1)
+    return RateTable(base, rates, float(data.get('fetched_at') or time.time()), source)
+
+
+def to_decimal(amount):
+    # str() first so 0.1 means 0.1, not its binary approximation.
+    return Decimal(str(amount)) if isinstance(amount, float) else Decimal(amount)
+
+
+class HTTPRateSource:
+    """Fetches ``{url}?base=USD&symbols=...`` and expects
+    ``{"base": "USD", "rates": {"ZAR": 18.2, ...}}``."""
+
+    name = 'http'
+
+    def __init__(self, url=None, base=None, symbols=None, api_key=None, timeout=10):
+        self.url = url or settings.CURRENCY_CONVERSION_API_URL
+        self.base = base or settings.DEFAULT_CURRENCY
+        self.symbols = symbols or settings.SUPPORTED_CURRENCIES
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def fetch(self):
+        query = {'base': self.base, 'symbols': ','.join(self.symbols)}
+        if self.api_key:
+            query['access_key'] = self.api_key
+        url = f"{self.url}{'&' if '?' in self.url else '?'}{urllib.parse.urlencode(query)}"
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            data = json.load(response)
+        return parse_table(data, self.name)
+
+
+class FixtureRateSource:
+    """Rates from a dict or a JSON file, for tests and offline development."""
+
+    name = 'fixture'
+
+    def __init__(self, rates=None, base=None, path=None):
+        self.rates = rates
+        self.base = base or settings.DEFAULT_CURRENCY
+        self.path = path or FIXTURE_PATH
+        self.fetches = 0
+
+    def fetch(self):
+        self.fetches += 1
+        if self.rates is not None:
+            data = {'base': self.base, 'rates': self.rates}
+        else:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        return parse_table(data, self.name)
+
+
+def get_source(cfg=None):
+    cfg = dict(cfg if cfg is not None else getattr(settings, 'CURRENCY_RATE_SOURCE', {}))
+    backend = cfg.pop('backend', 'billing.currency.HTTPRateSource')
+    return import_string(backend)(**cfg)
+
+
+class CurrencyConverter:
+    """Converts amounts with a cached rate table from ``source``."""
+
+    def __init__(self, source, ttl=DEFAULT_TTL, stale_ttl=DEFAULT_STALE_TTL, store_path=None,
+                 supported=None, clock=time.time):
+        self.source = source
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.store_path = store_path
+        self.supported = set(supported or settings.SUPPORTED_CURRENCIES)
+        self.clock = clock
+        self._table = None
+        self._lock = threading.Lock()
+        # Serialises blocking fetches so an expired table is fetched once.
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+        self._refresh_thread = None
+
+    def _load_store(self):
+        if not self.store_path:
+            return None
+        try:
+            with open(self.store_path, encoding='utf-8') as f:
+                data = json.load(f)
+            return parse_table(data, data.get('source', 'store'))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not read stored currency rates: %s", e)
+            return None
+
+    def _save_store(self, table):
+        if not self.store_path:
+            return
+        data = {
+            'base': table.base,
+            'rates': {code: str(rate) for code, rate in table.rates.items()},
+            'fetched_at': table.fetched_at,
+            'source': table.source,
+        }
+        tmp = f"{self.store_path}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.store_path)
+        except OSError as e:
+            logger.warning("Could not store currency rates: %s", e)
+
+    def refresh(self):
+        """Fetch a new table now. Raises on failure; the old table is kept."""
+        table = self.source.fetch()._replace(fetched_at=self.clock())
+        with self._lock:
+            self._table = table
+        self._save_store(table)
+        return table
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("Background currency rate refresh failed: %s", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def table(self):
+        """The current rate table, refreshing it as described above."""
+        with self._lock:
+            table = self._table
+        if table is None:
+            table = self._load_store()
+            if table is not None:
+                with self._lock:
+                    self._table = self._table or table
+        age = self.clock() - table.fetched_at if table else None
+
+        if table is not None and age < self.ttl:
+            return table
+        if table is not None and age < self.ttl + self.stale_ttl:
+            with self._lock:
+                start = not self._refreshing
+                self._refreshing = True
+            if start:
+                self._refresh_thread = threading.Thread(target=self._refresh_in_background, daemon=True)
+                self._refresh_thread.start()
+            return table
+        with self._fetch_lock:
+            current = self._table
+            if current is not None and current is not table and self.clock() - current.fetched_at < self.ttl:
+                return current  # another thread fetched it while we waited
+            try:
+                return self.refresh()
+            except Exception as e:
+                if table is None:
+                    raise RatesUnavailable(f"No currency rates available: {e}")
+                logger.warning("Currency rate refresh failed, using rates from %.0fs ago: %s", age, e)
+                return table
+
+    def _rates_for(self, table, currency):
+        currency = currency.upper()
+        if currency not in self.supported:
+            raise UnsupportedCurrency(f"Unsupported currency: {currency}")
+        try:
+            return table.rates[currency]
+        except KeyError:
+            raise RatesUnavailable(f"No rate for {currency}")
+
+    def convert_many(self, amounts, from_currency, to_currency):
+        """Convert each amount (Decimal, int or numeric string) and return a
+        list of ``Decimal`` rounded to cents."""
+        table = self.table()
+        from_rate = self._rates_for(table, from_currency)
+        to_rate = self._rates_for(table, to_currency)
+        with localcontext() as ctx:
+            ctx.prec = 34
+            return [
+                (to_decimal(amount) * to_rate / from_rate).quantize(CENT, rounding=ROUND_HALF_UP)
+                for amount in amounts
+            ]
+
+    def convert(self, amount, from_currency, to_currency):
+        return self.convert_many([amount], from_currency, to_currency)[0]
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_converter():
+    """The process-wide converter configured from settings."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = CurrencyConverter(
+                get_source(),
+                ttl=getattr(settings, 'CURRENCY_RATES_TTL', DEFAULT_TTL),
+                stale_ttl=getattr(settings, 'CURRENCY_RATES_STALE_TTL', DEFAULT_STALE_TTL),
+                store_path=getattr(settings, 'CURRENCY_RATES_STORE', None),
+            )
+        return _default
+
+
+def convert(amount, from_currency, to_currency):
+    return default_converter().convert(amount, from_currency, to_currency)
+
+
+def convert_many(amounts, from_currency, to_currency):
+    return default_converter().convert_many(amounts, from_currency, to_currency)
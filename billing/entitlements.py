@@ -0,0 +1,115 @@
+"""
+Feature entitlements per subscription tier.
+
+``settings.SUBSCRIPTION_TIERS`` is compiled once into a bit per feature and
+an integer mask per tier (a tier with ``ai_access`` also gets the
+``ai_access`` feature). A check is then a dict lookup and a bitwise AND.
+
+A user's tier is read from ``Subscription`` at most once per request, and
+only counts while the subscription is active or trialing: it is kept on
+the user object and cached for ``ENTITLEMENT_CACHE_TIMEOUT``
+seconds. ``billing.signals`` drops the cached tier when a subscription is
+saved or deleted.
+"""
+
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from account.roles import role_required
+
+CompiledTiers = namedtuple('CompiledTiers', 'bits masks default_mask')
+
+# Attribute holding the tier on the request's user object.
+_MEMO_ATTR = '_legacygrid_tier'
+
+_compiled = None
+
+
+def compile_tiers(tiers, default_tier):
+    bits, masks = {}, {}
+    for name, config in tiers.items():
+        features = list(config.get('features', ()))
+        if config.get('ai_access'):
+            features.append('ai_access')
+        mask = 0
+        for feature in features:
+            if feature not in bits:
+                bits[feature] = 1 << len(bits)
+            mask |= bits[feature]
+        masks[name] = mask
+    bits.setdefault('ai_access', 1 << len(bits))
+    return CompiledTiers(bits, masks, masks.get(default_tier, 0))
+
+
+def compiled_tiers():
+    global _compiled
+    if _compiled is None:
+        _compiled = compile_tiers(settings.SUBSCRIPTION_TIERS, settings.DEFAULT_TIER)
+    return _compiled
+
+
+def recompile():
+    """Rebuild the masks, e.g. after the tier settings changed."""
+    global _compiled
+    _compiled = None
+    return compiled_tiers()
+
+
+def feature_bit(feature):
+    try:
+        return compiled_tiers().bits[feature]
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown feature {feature!r}; add it to SUBSCRIPTION_TIERS")
+
+
+def tier_key(user_id):
+    return f'billing:tier:{user_id}'
+
+
+def get_tier(user):
+    """The user's tier name (``DEFAULT_TIER`` without an active
+    subscription)."""
+    if not getattr(user, 'is_authenticated', False):
+        return settings.DEFAULT_TIER
+    tier = getattr(user, _MEMO_ATTR, None)
+    if tier is not None:
+        return tier
+    key = tier_key(user.pk)
+    tier = cache.get(key)
+    if tier is None:
+        from .models import Subscription
+
+        tier = (
+            Subscription.objects.filter(user_id=user.pk, status__in=Subscription.ENTITLED_STATUSES)
+            .values_list('tier', flat=True)
+            .first()
+        )
+        tier = tier or settings.DEFAULT_TIER
+        cache.set(key, tier, getattr(settings, 'ENTITLEMENT_CACHE_TIMEOUT', 300))
+    setattr(user, _MEMO_ATTR, tier)
+    return tier
+
+
+def forget_tier(user_id, user=None):
+    cache.delete(tier_key(user_id))
+    if user is not None:
+        user.__dict__.pop(_MEMO_ATTR, None)
+
+
+def feature_mask(user):
+    compiled = compiled_tiers()
+    return compiled.masks.get(get_tier(user), compiled.default_mask)
+
+
+def has_feature(user, feature):
+    return bool(feature_mask(user) & feature_bit(feature))
+
+
+def requires_feature(feature, redirect_to='billing:subscription_management'):
+    """Decorator: the view needs a login and a tier that includes
+    ``feature``; other users are sent to ``redirect_to`` to upgrade."""
+    feature_bit(feature)  # fail at import time on a typo
+    return role_required(lambda user: has_feature(user, feature), redirect_to)
@@ -0,0 +1,420 @@
+"""
+HTTP clients for the payment gateways in ``settings.PAYMENT_GATEWAYS``.
+
+Each gateway gets one ``GatewayClient`` per process (``get_client``) with:
+
+* a pool of keep-alive connections to its ``api_url``, so consecutive calls
+  skip the TCP and TLS handshakes (see ``smtp_pool`` for the same idea);
+* a timeout on every call (``timeout``, seconds);
+* retries with full jitter for calls that are safe to repeat: GET, HEAD,
+  PUT, DELETE, and POSTs sent with an idempotency key. Connection errors,
+  timeouts, 429 and 5xx answers are retried; other 4xx answers are not;
+* a circuit breaker: after ``failure_threshold`` failed calls in a row the
+  gateway is not called for ``reset_timeout`` seconds and calls fail at
+  once with ``GatewayUnavailable``, instead of tying up request workers on
+  timeouts. One trial call is then let through;
+* latency histograms and error counts, readable with ``gateway_stats()``;
+* awaitable calls for async views (``arequest``, ``aget``, ``apost``). They
+  run on threads of the client's own, one per pooled connection, so waiting
+  on a gateway neither blocks the event loop nor queues behind other work
+  in the loop's default executor.
+
+Per-gateway settings override ``PAYMENT_GATEWAY_CLIENT``:
+
+    PAYMENT_GATEWAYS = {'ecocash': {'api_url': ..., 'timeout': 20, 'retries': 3}}
+"""
+
+import asyncio
+import base64
+import http.client
+import json
+import random
+import socket
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+
+from email_metrics import LatencyHistogram
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+DEFAULTS = {
+    'timeout': 10,
+    'connect_timeout': 5,
+    'retries': 2,
+    'backoff': 0.2,
+    'max_backoff': 5,
+    'max_connections': 8,
+    'max_idle': 4,
+    'idle_timeout': 60,
+    'failure_threshold': 5,
+    'reset_timeout': 30,
+}
+
+
+class GatewayError(Exception):
+    """A gateway call failed."""
+
+
+class GatewayUnavailable(GatewayError):
+    """The circuit is open; the gateway was not called."""
+
+
+class GatewayHTTPError(GatewayError):
+
+    def __init__(self, gateway, response):
+        super().__init__(f"{gateway} answered {response.status}")
+        self.response = response
+
+
+class GatewayResponse:
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+    def json(self):
+        return json.loads(self.body or b'null')
+
+
+class ConnectionPool:
+    """Keep-alive connections to one host, at most ``max_connections``
+    lent out at a time."""
+
+    def __init__(self, scheme, host, port, max_connections, max_idle, idle_timeout, connect_timeout):
+        self.connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        self.host, self.port = host, port
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._idle = []
+        self.connections_opened = 0
+
+    def _checkout(self):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, released_at = self._idle.pop()
+            if now - released_at <= self.idle_timeout:
+                return connection, True
+            connection.close()
+        with self._lock:
+            self.connections_opened += 1
+        return self.connection_class(self.host, self.port, timeout=self.connect_timeout), False
+
+    @contextmanager
+    def connection(self, timeout):
+        """Borrow a connection. ``reused`` tells whether it was idle in the
+        pool, in which case the server may have closed it meanwhile."""
+        if not self._slots.acquire(timeout=timeout):
+            raise GatewayError("No free connection")
+        connection, reused = None, False
+        try:
+            connection, reused = self._checkout()
+            yield connection, reused
+        except BaseException:
+            if connection is not None:
+                connection.close()
+            raise
+        else:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append((connection, time.monotonic()))
+                    connection = None
+            if connection is not None:
+                connection.close()
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            connection.close()
+
+
+class CircuitBreaker:
+    """closed -> open after ``failure_threshold`` consecutive failures;
+    open -> half-open after ``reset_timeout`` seconds, letting one trial
+    call through; its outcome closes or re-opens the circuit."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def release(self):
+        """Forget an allowed call that ended without reaching the gateway,
+        so a half-open circuit lets the next trial call through."""
+        with self._lock:
+            self._trial = False
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._trial = False
+
+
+class GatewayMetrics:
+    """Call latency and outcomes for one gateway."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = LatencyHistogram()
+        self.calls = self.errors = self.retries = self.rejected = 0
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self.latency.record(seconds * 1000)
+            self.calls += 1
+            if not ok:
+                self.errors += 1
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(
+                self.latency.summary(),
+                calls=self.calls,
+                errors=self.errors,
+                error_rate=self.errors / self.calls if self.calls else 0.0,
+                retries=self.retries,
+                rejected=self.rejected,
+            )
+
+
+def auth_headers(cfg):
+    if cfg.get('api_key'):
+        return {'Authorization': f"Bearer {cfg['api_key']}"}
+    if cfg.get('client_id'):
+        token = base64.b64encode(f"{cfg['client_id']}:{cfg.get('client_secret', '')}".encode()).decode()
+        return {'Authorization': f"Basic {token}"}
+    if cfg.get('merchant_code'):
+        return {'X-Merchant-Code': cfg['merchant_code']}
+    return {}
+
+
+class GatewayClient:
+
+    def __init__(self, name, cfg, clock=time.monotonic, sleep=time.sleep):
+        self.name = name
+        self.cfg = {**DEFAULTS, **getattr(settings, 'PAYMENT_GATEWAY_CLIENT', {}), **cfg}
+        url = urllib.parse.urlsplit(self.cfg['api_url'])
+        self.base_path = url.path.rstrip('/')
+        self.pool = ConnectionPool(
+            url.scheme, url.hostname, url.port,
+            self.cfg['max_connections'], self.cfg['max_idle'], self.cfg['idle_timeout'], self.cfg['connect_timeout'],
+        )
+        self.breaker = CircuitBreaker(self.cfg['failure_threshold'], self.cfg['reset_timeout'], clock)
+        self.metrics = GatewayMetrics()
+        self.sleep = sleep
+        self.headers = dict(auth_headers(self.cfg), Accept='application/json')
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.cfg['max_backoff'], self.cfg['backoff'] * 2 ** attempt))
+
+    def _connect(self, connection, timeout):
+        """Connect within ``connect_timeout``, then wait up to ``timeout``
+        for each read of the answer."""
+        if connection.sock is None:
+            connection.timeout = self.cfg['connect_timeout']
+            connection.connect()
+        connection.timeout = timeout
+        connection.sock.settimeout(timeout)
+
+    def _send(self, method, path, body, headers, timeout):
+        with self.pool.connection(timeout) as (connection, reused):
+            try:
+                self._connect(connection, timeout)
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # The server closed the idle connection; reconnect once.
+                connection.close()
+                self._connect(connection, timeout)
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+            data = response.read()
+            if response.will_close:
+                connection.close()
+            return GatewayResponse(response.status, dict(response.getheaders()), data)
+
+    def request(self, method, path, data=None, headers=None, idempotency_key=None, timeout=None):
+        """Call the gateway and return a ``GatewayResponse`` with a 2xx
+        status. Raises ``GatewayHTTPError`` for other answers,
+        ``GatewayUnavailable`` while the circuit is open and ``GatewayError``
+        when the gateway cannot be reached."""
+        method = method.upper()
+        timeout = timeout or self.cfg['timeout']
+        headers = dict(self.headers, **(headers or {}))
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        retries = self.cfg['retries'] if method in IDEMPOTENT_METHODS or idempotency_key else 0
+        path = f"{self.base_path}/{path.lstrip('/')}"
+
+        for attempt in range(retries + 1):
+            if not self.breaker.allow():
+                self.metrics.count('rejected')
+                raise GatewayUnavailable(f"{self.name} is unavailable (circuit open)")
+            started = time.perf_counter()
+            settled = False
+            try:
+                try:
+                    response = self._send(method, path, body, headers, timeout)
+                except (OSError, http.client.HTTPException) as e:
+                    error, response = GatewayError(f"{self.name}: {type(e).__name__}: {e}"), None
+                    if isinstance(e, socket.timeout):
+                        error = GatewayError(f"{self.name} timed out after {timeout}s")
+                else:
+                    error = None if response.ok else GatewayHTTPError(self.name, response)
+                gateway_fault = error is not None and (response is None or response.status in RETRY_STATUSES)
+                self.metrics.record(time.perf_counter() - started, error is None)
+                if gateway_fault:
+                    self.breaker.record_failure()
+                else:
+                    # A 4xx is the caller's problem; the gateway itself is up.
+                    self.breaker.record_success()
+                settled = True
+            finally:
+                if not settled:
+                    # The call never reached the gateway (e.g. no free pooled
+                    # connection); its outcome says nothing about the gateway.
+                    self.breaker.release()
+            if error is None:
+                return response
+            if not gateway_fault or attempt == retries:
+                raise error
+            self.metrics.count('retries')
+            self.sleep(self.backoff(attempt))
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, data=None, **kwargs):
+        return self.request('POST', path, data, **kwargs)
+
+    def executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.cfg['max_connections'], thread_name_prefix=f'gateway-{self.name}'
+                )
+            return self._executor
+
+    async def arequest(self, method, path, data=None, **kwargs):
+        """``request`` for async code; same arguments, answers and errors."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor(), partial(self.request, method, path, data, **kwargs))
+
+    async def aget(self, path, **kwargs):
+        return await self.arequest('GET', path, **kwargs)
+
+    async def apost(self, path, data=None, **kwargs):
+        return await self.arequest('POST', path, data, **kwargs)
+
+    def stats(self):
+        return dict(self.metrics.snapshot(), state=self.breaker.state, connections_opened=self.pool.connections_opened)
+
+    def close(self):
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        self.pool.close_all()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(name):
+    """The process-wide client for ``settings.PAYMENT_GATEWAYS[name]``."""
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            try:
+                cfg = settings.PAYMENT_GATEWAYS[name]
+            except KeyError:
+                raise GatewayError(f"Unknown payment gateway {name!r}")
+            client = _clients[name] = GatewayClient(name, cfg)
+        return client
+
+
+def reset_clients():
+    """Close and forget all clients, e.g. after the gateway settings changed."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+def gateway_stats():
+    """``{gateway: stats}`` for the clients used in this process."""
+    with _clients_lock:
+        clients = list(_clients.values())
+    return {client.name: client.stats() for client in clients}
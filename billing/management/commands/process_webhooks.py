@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from billing.webhooks import inbox_stats, process_webhooks
+
+
+class Command(BaseCommand):
+    help = "Apply received Stripe webhook events from the inbox in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Events claimed per batch.")
+        parser.add_argument('--once', action='store_true', help="Apply pending events and exit.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to sleep when the inbox is empty.")
+        parser.add_argument('--stats', action='store_true', help="Print inbox depth and lag, then exit.")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            for key, value in inbox_stats().items():
+                self.stdout.write(f"{key}: {value}")
+            return
+
+        try:
+            while True:
+                processed, failed = process_webhooks(options['batch_size'])
+                if processed or failed:
+                    self.stdout.write(f"Processed {processed}, failed {failed}")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.rollups import compare_rollups, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily and monthly revenue rollups from the payments table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help="Compare the stored rollups with a recomputation instead of rebuilding; fails on any difference.",
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            differences = compare_rollups()
+            for model, key, stored, expected in differences:
+                self.stdout.write(f"{model} {key}: stored {stored}, expected {expected}")
+            if differences:
+                raise CommandError(f"{len(differences)} rollup row(s) differ; run without --verify to rebuild.")
+            self.stdout.write("Rollups match the payments table.")
+            return
+
+        for model, rows in rebuild_rollups().items():
+            self.stdout.write(f"{model}: {rows} rows")
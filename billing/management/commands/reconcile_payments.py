@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.reconcile import DEFAULT_BATCH_SIZE, DEFAULT_LATE_DAYS, GATEWAYS, StatementError, reconcile_statement
+from schools.models import School
+
+
+class Command(BaseCommand):
+    help = "Match an EcoCash or OneMoney merchant statement (CSV, optionally .gz) against open invoices."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Statement export.")
+        parser.add_argument('--gateway', choices=GATEWAYS, required=True)
+        parser.add_argument('--currency', default=None, help="Currency of rows without one (default: DEFAULT_CURRENCY).")
+        parser.add_argument('--school', type=int, default=None, help="Only match invoices of this school id.")
+        parser.add_argument('--late-days', type=int, default=DEFAULT_LATE_DAYS,
+                            help="Days after the due date a payment may still match by amount.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Rows written per transaction.")
+
+    def handle(self, *args, **options):
+        school = None
+        if options['school'] is not None:
+            school = School.objects.filter(pk=options['school']).first()
+            if school is None:
+                raise CommandError(f"No school with id {options['school']}")
+
+        def on_progress(run, rate):
+            self.stdout.write(f"{run.rows} rows, {run.matched} matched ({rate:.0f} rows/s)")
+
+        try:
+            result = reconcile_statement(
+                options['path'],
+                options['gateway'],
+                batch_size=max(1, options['batch_size']),
+                late_days=options['late_days'],
+                school=school,
+                currency=options['currency'],
+                on_progress=on_progress,
+            )
+        except (OSError, StatementError) as e:
+            raise CommandError(str(e))
+
+        run = result.run
+        self.stdout.write(self.style.SUCCESS(
+            f"Run {run.pk}: {run.rows} rows in {result.elapsed:.2f}s - {run.matched} matched, "
+            f"{run.unmatched} unmatched, {run.ambiguous} ambiguous, {run.duplicate} duplicate, {run.invalid} invalid"
+        ))
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gateway', models.CharField(max_length=32)),
+                ('external_id', models.CharField(max_length=255)),
+                ('kind', models.CharField(choices=[('payment', 'Payment'), ('refund', 'Refund')], default='payment', max_length=16)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('currency', models.CharField(max_length=3)),
+                ('tier', models.CharField(blank=True, max_length=32)),
+                ('reference', models.CharField(blank=True, max_length=255)),
+                ('occurred_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RevenueDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('tier', models.CharField(blank=True, max_length=32)),
+                ('gateway', models.CharField(max_length=32)),
+                ('payments', models.PositiveIntegerField(default=0)),
+                ('refunds', models.PositiveIntegerField(default=0)),
+                ('gross', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('refunded', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('day', models.DateField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RevenueMonthly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('tier', models.CharField(blank=True, max_length=32)),
+                ('gateway', models.CharField(max_length=32)),
+                ('payments', models.PositiveIntegerField(default=0)),
+                ('refunds', models.PositiveIntegerField(default=0)),
+                ('gross', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('refunded', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('month', models.DateField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['status', 'tier'], name='billing_sub_status_ad79fd_idx'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='revenuedaily',
+            constraint=models.UniqueConstraint(fields=('day', 'currency', 'tier', 'gateway'), name='revenue_daily_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='revenuemonthly',
+            constraint=models.UniqueConstraint(fields=('month', 'currency', 'tier', 'gateway'), name='revenue_monthly_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='payment',
+            constraint=models.UniqueConstraint(fields=('gateway', 'external_id'), name='payment_gateway_external_id'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:14
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0002_payments_and_revenue_rollups'),
+        ('schools', '0006_school_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gateway', models.CharField(max_length=32)),
+                ('source', models.CharField(max_length=500)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('matched', models.PositiveIntegerField(default=0)),
+                ('unmatched', models.PositiveIntegerField(default=0)),
+                ('ambiguous', models.PositiveIntegerField(default=0)),
+                ('duplicate', models.PositiveIntegerField(default=0)),
+                ('invalid', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Invoice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference', models.CharField(max_length=64, unique=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('currency', models.CharField(default='USD', max_length=3)),
+                ('payer_name', models.CharField(blank=True, max_length=200)),
+                ('payer_email', models.EmailField(blank=True, max_length=254)),
+                ('issued_on', models.DateField(default=datetime.date.today)),
+                ('due_date', models.DateField()),
+                ('status', models.CharField(choices=[('open', 'Open'), ('paid', 'Paid'), ('void', 'Void')], default='open', max_length=16)),
+                ('paid_at', models.DateTimeField(blank=True, null=True)),
+                ('paid_via', models.CharField(blank=True, max_length=32)),
+                ('transaction_id', models.CharField(blank=True, max_length=255)),
+                ('school', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invoices', to='schools.school')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StatementLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.PositiveIntegerField()),
+                ('transaction_id', models.CharField(blank=True, max_length=255)),
+                ('occurred_at', models.DateTimeField(blank=True, null=True)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('currency', models.CharField(blank=True, max_length=3)),
+                ('reference', models.CharField(blank=True, max_length=255)),
+                ('payer', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('matched', 'Matched'), ('unmatched', 'Unmatched'), ('ambiguous', 'Ambiguous'), ('duplicate', 'Duplicate'), ('invalid', 'Invalid')], max_length=16)),
+                ('candidates', models.PositiveIntegerField(default=0)),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='billing.invoice')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='billing.reconciliationrun')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'school'], name='billing_inv_status_309dbd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='statementline',
+            index=models.Index(fields=['run', 'status'], name='billing_sta_run_id_6f1b6e_idx'),
+        ),
+    ]
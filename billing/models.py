@@ -1,3 +1,237 @@
+import datetime
+
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+from schools.tenancy import TenantScopedManager
+
+
+class WebhookEvent(models.Model):
+    """A payment provider event, stored as received and applied later by
+    ``manage.py process_webhooks``."""
+
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (PROCESSED, 'Processed'),
+        (FAILED, 'Failed'),
+    ]
+
+    # The provider's event id; a redelivered event is dropped on insert.
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=128)
+    payload = models.TextField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # See notifications.OutboxEmail: an expired claim means the worker died.
+    # On a pending event that failed, the earliest time to retry it.
+    claim_token = models.CharField(max_length=32, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} ({self.status})"
+
+
+class Subscription(models.Model):
+    """A user's subscription tier (see ``settings.SUBSCRIPTION_TIERS``)."""
+
+    # Stripe statuses under which the tier's features are granted.
+    ACTIVE = 'active'
+    TRIALING = 'trialing'
+    ENTITLED_STATUSES = (ACTIVE, TRIALING)
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='subscription')
+    tier = models.CharField(max_length=32, default=settings.DEFAULT_TIER)
+    status = models.CharField(max_length=32, blank=True)
+    stripe_customer_id = models.CharField(max_length=255, blank=True, db_index=True)
+    stripe_subscription_id = models.CharField(max_length=255, blank=True)
+    current_period_end = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Active subscriptions per tier on the billing dashboard.
+            models.Index(fields=['status', 'tier']),
+        ]
+
+    def __str__(self):
+        return f"{self.user} ({self.tier})"
+
+
+class Payment(models.Model):
+    """A settled payment or refund from any gateway. Rows are append-only;
+    ``billing.rollups`` keeps the revenue summaries in step as they are added."""
+
+    PAYMENT = 'payment'
+    REFUND = 'refund'
+    KIND_CHOICES = [
+        (PAYMENT, 'Payment'),
+        (REFUND, 'Refund'),
+    ]
+
+    gateway = models.CharField(max_length=32)
+    # The gateway's id for the transaction; recording it twice is a no-op.
+    external_id = models.CharField(max_length=255)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES, default=PAYMENT)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    currency = models.CharField(max_length=3)
+    tier = models.CharField(max_length=32, blank=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    reference = models.CharField(max_length=255, blank=True)
+    occurred_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['gateway', 'external_id'], name='payment_gateway_external_id'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.amount} {self.currency} via {self.gateway}"
+
+
+class RevenueRollup(models.Model):
+    """Payment totals for one period and (currency, tier, gateway)."""
+
+    currency = models.CharField(max_length=3)
+    tier = models.CharField(max_length=32, blank=True)
+    gateway = models.CharField(max_length=32)
+    payments = models.PositiveIntegerField(default=0)
+    refunds = models.PositiveIntegerField(default=0)
+    gross = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    refunded = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def net(self):
+        return self.gross - self.refunded
+
+
+class RevenueDaily(RevenueRollup):
+    day = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'currency', 'tier', 'gateway'], name='revenue_daily_key'),
+        ]
+
+
+class RevenueMonthly(RevenueRollup):
+    # First day of the month.
+    month = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'currency', 'tier', 'gateway'], name='revenue_monthly_key'),
+        ]
+
+
+class Invoice(models.Model):
+    """A school fee invoice, paid through a mobile money statement matched
+    by ``billing.reconcile``."""
+
+    OPEN = 'open'
+    PAID = 'paid'
+    VOID = 'void'
+    STATUS_CHOICES = [
+        (OPEN, 'Open'),
+        (PAID, 'Paid'),
+        (VOID, 'Void'),
+    ]
+
+    school = models.ForeignKey('schools.School', on_delete=models.CASCADE, related_name='invoices')
+    # What the payer types as the payment reference, e.g. "INV-1042".
+    reference = models.CharField(max_length=64, unique=True)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    currency = models.CharField(max_length=3, default=settings.DEFAULT_CURRENCY)
+    payer_name = models.CharField(max_length=200, blank=True)
+    payer_email = models.EmailField(blank=True)
+    issued_on = models.DateField(default=datetime.date.today)
+    due_date = models.DateField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=OPEN)
+    paid_at = models.DateTimeField(null=True, blank=True)
+    # Gateway and transaction id of the statement line that paid it.
+    paid_via = models.CharField(max_length=32, blank=True)
+    transaction_id = models.CharField(max_length=255, blank=True)
+
+    objects = TenantScopedManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'school']),
+        ]
+
+    def __str__(self):
+        return f"{self.reference} ({self.amount} {self.currency}, {self.status})"
+
+
+class ReconciliationRun(models.Model):
+    """One statement file run through ``manage.py reconcile_payments``."""
+
+    gateway = models.CharField(max_length=32)
+    source = models.CharField(max_length=500)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    rows = models.PositiveIntegerField(default=0)
+    matched = models.PositiveIntegerField(default=0)
+    unmatched = models.PositiveIntegerField(default=0)
+    ambiguous = models.PositiveIntegerField(default=0)
+    duplicate = models.PositiveIntegerField(default=0)
+    invalid = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.gateway} {self.source} ({self.matched}/{self.rows} matched)"
+
+
+class StatementLine(models.Model):
+    """A credit from a statement and what it was matched to."""
+
+    MATCHED = 'matched'
+    UNMATCHED = 'unmatched'
+    AMBIGUOUS = 'ambiguous'
+    DUPLICATE = 'duplicate'
+    INVALID = 'invalid'
+    STATUS_CHOICES = [
+        (MATCHED, 'Matched'),
+        (UNMATCHED, 'Unmatched'),
+        (AMBIGUOUS, 'Ambiguous'),
+        (DUPLICATE, 'Duplicate'),
+        (INVALID, 'Invalid'),
+    ]
+
+    run = models.ForeignKey(ReconciliationRun, on_delete=models.CASCADE, related_name='lines')
+    row = models.PositiveIntegerField()
+    transaction_id = models.CharField(max_length=255, blank=True)
+    occurred_at = models.DateTimeField(null=True, blank=True)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    currency = models.CharField(max_length=3, blank=True)
+    reference = models.CharField(max_length=255, blank=True)
+    payer = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES)
+    invoice = models.ForeignKey(Invoice, null=True, blank=True, on_delete=models.SET_NULL)
+    # Open invoices that fit an ambiguous line.
+    candidates = models.PositiveIntegerField(default=0)
+    note = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_id or self.row} ({self.status})"
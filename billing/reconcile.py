@@ -0,0 +1,338 @@
+"""
+Reconciliation of EcoCash and OneMoney merchant statements.
+
+A statement (CSV, optionally ``.gz``) is read one row at a time and matched
+against open invoices held in two hash indexes built once per run:
+
+* by reference: the row's reference, without spaces and in upper case,
+  names an invoice and the amount and currency agree. A reference to an
+  invoice that is not open (already paid, void, or another school's when
+  reconciling one school) leaves the row unmatched;
+* by amount: if the reference names no invoice at all, the open invoices with the row's currency and
+  amount whose ``issued_on`` .. ``due_date + late_days`` window contains
+  the payment date. One such invoice is a match; several make the row
+  ambiguous.
+
+Rows are handled in batches, each in one transaction: statement lines are
+written with ``bulk_create``, matched invoices are marked paid with one
+``UPDATE``, payments go to ``billing.rollups.record_payments`` and
+receipts to the email outbox. Memory use depends on the batch size and the
+number of open invoices, not on the statement. A transaction id already
+recorded as a payment (a statement run twice, or overlapping exports) is
+reported as a duplicate and not paid again.
+"""
+
+import csv
+import datetime
+import time
+from collections import defaultdict, namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Replace, Upper
+from django.utils import timezone
+
+from notifications.outbox import enqueue_emails
+from schools.importer import open_text
+
+from .models import Invoice, Payment, ReconciliationRun, StatementLine
+from .rollups import record_payments, recorded_ids
+
+GATEWAYS = ('ecocash', 'onemoney')
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_LATE_DAYS = 30
+
+# Header names seen in each field's column, compared in lower case.
+COLUMNS = {
+    'transaction_id': ('transaction id', 'transaction_id', 'txn id', 'receipt no', 'receipt number', 'transaction reference'),
+    'occurred_at': ('date', 'transaction date', 'completion time', 'date time', 'timestamp'),
+    'amount': ('amount', 'credit', 'credit amount', 'paid in'),
+    'currency': ('currency',),
+    'reference': ('reference', 'bill reference', 'account', 'account reference', 'narrative', 'details'),
+    'payer': ('sender', 'sender name', 'from', 'payer', 'customer', 'msisdn'),
+}
+REQUIRED_COLUMNS = ('transaction_id', 'occurred_at', 'amount', 'reference')
+DATE_FORMATS = ('%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y', '%d-%m-%Y %H:%M:%S', '%d-%m-%Y', '%d %b %Y %H:%M')
+
+ReconcileResult = namedtuple('ReconcileResult', 'run elapsed')
+
+
+class StatementError(ValueError):
+    pass
+
+
+class RowError(ValueError):
+    pass
+
+
+def column_map(header):
+    """Map each field to its column index in ``header``."""
+    positions = {name.strip().lower(): index for index, name in enumerate(header)}
+    found = {}
+    for field, names in COLUMNS.items():
+        for name in names:
+            if name in positions:
+                found[field] = positions[name]
+                break
+    missing = [field for field in REQUIRED_COLUMNS if field not in found]
+    if missing:
+        raise StatementError(f"Statement has no {', '.join(missing)} column")
+    return found
+
+
+def normalise_reference(value):
+    return ''.join(value.split()).upper()
+
+
+class DateParser:
+    """Parses the dates of one statement; naive values are in ``tz``. A
+    statement uses one format throughout, so the last one that worked is
+    tried first."""
+
+    def __init__(self, tz):
+        self.tz = tz
+        self.last_format = DATE_FORMATS[0]
+
+    def __call__(self, value):
+        value = value.strip()
+        try:
+            when = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            for fmt in (self.last_format, *DATE_FORMATS):
+                try:
+                    when = datetime.datetime.strptime(value, fmt)
+                except ValueError:
+                    continue
+                self.last_format = fmt
+                break
+            else:
+                raise RowError(f"Unrecognised date {value!r}")
+        return when.replace(tzinfo=self.tz) if when.tzinfo is None else when
+
+
+def parse_amount(value):
+    try:
+        amount = Decimal(value.replace(',', '').strip())
+    except InvalidOperation:
+        raise RowError(f"Unrecognised amount {value!r}")
+    if not amount.is_finite():
+        raise RowError(f"Unrecognised amount {value!r}")
+    return amount.quantize(Decimal('0.01'))
+
+
+def read_statement(path):
+    """Yield ``(row_number, values)`` for each data row, with ``values`` a
+    dict of the ``COLUMNS`` fields as strings."""
+    with open_text(path) as stream:
+        reader = csv.reader(stream)
+        try:
+            columns = column_map(next(reader))
+        except StopIteration:
+            return
+        items = list(columns.items())
+        for number, row in enumerate(reader, 1):
+            if not any(row):
+                continue
+            yield number, {field: row[index] if index < len(row) else '' for field, index in items}
+
+
+class InvoiceIndex:
+    """Open invoices by normalised reference and by (currency, amount)."""
+
+    def __init__(self, invoices, late_days=DEFAULT_LATE_DAYS, tz=None):
+        self.late = datetime.timedelta(days=late_days)
+        self.tz = tz or timezone.get_default_timezone()
+        self.by_reference = {}
+        self.by_amount = defaultdict(list)
+        self.paid = set()
+        # Invoices outside the index named by the batch in progress.
+        self.others = {}
+        for invoice in invoices:
+            self.by_reference[normalise_reference(invoice.reference)] = invoice
+            self.by_amount[(invoice.currency, invoice.amount)].append(invoice)
+
+    def __len__(self):
+        return len(self.by_reference) - len(self.paid)
+
+    def load_others(self, references):
+        """Look up the invoices outside the index that ``references`` name,
+        in one query, replacing those of the previous batch."""
+        keys = {normalise_reference(reference) for reference in references if reference}
+        keys.difference_update(self.by_reference)
+        self.others = {}
+        if keys:
+            invoices = (
+                Invoice.all_objects
+                .annotate(key=Upper(Replace('reference', Value(' '), Value(''))))
+                .filter(key__in=keys)
+                .only('id', 'reference', 'status')
+            )
+            self.others = {invoice.key: invoice for invoice in invoices}
+
+    def match(self, reference, amount, currency, when):
+        """Return ``(status, invoice, candidates, note)`` for one credit."""
+        key = normalise_reference(reference) if reference else None
+        invoice = self.by_reference.get(key)
+        if invoice is not None:
+            if invoice.pk in self.paid:
+                return StatementLine.UNMATCHED, invoice, 0, "Invoice already paid in this statement"
+            if (invoice.amount, invoice.currency) != (amount, currency):
+                return StatementLine.UNMATCHED, invoice, 0, f"Invoice is for {invoice.amount} {invoice.currency}"
+            return StatementLine.MATCHED, invoice, 1, ''
+        invoice = self.others.get(key)
+        if invoice is not None:
+            if invoice.status == Invoice.PAID:
+                note = "Invoice already paid"
+            elif invoice.status == Invoice.VOID:
+                note = "Invoice is void"
+            else:
+                note = "Invoice is not being reconciled"
+            return StatementLine.UNMATCHED, invoice, 0, note
+        day = when.astimezone(self.tz).date()
+        late = self.late
+        candidates = [
+            invoice for invoice in self.by_amount.get((currency, amount), ())
+            if invoice.issued_on <= day <= invoice.due_date + late
+        ]
+        if len(candidates) == 1:
+            return StatementLine.MATCHED, candidates[0], 1, 'Matched by amount and date'
+        if candidates:
+            return StatementLine.AMBIGUOUS, None, len(candidates), ''
+        return StatementLine.UNMATCHED, None, 0, ''
+
+    def claim(self, invoice):
+        self.paid.add(invoice.pk)
+        self.by_amount[(invoice.currency, invoice.amount)].remove(invoice)
+
+
+def open_invoices(school=None):
+    invoices = Invoice.all_objects.filter(status=Invoice.OPEN)
+    if school is not None:
+        invoices = invoices.filter(school=school)
+    return invoices.only('id', 'reference', 'amount', 'currency', 'issued_on', 'due_date', 'payer_name', 'payer_email')
+
+
+def receipt_email(gateway, line, invoice):
+    if not invoice.payer_email:
+        return None
+    return (
+        'billing_receipt',
+        {
+            'user_name': invoice.payer_name or line.payer or invoice.payer_email,
+            'amount': f"{line.amount:.2f} {line.currency}",
+            'date': f"{timezone.localdate(line.occurred_at):%Y-%m-%d}",
+        },
+        invoice.payer_email,
+        f"{gateway}:{line.transaction_id}:receipt",
+    )
+
+
+def mark_paid(run, invoice_ids):
+    """Mark invoices paid from their matched lines, in one UPDATE rather
+    than one per invoice. An invoice is matched at most once per run, but
+    one reopened after an earlier run has that run's matched line too."""
+    line = StatementLine.objects.filter(run=run, invoice=OuterRef('pk'), status=StatementLine.MATCHED)
+    Invoice.all_objects.filter(pk__in=invoice_ids).update(
+        status=Invoice.PAID,
+        paid_via=run.gateway,
+        paid_at=Subquery(line.values('occurred_at')[:1]),
+        transaction_id=Subquery(line.values('transaction_id')[:1]),
+    )
+
+
+def reconcile_statement(path, gateway, batch_size=DEFAULT_BATCH_SIZE, late_days=DEFAULT_LATE_DAYS, school=None,
+                        currency=None, on_progress=None):
+    """Match the credits in the statement at ``path`` against open invoices.
+    Returns a ``ReconcileResult`` whose ``run`` holds the counts.
+
+    ``on_progress(run, rows_per_second)`` is called after each batch."""
+    if gateway not in GATEWAYS:
+        raise StatementError(f"Unknown gateway {gateway!r}; expected one of {', '.join(GATEWAYS)}")
+    currency = (currency or settings.DEFAULT_CURRENCY).upper()
+    started = time.perf_counter()
+    tz = timezone.get_default_timezone()
+    index = InvoiceIndex(open_invoices(school).iterator(chunk_size=2000), late_days, tz)
+    run = ReconciliationRun.objects.create(gateway=gateway, source=str(path))
+    counts = defaultdict(int)
+    parse_when = DateParser(tz)
+
+    def flush(rows):
+        seen = recorded_ids(gateway, (values['transaction_id'].strip() for _, values in rows))
+        index.load_others(values['reference'] for _, values in rows)
+        lines, payments, paid, receipts = [], [], [], []
+        for number, values in rows:
+            line = StatementLine(
+                run=run,
+                row=number,
+                transaction_id=values['transaction_id'].strip()[:255],
+                reference=values['reference'].strip()[:255],
+                payer=values.get('payer', '').strip()[:255],
+                currency=(values.get('currency') or currency).strip().upper()[:3],
+            )
+            lines.append(line)
+            try:
+                line.occurred_at = parse_when(values['occurred_at'])
+                line.amount = parse_amount(values['amount'])
+                if not line.transaction_id:
+                    raise RowError("No transaction id")
+            except RowError as e:
+                line.status, line.note = StatementLine.INVALID, str(e)
+                continue
+            if line.amount <= 0:
+                lines.pop()  # debits and reversals are not payments
+                continue
+            if line.transaction_id in seen:
+                line.status, line.note = StatementLine.DUPLICATE, "Transaction already recorded"
+                continue
+            seen.add(line.transaction_id)
+
+            line.status, line.invoice, line.candidates, line.note = index.match(
+                line.reference, line.amount, line.currency, line.occurred_at
+            )
+            if line.status != StatementLine.MATCHED:
+                continue
+            invoice = line.invoice
+            index.claim(invoice)
+            paid.append(invoice.pk)
+            payments.append(Payment(
+                gateway=gateway,
+                external_id=line.transaction_id,
+                amount=line.amount,
+                currency=line.currency,
+                reference=invoice.reference,
+                occurred_at=line.occurred_at,
+            ))
+            receipt = receipt_email(gateway, line, invoice)
+            if receipt:
+                receipts.append(receipt)
+
+        with transaction.atomic():
+            StatementLine.objects.bulk_create(lines, batch_size=1000)
+            if paid:
+                mark_paid(run, paid)
+                record_payments(payments)
+                enqueue_emails(receipts)
+        counts['rows'] += len(lines)
+        for line in lines:
+            counts[line.status] += 1
+        for field, value in counts.items():
+            setattr(run, field, value)
+        run.save(update_fields=list(counts))
+        if on_progress:
+            elapsed = time.perf_counter() - started
+            on_progress(run, run.rows / elapsed if elapsed else 0.0)
+
+    batch = []
+    for number, values in read_statement(path):
+        batch.append((number, values))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    run.finished_at = timezone.now()
+    run.save(update_fields=['finished_at'])
+    return ReconcileResult(run, time.perf_counter() - started)
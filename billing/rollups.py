@@ -0,0 +1,197 @@
+"""
+Revenue rollups for the billing dashboard.
+
+``record_payment`` stores a payment or refund and, in the same transaction,
+adds it to one ``RevenueDaily`` and one ``RevenueMonthly`` row for its
+(currency, tier, gateway) with an in-place ``F()`` update. ``record_payments``
+does the same for a batch, with one update per row touched. Reports read
+the rollups, one row per period and key, and never scan ``Payment``.
+
+``rebuild_rollups`` recomputes both tables from ``Payment``, and
+``compare_rollups`` reports where the stored rollups differ from a
+recomputation (``manage.py rebuild_revenue_rollups``).
+"""
+
+import datetime
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .models import Payment, RevenueDaily, RevenueMonthly, Subscription
+
+ROLLUPS = ((RevenueDaily, 'day'), (RevenueMonthly, 'month'))
+
+
+def period_start(model, moment):
+    day = timezone.localdate(moment)
+    return day if model is RevenueDaily else day.replace(day=1)
+
+
+def _increments(kind, amount):
+    if kind == Payment.REFUND:
+        return {'refunds': 1, 'refunded': amount}
+    return {'payments': 1, 'gross': amount}
+
+
+def _add(model, row, increments):
+    update = {field: F(field) + value for field, value in increments.items()}
+    if not model.objects.filter(**row).update(**update):
+        # First payment for this key and period; a concurrent writer may
+        # create the row first, in which case the update below applies.
+        model.objects.bulk_create([model(**row)], ignore_conflicts=True)
+        model.objects.filter(**row).update(**update)
+
+
+def apply_to_rollups(payments):
+    """Add ``payments`` to their daily and monthly rows, with one update per
+    row touched. Call inside the transaction that created them."""
+    for model, period in ROLLUPS:
+        totals = {}
+        for payment in payments:
+            key = (period_start(model, payment.occurred_at), payment.currency, payment.tier, payment.gateway)
+            total = totals.setdefault(key, {})
+            for field, value in _increments(payment.kind, payment.amount).items():
+                total[field] = total.get(field, 0) + value
+        for (start, currency, tier, gateway), increments in totals.items():
+            _add(model, {period: start, 'currency': currency, 'tier': tier, 'gateway': gateway}, increments)
+
+
+def record_payment(gateway, external_id, amount, currency, occurred_at=None, kind=Payment.PAYMENT,
+                   tier='', user=None, reference=''):
+    """Store a payment and update the rollups. Returns ``(payment, created)``;
+    a second call with the same ``(gateway, external_id)`` changes nothing."""
+    try:
+        with transaction.atomic():
+            payment = Payment.objects.create(
+                gateway=gateway,
+                external_id=external_id,
+                kind=kind,
+                amount=Decimal(amount),
+                currency=currency.upper(),
+                tier=tier or '',
+                user=user,
+                reference=reference,
+                occurred_at=occurred_at or timezone.now(),
+            )
+            apply_to_rollups([payment])
+        return payment, True
+    except IntegrityError:
+        return Payment.objects.get(gateway=gateway, external_id=external_id), False
+
+
+def recorded_ids(gateway, external_ids):
+    """The subset of ``external_ids`` already recorded for ``gateway``."""
+    return set(
+        Payment.objects.filter(gateway=gateway, external_id__in=list(external_ids)).values_list('external_id', flat=True)
+    )
+
+
+def record_payments(payments):
+    """Store unsaved ``Payment`` objects with one insert and update the
+    rollups. Callers drop already recorded ids first (``recorded_ids``)."""
+    with transaction.atomic():
+        Payment.objects.bulk_create(payments, batch_size=1000)
+        apply_to_rollups(payments)
+    return payments
+
+
+def _aggregate(model):
+    trunc = TruncDate if model is RevenueDaily else TruncMonth
+    period = 'day' if model is RevenueDaily else 'month'
+    rows = (
+        Payment.objects.annotate(period=trunc('occurred_at'))
+        .values('period', 'currency', 'tier', 'gateway')
+        .annotate(
+            payments=Count('id', filter=Q(kind=Payment.PAYMENT)),
+            refunds=Count('id', filter=Q(kind=Payment.REFUND)),
+            gross=Sum('amount', filter=Q(kind=Payment.PAYMENT), default=Decimal('0')),
+            refunded=Sum('amount', filter=Q(kind=Payment.REFUND), default=Decimal('0')),
+        )
+        .order_by()
+    )
+    for row in rows:
+        start = row.pop('period')
+        if isinstance(start, datetime.datetime):
+            start = start.date()
+        yield model(**{period: start}, **row)
+
+
+def rebuild_rollups():
+    """Recompute both rollup tables from ``Payment``. Returns the row counts."""
+    counts = {}
+    with transaction.atomic():
+        for model, _ in ROLLUPS:
+            model.objects.all().delete()
+            rows = list(_aggregate(model))
+            model.objects.bulk_create(rows, batch_size=1000)
+            counts[model.__name__] = len(rows)
+    return counts
+
+
+def _row_key(row, period):
+    return getattr(row, period), row.currency, row.tier, row.gateway
+
+
+def _row_values(row):
+    return row.payments, row.refunds, row.gross, row.refunded
+
+
+def compare_rollups():
+    """Differences between the stored rollups and a recomputation, as
+    ``[(model name, key, stored values, expected values)]``."""
+    differences = []
+    for model, period in ROLLUPS:
+        expected = {_row_key(row, period): _row_values(row) for row in _aggregate(model)}
+        stored = {_row_key(row, period): _row_values(row) for row in model.objects.all()}
+        for key in sorted(set(expected) | set(stored), key=str):
+            if expected.get(key) != stored.get(key):
+                differences.append((model.__name__, key, stored.get(key), expected.get(key)))
+    return differences
+
+
+def _totals(rows, key_fields):
+    totals = {}
+    for row in rows:
+        key = tuple(row[field] for field in key_fields)
+        total = totals.setdefault(key, {'payments': 0, 'refunds': 0, 'gross': Decimal('0'), 'refunded': Decimal('0')})
+        for field in ('payments', 'refunds', 'gross', 'refunded'):
+            total[field] += row[field]
+    for total in totals.values():
+        total['net'] = total['gross'] - total['refunded']
+    return totals
+
+
+def revenue_summary(days=30, months=12, today=None):
+    """Revenue for the dashboard from the rollup tables.
+
+    ``daily``/``monthly`` list each period's rows; ``by_currency`` and
+    ``by_gateway`` total the last ``days`` days; ``subscriptions`` counts
+    active subscriptions per tier."""
+    today = today or timezone.localdate()
+    fields = ('currency', 'tier', 'gateway', 'payments', 'refunds', 'gross', 'refunded')
+    daily = list(
+        RevenueDaily.objects.filter(day__gt=today - datetime.timedelta(days=days))
+        .order_by('day', 'currency', 'tier', 'gateway').values('day', *fields)
+    )
+    first_month = today.replace(day=1)
+    for _ in range(months - 1):
+        first_month = (first_month - datetime.timedelta(days=1)).replace(day=1)
+    monthly = list(
+        RevenueMonthly.objects.filter(month__gte=first_month)
+        .order_by('month', 'currency', 'tier', 'gateway').values('month', *fields)
+    )
+    subscriptions = dict(
+        Subscription.objects.filter(status__in=('active', 'trialing'))
+        .values_list('tier').annotate(count=Count('id')).order_by()
+    )
+    return {
+        'days': days,
+        'daily': daily,
+        'monthly': monthly,
+        'by_currency': _totals(daily, ('currency',)),
+        'by_gateway': _totals(daily, ('gateway', 'currency')),
+        'subscriptions': subscriptions,
+    }
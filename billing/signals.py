@@ -0,0 +1,25 @@
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .entitlements import forget_tier, recompile
+from .gateways import reset_clients
+from .models import Subscription
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def subscription_changed(sender, instance, **kwargs):
+    forget_tier(instance.user_id)
+
+
+@receiver(setting_changed)
+def tiers_changed(setting, **kwargs):
+    if setting in ('SUBSCRIPTION_TIERS', 'DEFAULT_TIER'):
+        recompile()
+
+
+@receiver(setting_changed)
+def gateways_changed(setting, **kwargs):
+    if setting in ('PAYMENT_GATEWAYS', 'PAYMENT_GATEWAY_CLIENT'):
+        reset_clients()
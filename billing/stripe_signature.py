@@ -0,0 +1,57 @@
+"""
+Stripe webhook signatures.
+
+Stripe signs ``"{timestamp}.{raw body}"`` with HMAC-SHA256 using the
+endpoint's webhook secret and sends ``Stripe-Signature: t=<timestamp>,
+v1=<hex digest>[,v1=...]``. Verification checks the digest in constant time
+and rejects timestamps outside the tolerance to stop replays.
+"""
+
+import hashlib
+import hmac
+import time
+
+DEFAULT_TOLERANCE = 300
+
+
+class SignatureError(ValueError):
+    pass
+
+
+def compute_signature(payload, secret, timestamp):
+    signed = str(timestamp).encode('ascii') + b'.' + payload
+    return hmac.new(secret.encode('utf-8'), signed, hashlib.sha256).hexdigest()
+
+
+def sign(payload, secret, timestamp=None):
+    """Return a ``Stripe-Signature`` header value for ``payload`` (bytes)."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    return f"t={timestamp},v1={compute_signature(payload, secret, timestamp)}"
+
+
+def parse_header(header):
+    timestamp, signatures = None, []
+    for item in (header or '').split(','):
+        key, _, value = item.strip().partition('=')
+        if key == 't':
+            try:
+                timestamp = int(value)
+            except ValueError:
+                raise SignatureError("Malformed timestamp")
+        elif key == 'v1':
+            signatures.append(value)
+    if timestamp is None or not signatures:
+        raise SignatureError("Missing timestamp or v1 signature")
+    return timestamp, signatures
+
+
+def verify(payload, header, secret, tolerance=DEFAULT_TOLERANCE, now=None):
+    """Raise ``SignatureError`` unless ``header`` is a valid signature of
+    ``payload`` made within ``tolerance`` seconds of ``now``."""
+    timestamp, signatures = parse_header(header)
+    now = time.time() if now is None else now
+    if tolerance and abs(now - timestamp) > tolerance:
+        raise SignatureError("Timestamp outside the tolerance")
+    expected = compute_signature(payload, secret, timestamp)
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        raise SignatureError("No matching signature")
@@ -0,0 +1,19 @@
+from django import template
+
+from billing.entitlements import has_feature as user_has_feature
+
+register = template.Library()
+
+
+@register.filter
+def has_feature(user, feature):
+    """``{% if request.user|has_feature:"ai_reports" %}`` - no queries once
+    the user's tier is known for the request."""
+    return user_has_feature(user, feature)
+
+
+@register.simple_tag(takes_context=True)
+def feature_enabled(context, feature):
+    """``{% feature_enabled "ai_reports" as can_report %}``, for the
+    template's ``user``."""
+    return user_has_feature(context.get('user'), feature)
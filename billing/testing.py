@@ -0,0 +1,199 @@
+"""
+Signed Stripe-style webhook payloads for tests and local runs.
+
+    body, signature = signed_event('invoice.paid', invoice_paid(user))
+    client.post(url, body, content_type='application/json', HTTP_STRIPE_SIGNATURE=signature)
+
+``post_event`` sends one to a running server, e.g. ``manage.py runserver``.
+
+``StubGateway`` is a local HTTP server standing in for a payment gateway:
+
+    with StubGateway(latency=0.2, failure_rate=0.1) as stub:
+        with override_settings(PAYMENT_GATEWAYS={'ecocash': {'api_url': stub.url}}):
+            get_client('ecocash').get('/status')
+"""
+
+import http.server
+import json
+import random
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+
+from django.conf import settings
+
+from .stripe_signature import sign
+
+
+def make_event(event_type, obj, event_id=None, created=None):
+    return {
+        'id': event_id or f"evt_{uuid.uuid4().hex[:24]}",
+        'object': 'event',
+        'type': event_type,
+        'created': int(time.time()) if created is None else created,
+        'data': {'object': obj},
+    }
+
+
+def signed_event(event_type, obj, secret=None, event_id=None, timestamp=None):
+    """Return ``(body bytes, Stripe-Signature header)`` for a new event."""
+    body = json.dumps(make_event(event_type, obj, event_id)).encode('utf-8')
+    return body, sign(body, secret or settings.STRIPE_WEBHOOK_SECRET, timestamp)
+
+
+def checkout_completed(user, amount=1000, currency='usd', mode='subscription', customer='cus_test'):
+    return {
+        'object': 'checkout.session',
+        'client_reference_id': str(user.pk),
+        'customer': customer,
+        'customer_email': user.email,
+        'mode': mode,
+        'payment_status': 'paid',
+        'amount_total': amount,
+        'currency': currency,
+        'subscription': 'sub_test' if mode == 'subscription' else None,
+    }
+
+
+def invoice_paid(user, amount=1000, currency='usd', customer='cus_test', period_end=None):
+    return {
+        'object': 'invoice',
+        'id': f"in_{uuid.uuid4().hex[:24]}",
+        'customer': customer,
+        'customer_email': user.email,
+        'amount_paid': amount,
+        'currency': currency,
+        'subscription': 'sub_test',
+        'metadata': {'user_id': str(user.pk)},
+        'lines': {'data': [{'period': {'end': period_end or int(time.time()) + 30 * 86400}}]},
+    }
+
+
+def subscription_deleted(customer='cus_test'):
+    return {'object': 'subscription', 'id': 'sub_test', 'customer': customer, 'status': 'canceled'}
+
+
+def charge_refunded(amount=1000, currency='usd', customer='cus_test', refund_id=None):
+    return {
+        'object': 'charge',
+        'id': f"ch_{uuid.uuid4().hex[:24]}",
+        'customer': customer,
+        'currency': currency,
+        'amount_refunded': amount,
+        'refunds': {'data': [{'id': refund_id or f"re_{uuid.uuid4().hex[:24]}", 'amount': amount, 'currency': currency}]},
+    }
+
+
+def post_event(url, event_type, obj, secret=None, timeout=10):
+    """POST a signed event to ``url``; returns the HTTP status."""
+    body, signature = signed_event(event_type, obj, secret)
+    request = urllib.request.Request(
+        url, data=body, method='POST',
+        headers={'Content-Type': 'application/json', 'Stripe-Signature': signature},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status
+
+
+class _StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    # Headers and body go out in separate writes; with Nagle's algorithm the
+    # body would wait for the client's delayed ACK (~40 ms).
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.stub._count('connections')
+
+    def _answer(self):
+        stub = self.server.stub
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        stub._record(self.command, self.path, dict(self.headers), body)
+        if stub.latency:
+            time.sleep(stub.latency)
+        status, payload = stub.next_response()
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _answer
+
+
+class _StubServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up before the answer is written.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubGateway:
+    """Answers every request with 200 ``{"ok": true}`` unless ``respond``
+    queued other answers. ``failure_rate`` of answers are 503s; ``latency``
+    seconds are added to each. ``requests`` records what was received."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, host='127.0.0.1'):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.counts = {'connections': 0, 'requests': 0}
+        self.requests = []
+        self._queued = []
+        self._lock = threading.Lock()
+        self._server = _StubServer((host, 0), _StubHandler)
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/"
+
+    def respond(self, *answers):
+        """Queue ``(status, payload)`` answers for the next requests."""
+        with self._lock:
+            self._queued.extend(answers)
+
+    def next_response(self):
+        with self._lock:
+            if self._queued:
+                return self._queued.pop(0)
+        if self.failure_rate and random.random() < self.failure_rate:
+            return 503, {'error': 'unavailable'}
+        return 200, {'ok': True}
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _record(self, method, path, headers, body):
+        with self._lock:
+            self.counts['requests'] += 1
+            self.requests.append((method, path, headers, body))
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
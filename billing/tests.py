@@ -1,3 +1,621 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime as dt
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from legacygrid_school_management import profiling
+from notifications.models import OutboxEmail
+from schools.models import School
+
+from .currency import CurrencyConverter, FixtureRateSource, RatesUnavailable, UnsupportedCurrency
+from .entitlements import compile_tiers, has_feature, requires_feature
+from .gateways import CircuitBreaker, GatewayClient, GatewayError, GatewayHTTPError, GatewayUnavailable, get_client
+from .models import (
+    Invoice, Payment, ReconciliationRun, RevenueDaily, RevenueMonthly, StatementLine, Subscription, WebhookEvent,
+)
+from .rollups import compare_rollups, rebuild_rollups, record_payment, revenue_summary
+from .stripe_signature import SignatureError, sign, verify
+from .testing import StubGateway, charge_refunded, checkout_completed, invoice_paid, signed_event, subscription_deleted
+from .webhooks import claim_batch, inbox_stats, process_batch, process_webhooks
+
+SECRET = 'whsec_test'
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=SECRET, AUTO_ACTIVATE_ON_PAYMENT=True, WEBHOOK_MAX_ATTEMPTS=2)
+class StripeWebhookTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('parent', 'parent@test.com', 'testpass')
+
+    def post(self, body, signature):
+        return self.client.post(
+            reverse('billing:stripe_webhook'), body, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature,
+        )
+
+    def deliver(self, event_type, obj, event_id=None):
+        body, signature = signed_event(event_type, obj, event_id=event_id)
+        response = self.post(body, signature)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(body)['id']
+
+    def test_signature_verification(self):
+        body = b'{"id": "evt_1"}'
+        now = time.time()
+        verify(body, sign(body, SECRET, int(now)), SECRET, now=now)
+        with self.assertRaises(SignatureError):
+            verify(body, sign(body, 'whsec_other', int(now)), SECRET, now=now)
+        with self.assertRaises(SignatureError):
+            verify(body, sign(body, SECRET, int(now) - 600), SECRET, now=now)
+        with self.assertRaises(SignatureError):
+            verify(body, 'garbage', SECRET)
+
+    def test_endpoint_only_stores_the_event(self):
+        body, signature = signed_event('invoice.paid', invoice_paid(self.user))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.post(body, signature).status_code, 200)
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.PENDING)
+        self.assertFalse(Subscription.objects.exists())
+
+        self.assertEqual(self.post(body, 't=1,v1=deadbeef').status_code, 400)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_duplicate_deliveries_apply_once(self):
+        obj = invoice_paid(self.user, amount=2500)
+        self.deliver('invoice.paid', obj, event_id='evt_dup')
+        self.deliver('invoice.paid', obj, event_id='evt_dup')
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+        self.assertEqual(process_webhooks(), (1, 0))
+        self.assertEqual(process_webhooks(), (0, 0))
+
+        subscription = Subscription.objects.get(user=self.user)
+        self.assertEqual((subscription.tier, subscription.status), ('premium', 'active'))
+        receipt = OutboxEmail.objects.get()
+        self.assertEqual((receipt.event_type, receipt.recipient), ('billing_receipt', 'parent@test.com'))
+        self.assertEqual(receipt.payload['amount'], '25.00 USD')
+
+    def test_batch_applies_events_in_order(self):
+        self.deliver('checkout.session.completed', checkout_completed(self.user))
+        self.deliver('customer.subscription.deleted', subscription_deleted())
+        self.deliver('customer.created', {'id': 'cus_test'})
+
+        self.assertEqual(process_webhooks(), (3, 0))
+        subscription = Subscription.objects.get(user=self.user)
+        self.assertEqual((subscription.tier, subscription.status), ('free', 'canceled'))
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_bad_events_fail_after_max_attempts_and_lag_is_reported(self):
+        WebhookEvent.objects.create(event_id='evt_bad', event_type='invoice.paid', payload='not json')
+        self.assertEqual(inbox_stats()['pending'], 1)
+        self.assertIsNotNone(inbox_stats()['oldest_pending_age_seconds'])
+
+        self.assertEqual(process_webhooks(), (0, 1))
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.status, WebhookEvent.PENDING)
+        self.assertGreater(event.claimed_until, timezone.now() + dt.timedelta(seconds=29))
+        # Backing off: the next pass leaves it alone.
+        self.assertEqual(process_webhooks(), (0, 0))
+
+        WebhookEvent.objects.update(claimed_until=timezone.now())
+        self.assertEqual(process_webhooks(), (0, 1))
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), (WebhookEvent.FAILED, 2))
+
+        self.deliver('invoice.paid', invoice_paid(self.user))
+        process_webhooks()
+        stats = inbox_stats()
+        self.assertEqual((stats['processed'], stats['failed'], stats['oldest_pending_age_seconds']), (1, 1, None))
+        self.assertGreaterEqual(stats['lag_max_seconds'], 0)
+
+    def test_event_whose_claim_was_taken_over_is_rolled_back(self):
+        self.deliver('invoice.paid', invoice_paid(self.user))
+        rows = claim_batch()
+        WebhookEvent.objects.update(claim_token='another-worker')
+
+        self.assertEqual(process_batch(rows), (0, 0))
+        self.assertFalse(Subscription.objects.exists())
+        self.assertFalse(OutboxEmail.objects.exists())
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.PROCESSING)
+
+
+class RevenueRollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(settings.BILLING_OWNER_USERNAME, 'owner@test.com', 'testpass')
+
+    def setUp(self):
+        cache.clear()
+
+    def pay(self, external_id, amount, day=1, hour=10, **kwargs):
+        kwargs.setdefault('tier', 'premium')
+        return record_payment(
+            kwargs.pop('gateway', 'stripe'), external_id, Decimal(amount), kwargs.pop('currency', 'usd'),
+            occurred_at=datetime(2026, 3, day, hour, tzinfo=dt_timezone.utc), **kwargs,
+        )
+
+    def test_payments_update_rollups_in_place(self):
+        self.pay('in_1', '10.00')
+        self.pay('in_2', '15.50', day=2)
+        self.pay('in_3', '5.00', gateway='ecocash')
+        self.pay('re_1', '2.50', kind=Payment.REFUND)
+
+        march = RevenueMonthly.objects.get(month='2026-03-01', gateway='stripe')
+        self.assertEqual((march.payments, march.refunds), (2, 1))
+        self.assertEqual((march.gross, march.refunded, march.net), (Decimal('25.50'), Decimal('2.50'), Decimal('23.00')))
+        self.assertEqual(RevenueDaily.objects.filter(gateway='stripe').count(), 2)
+        self.assertEqual(RevenueDaily.objects.get(day='2026-03-01', gateway='stripe').gross, Decimal('10.00'))
+
+        # Savepoint, insert, one update per table and release once the rows exist.
+        with self.assertNumQueries(5):
+            self.pay('in_4', '1.00')
+
+    def test_recording_is_idempotent_and_rebuild_matches(self):
+        self.assertTrue(self.pay('in_1', '10.00')[1])
+        payment, created = self.pay('in_1', '10.00')
+        self.assertFalse(created)
+        self.assertEqual(RevenueDaily.objects.get().payments, 1)
+        self.pay('in_2', '20.00', day=31, hour=23, currency='zar')
+        self.assertEqual(compare_rollups(), [])
+
+        RevenueDaily.objects.update(gross=0)
+        self.assertEqual(len(compare_rollups()), 2)
+        self.assertEqual(rebuild_rollups(), {'RevenueDaily': 2, 'RevenueMonthly': 2})
+        self.assertEqual(compare_rollups(), [])
+
+    @override_settings(STRIPE_WEBHOOK_SECRET=SECRET, AUTO_ACTIVATE_ON_PAYMENT=True)
+    def test_stripe_events_feed_rollups(self):
+        user = User.objects.create_user('parent', 'parent@test.com', 'testpass')
+        for event_type, obj in [
+            ('invoice.paid', invoice_paid(user, amount=2500)),
+            ('checkout.session.completed', checkout_completed(user, amount=700, mode='payment')),
+            ('charge.refunded', charge_refunded(amount=500)),
+        ]:
+            body, signature = signed_event(event_type, obj)
+            self.client.post(reverse('billing:stripe_webhook'), body, content_type='application/json',
+                             HTTP_STRIPE_SIGNATURE=signature)
+        self.assertEqual(process_webhooks(), (3, 0))
+
+        totals = revenue_summary()['by_currency'][('USD',)]
+        self.assertEqual((totals['payments'], totals['refunds']), (2, 1))
+        self.assertEqual(totals['net'], Decimal('27.00'))
+        self.assertEqual(Payment.objects.filter(tier='premium').count(), 3)
+
+    def test_stats_endpoint_reads_rollups(self):
+        today = datetime.now(dt_timezone.utc)
+        record_payment('stripe', 'in_1', Decimal('12.00'), 'usd', tier='premium')
+        record_payment('paynow', 'p_1', Decimal('3.00'), 'usd', occurred_at=today)
+        Subscription.objects.create(user=self.owner, tier='premium', status='active')
+
+        self.assertEqual(self.client.get(reverse('billing:revenue_stats')).status_code, 302)
+        self.client.force_login(self.owner)
+        url = reverse('billing:revenue_stats')
+        with self.assertNumQueries(6):  # session, user, groups, two rollup reads and subscriptions
+            data = self.client.get(url, {'days': 7}).json()
+        self.assertEqual(data['by_currency']['USD']['gross'], '15.00')
+        self.assertEqual(len(data['daily']), 2)
+        self.assertEqual(data['active_subscriptions'], {'premium': 1})
+        self.assertEqual(self.client.get(url, {'days': 'x'}).status_code, 400)
+
+
+class ReconcileTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('head', 'head@test.com', 'testpass')
+        cls.school = School.objects.create(name='Hillside High', owner=owner)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def invoice(self, reference, amount, email='', due=dt.date(2026, 3, 31)):
+        return Invoice.objects.create(
+            school=self.school, reference=reference, amount=Decimal(amount), currency='USD',
+            payer_email=email, payer_name='A Parent', issued_on=dt.date(2026, 3, 1), due_date=due,
+        )
+
+    def statement(self, rows, name='statement.csv'):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Transaction ID', 'Date', 'Amount', 'Reference', 'Sender'])
+            writer.writerows(rows)
+        return path
+
+    def reconcile(self, path, **options):
+        out = io.StringIO()
+        call_command('reconcile_payments', path, gateway='ecocash', batch_size=2, stdout=out, **options)
+        return ReconciliationRun.objects.latest('pk')
+
+    def test_statement_is_matched_by_reference_then_amount_and_date(self):
+        by_reference = self.invoice('INV-1', '50.00', email='parent@test.com')
+        by_amount = self.invoice('INV-2', '75.00')
+        self.invoice('INV-3', '20.00')
+        self.invoice('INV-4', '20.00')
+        path = self.statement([
+            ['MP1', '2026-03-05 09:30:00', '50.00', 'inv 1', 'A Parent'],
+            ['MP2', '06/03/2026 10:00', '75.00', 'school fees', 'B Parent'],
+            ['MP3', '2026-03-07', '20.00', '', 'C Parent'],
+            ['MP4', '2026-03-08', '1,000.00', 'INV-9', 'D Parent'],
+            ['MP5', '2026-03-08', '-5.00', 'charge', ''],
+            ['MP6', 'yesterday', '5.00', 'INV-1', ''],
+            ['MP1', '2026-03-05 09:30:00', '50.00', 'inv 1', 'A Parent'],
+        ])
+        run = self.reconcile(path)
+        self.assertEqual(
+            (run.rows, run.matched, run.ambiguous, run.unmatched, run.invalid, run.duplicate), (6, 2, 1, 1, 1, 1)
+        )
+        self.assertIsNotNone(run.finished_at)
+
+        by_reference.refresh_from_db()
+        by_amount.refresh_from_db()
+        self.assertEqual((by_reference.status, by_reference.transaction_id), (Invoice.PAID, 'MP1'))
+        self.assertEqual((by_amount.status, by_amount.paid_via), (Invoice.PAID, 'ecocash'))
+        self.assertEqual(StatementLine.objects.get(transaction_id='MP3').candidates, 2)
+
+        self.assertEqual(RevenueMonthly.objects.get(gateway='ecocash').gross, Decimal('125.00'))
+        receipt = OutboxEmail.objects.get()
+        self.assertEqual((receipt.recipient, receipt.payload['amount']), ('parent@test.com', '50.00 USD'))
+
+    def test_rerun_reports_duplicates_and_pays_nothing_twice(self):
+        self.invoice('INV-1', '50.00', email='parent@test.com')
+        path = self.statement([['MP1', '2026-03-05', '50.00', 'INV-1', '']])
+        self.assertEqual(self.reconcile(path).matched, 1)
+        run = self.reconcile(path)
+        self.assertEqual((run.matched, run.duplicate), (0, 1))
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_reference_to_a_closed_invoice_is_not_matched_by_amount(self):
+        paid = self.invoice('INV-1', '50.00')
+        Invoice.objects.filter(pk=paid.pk).update(status=Invoice.PAID)
+        other = self.invoice('INV-2', '50.00')
+        path = self.statement([['MP1', '2026-03-05', '50.00', 'inv-1', '']])
+        run = self.reconcile(path)
+        self.assertEqual((run.matched, run.unmatched), (0, 1))
+        line = StatementLine.objects.get(transaction_id='MP1')
+        self.assertEqual((line.invoice_id, line.note), (paid.pk, "Invoice already paid"))
+        other.refresh_from_db()
+        self.assertEqual(other.status, Invoice.OPEN)
+
+    def test_reopened_invoice_is_paid_from_the_new_statement(self):
+        invoice = self.invoice('INV-1', '50.00')
+        self.reconcile(self.statement([['MP1', '2026-03-05', '50.00', 'INV-1', '']]))
+        Invoice.objects.filter(pk=invoice.pk).update(status=Invoice.OPEN)
+        run = self.reconcile(self.statement([['MP2', '2026-03-20', '50.00', 'INV-1', '']], name='second.csv'))
+        self.assertEqual(run.matched, 1)
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.status, invoice.transaction_id), (Invoice.PAID, 'MP2'))
+        self.assertEqual(invoice.paid_at.date(), dt.date(2026, 3, 20))
+
+    def test_payment_outside_the_invoice_window_is_unmatched(self):
+        self.invoice('INV-1', '50.00', due=dt.date(2026, 3, 10))
+        path = self.statement([['MP1', '2026-05-01', '50.00', 'cash', '']])
+        run = self.reconcile(path, late_days=7)
+        self.assertEqual((run.matched, run.unmatched), (0, 1))
+
+
+class EntitlementTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('teacher', 'teacher@test.com', 'testpass')
+
+    def setUp(self):
+        cache.clear()
+
+    def fresh(self):
+        return User.objects.get(pk=self.user.pk)
+
+    def test_tiers_compile_to_masks(self):
+        compiled = compile_tiers({
+            'free': {'features': ['a']},
+            'plus': {'features': ['a', 'b'], 'ai_access': True},
+        }, 'free')
+        self.assertEqual(compiled.bits, {'a': 1, 'b': 2, 'ai_access': 4})
+        self.assertEqual(compiled.masks, {'free': 1, 'plus': 7})
+        self.assertEqual(compiled.default_mask, 1)
+        with self.assertRaises(ImproperlyConfigured):
+            requires_feature('telepathy')
+
+    def test_tier_is_read_once_and_invalidated_on_change(self):
+        user = self.fresh()
+        with self.assertNumQueries(1):
+            self.assertTrue(has_feature(user, 'basic_dashboard'))
+            self.assertFalse(has_feature(user, 'ai_reports'))
+            self.assertFalse(has_feature(user, 'ai_access'))
+        # The next request's user object is served from the cache.
+        next_request_user = self.fresh()
+        with self.assertNumQueries(0):
+            self.assertFalse(has_feature(next_request_user, 'ai_reports'))
+
+        subscription = Subscription.objects.create(user=self.user, tier='premium', status='active')
+        self.assertTrue(has_feature(self.fresh(), 'ai_reports'))
+        for status in ('past_due', 'canceled'):
+            subscription.status = status
+            subscription.save()
+            self.assertFalse(has_feature(self.fresh(), 'ai_reports'))
+        subscription.status = 'trialing'
+        subscription.save()
+        self.assertTrue(has_feature(self.fresh(), 'ai_reports'))
+        subscription.delete()
+        self.assertFalse(has_feature(self.fresh(), 'ai_reports'))
+
+    def test_decorator_and_template_filter(self):
+        view = requires_feature('ai_reports')(lambda request: HttpResponse('report'))
+        request = RequestFactory().get('/')
+        request.user = self.fresh()
+        response = view(request)
+        self.assertEqual((response.status_code, response.url), (302, reverse('billing:subscription_management')))
+
+        Subscription.objects.create(user=self.user, tier='premium', status='active')
+        request.user = self.fresh()
+        self.assertEqual(view(request).content, b'report')
+
+        rendered = Template(
+            '{% load entitlements %}{% if user|has_feature:"ai_chat" %}chat{% endif %}'
+            '{% feature_enabled "ai_reports" as can_report %}{% if can_report %} report{% endif %}'
+        ).render(Context({'user': request.user}))
+        self.assertEqual(rendered, 'chat report')
+
+
+class FailingRateSource:
+    name = 'failing'
+
+    def fetch(self):
+        raise OSError("network is down")
+
+
+class CurrencyConverterTests(TestCase):
+
+    def setUp(self):
+        self.now = 1_000_000.0
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        self.store = os.path.join(tmp, 'rates.json')
+        self.source = FixtureRateSource({'ZWL': '26.85', 'ZAR': '18.21', 'GBP': '0.79'}, base='USD')
+
+    def converter(self, source=None):
+        return CurrencyConverter(
+            source or self.source, ttl=60, stale_ttl=600, store_path=self.store, clock=lambda: self.now
+        )
+
+    def test_batch_conversion_is_exact_to_the_cent(self):
+        converter = self.converter()
+        self.assertEqual(
+            converter.convert_many(['100', Decimal('0.10'), 1, 0.1], 'USD', 'ZWL'),
+            [Decimal('2685.00'), Decimal('2.69'), Decimal('26.85'), Decimal('2.69')],
+        )
+        self.assertEqual(converter.convert('182.10', 'ZAR', 'GBP'), Decimal('7.90'))
+        self.assertEqual(self.source.fetches, 1)
+        with self.assertRaises(UnsupportedCurrency):
+            converter.convert(1, 'USD', 'JPY')
+
+    def test_ttl_and_stale_while_revalidate(self):
+        converter = self.converter()
+        converter.table()
+        self.now += 30
+        converter.table()
+        self.assertEqual(self.source.fetches, 1)
+
+        self.now += 60  # stale: served at once, refreshed in the background
+        table = converter.table()
+        self.assertEqual(table.source, 'fixture')
+        converter._refresh_thread.join(timeout=5)
+        self.assertEqual(self.source.fetches, 2)
+
+    def test_last_good_table_is_used_offline(self):
+        self.converter().table()
+        self.now += 10_000
+
+        offline = self.converter(FailingRateSource())
+        self.assertEqual(offline.convert(10, 'USD', 'ZAR'), Decimal('182.10'))
+
+        with open(self.store, 'w') as f:
+            f.write('corrupt')
+        with self.assertRaises(RatesUnavailable):
+            self.converter(FailingRateSource()).table()
+
+    def test_bundled_fixture_covers_supported_currencies(self):
+        rates = FixtureRateSource().fetch().rates
+        self.assertTrue(set(settings.SUPPORTED_CURRENCIES) <= set(rates))
+
+
+class GatewayClientTests(SimpleTestCase):
+
+    def setUp(self):
+        self.stub = StubGateway().start()
+        self.addCleanup(self.stub.stop)
+        self.now = 1000.0
+        self.sleeps = []
+
+    def gateway(self, **cfg):
+        cfg = dict({'api_url': self.stub.url + 'api/', 'api_key': 'sk_test', 'backoff': 0.01}, **cfg)
+        client = GatewayClient('stub', cfg, clock=lambda: self.now, sleep=self.sleeps.append)
+        self.addCleanup(client.close)
+        return client
+
+    def test_connections_are_kept_alive(self):
+        client = self.gateway()
+        for _ in range(5):
+            self.assertEqual(client.get('/charges').json(), {'ok': True})
+        self.assertEqual((self.stub.counts['connections'], self.stub.counts['requests']), (1, 5))
+        method, path, headers, _ = self.stub.requests[0]
+        self.assertEqual((method, path, headers['Authorization']), ('GET', '/api/charges', 'Bearer sk_test'))
+        self.assertEqual(client.stats()['calls'], 5)
+
+    def test_only_idempotent_calls_are_retried(self):
+        client = self.gateway(retries=2)
+        self.stub.respond((503, {}), (502, {}))
+        self.assertTrue(client.get('/status').ok)
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertTrue(all(0 <= delay <= 0.02 for delay in self.sleeps))
+
+        self.stub.respond((503, {}))
+        with self.assertRaises(GatewayHTTPError):
+            client.post('/payments', {'amount': 100})
+        self.stub.respond((503, {}))
+        client.post('/payments', {'amount': 100}, idempotency_key='pay-1')
+        self.assertEqual(self.stub.requests[-1][2]['Idempotency-Key'], 'pay-1')
+
+        self.stub.respond((400, {'error': 'bad'}))
+        with self.assertRaises(GatewayHTTPError) as caught:
+            client.get('/status')
+        self.assertEqual(caught.exception.response.json(), {'error': 'bad'})
+        stats = client.stats()
+        self.assertEqual((stats['calls'], stats['errors'], stats['retries']), (7, 5, 3))
+
+    def test_circuit_opens_and_recovers(self):
+        client = self.gateway(retries=0, failure_threshold=2, reset_timeout=30)
+        self.stub.respond((503, {}), (503, {}))
+        for _ in range(2):
+            with self.assertRaises(GatewayHTTPError):
+                client.get('/status')
+        self.assertEqual(client.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(GatewayUnavailable):
+            client.get('/status')
+        self.assertEqual(self.stub.counts['requests'], 2)
+
+        self.now += 30
+        self.assertEqual(client.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(client.get('/status').ok)
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(client.stats()['rejected'], 1)
+
+    def test_calls_that_never_reach_the_gateway_release_the_trial(self):
+        client = self.gateway(retries=0, failure_threshold=1, reset_timeout=30)
+        self.stub.respond((503, {}))
+        with self.assertRaises(GatewayHTTPError):
+            client.get('/status')
+        self.now += 30
+        with mock.patch.object(client.pool, 'connection', side_effect=GatewayError("No free connection")):
+            with self.assertRaisesMessage(GatewayError, "No free connection"):
+                client.get('/status')
+        self.assertEqual(client.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(client.get('/status').ok)
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_connect_timeout_is_used_for_connecting(self):
+        client = self.gateway(connect_timeout=1.5, timeout=7)
+        with mock.patch('socket.create_connection', wraps=socket.create_connection) as create_connection:
+            client.get('/status')
+        self.assertEqual(create_connection.call_args.args[1], 1.5)
+        with client.pool.connection(7) as (connection, reused):
+            self.assertTrue(reused)
+            self.assertEqual(connection.sock.gettimeout(), 7)
+
+    def test_timeouts_are_errors(self):
+        self.stub.latency = 0.3
+        client = self.gateway(timeout=0.05, retries=0)
+        with self.assertRaises(GatewayError):
+            client.get('/slow')
+        self.assertEqual(client.stats()['error_rate'], 1.0)
+
+    async def test_async_calls_do_not_wait_for_each_other(self):
+        self.stub.latency = 0.2
+        client = self.gateway(max_connections=4)
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(client.aget('/status') for _ in range(4)))
+        self.assertLess(time.perf_counter() - started, 0.6)
+        self.assertTrue(all(response.ok for response in responses))
+        self.stub.respond((400, {'error': 'bad'}))
+        with self.assertRaises(GatewayHTTPError):
+            await client.apost('/payments', {'amount': 100})
+
+    def test_clients_come_from_settings(self):
+        with override_settings(PAYMENT_GATEWAYS={'ecocash': {'api_url': self.stub.url, 'merchant_code': 'm1'}}):
+            client = get_client('ecocash')
+            self.assertIs(get_client('ecocash'), client)
+            client.get('/ping')
+            self.assertEqual(self.stub.requests[-1][2]['X-Merchant-Code'], 'm1')
+            with self.assertRaises(GatewayError):
+                get_client('bitcoin')
+        self.assertIsNot(get_client('ecocash'), client)
+
+
+@override_settings(
+    BILLING_OWNER_USERNAME='finance',
+    REQUEST_PROFILING={'sample_rate': 1, 'slow_ms': 10000, 'server_timing': True},
+)
+class RequestProfilingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('finance', 'finance@test.com', 'testpass')
+        School.objects.create(name='Chisipite', owner=cls.owner)
+
+    def setUp(self):
+        cache.clear()
+        profiling.registry.reset()
+
+    def test_profiled_requests_report_queries_templates_and_cache(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('schools:list_json'))
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="1 queries"', timing)
+        self.assertRegex(timing, r'cache;desc="\d+ hits, [1-9]\d* misses"')
+
+        self.client.force_login(self.owner)
+        self.assertIn('tpl;dur=', self.client.get(reverse('billing:performance'))['Server-Timing'])
+        routes = self.client.get(reverse('billing:performance_stats')).json()['routes']
+        self.assertEqual(routes['schools:list_json']['count'], 1)
+        self.assertEqual(routes['schools:list_json']['mean_queries'], 1)
+        self.assertGreater(routes['billing:performance']['mean_template_ms'], 0)
+
+    @override_settings(REQUEST_PROFILING={'sample_rate': 0, 'server_timing': True})
+    def test_unsampled_requests_are_only_timed(self):
+        response = self.client.get(reverse('schools:list_json'))
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+$')
+        stats = profiling.route_stats()['schools:list_json']
+        self.assertEqual((stats['count'], stats['sampled'], stats['mean_queries']), (1, 0, None))
+
+    @override_settings(REQUEST_PROFILING={'sample_rate': 1, 'slow_ms': 0})
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs('legacygrid.profiling', 'WARNING') as logs:
+            response = self.client.get(reverse('schools:list_json'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertIn('GET /schools/list/json/ (schools:list_json) 200', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+        self.assertEqual(profiling.route_stats()['schools:list_json']['slow'], 1)
+
+    def test_performance_page_is_owner_only(self):
+        self.client.force_login(User.objects.create_user('teacher'))
+        self.assertEqual(self.client.get(reverse('billing:performance_stats')).status_code, 302)
+
+    def test_rolling_window_drops_old_slices(self):
+        now = [0.0]
+        registry = profiling.RouteRegistry(clock=lambda: now[0])
+        for ms in (5, 5, 5, 400):
+            registry.record('schools:list', ms, 200, False, None, window=60, slices=6)
+        self.assertEqual(registry.snapshot()['schools:list']['p99_ms'], 400)
+        now[0] = 30
+        registry.record('schools:list', 50, 500, False, None, window=60, slices=6)
+        stats = registry.snapshot()['schools:list']
+        self.assertEqual((stats['count'], stats['errors']), (5, 1))
+        now[0] = 65
+        stats = registry.snapshot()['schools:list']
+        self.assertEqual((stats['count'], stats['max_ms']), (1, 50))
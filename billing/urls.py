@@ -5,7 +5,11 @@ app_name = 'billing'
 
 urlpatterns = [
     path('dashboard/', views.billing_dashboard, name='billing_dashboard'),
+    path('dashboard/revenue.json', views.revenue_stats, name='revenue_stats'),
+    path('dashboard/performance/', views.performance, name='performance'),
+    path('dashboard/performance.json', views.performance_stats, name='performance_stats'),
     path('subscription/', views.subscription_management, name='subscription_management'),
     path('settings/', views.billing_settings, name='billing_settings'),
     path('not-authorized/', views.not_authorized, name='not_authorized'),
+    path('webhooks/stripe/', views.stripe_webhook, name='stripe_webhook'),
 ]
\ No newline at end of file
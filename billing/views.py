@@ -1,22 +1,19 @@
-from django.contrib.auth.decorators import login_required
-from django.shortcuts import render, redirect
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.shortcuts import render
 from django.conf import settings
-from functools import wraps
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from account.roles import is_billing_owner, role_required
+from legacygrid_school_management.profiling import profiling_settings, route_stats
+from .gateways import gateway_stats
+from .rollups import revenue_summary
+from .stripe_signature import SignatureError, verify
+from .webhooks import InvalidEvent, record_event
 
 
-def owner_only(view_func):
-    """
-    Decorator that restricts access to only the owner (Uncle-T36).
-    Redirects unauthorized users to the 'not_authorized' page.
-    """
-    @wraps(view_func)
-    @login_required
-    def _wrapped_view(request, *args, **kwargs):
-        if request.user.username == settings.BILLING_OWNER_USERNAME:
-            return view_func(request, *args, **kwargs)
-        else:
-            return redirect('not_authorized')
-    return _wrapped_view
+# Restricts access to only the owner (Uncle-T36); anyone else is redirected
+# to the 'not_authorized' page. Roles are resolved once per request.
+owner_only = role_required(is_billing_owner, 'billing:not_authorized')
 
 
 @owner_only
@@ -28,10 +25,38 @@ def billing_dashboard(request):
         'stripe_public_key': settings.STRIPE_PUBLIC_KEY,
         'demo_mode': settings.DEMO_MODE,
         'subscription_tiers': settings.SUBSCRIPTION_TIERS,
+        'revenue': revenue_summary(),
     }
     return render(request, 'billing/dashboard.html', context)
 
 
+def _amounts(totals):
+    return {field: str(value) if field in ('gross', 'refunded', 'net') else value for field, value in totals.items()}
+
+
+@owner_only
+def revenue_stats(request):
+    """
+    Revenue rollups as JSON (`?days=30`) - only accessible to Uncle-T36
+    """
+    try:
+        days = min(max(int(request.GET.get('days', 30)), 1), 366)
+    except ValueError:
+        return JsonResponse({"error": "Invalid days"}, status=400)
+    summary = revenue_summary(days=days)
+    return JsonResponse({
+        "days": days,
+        "daily": [dict(_amounts(row), day=row['day'].isoformat()) for row in summary['daily']],
+        "monthly": [dict(_amounts(row), month=row['month'].isoformat()) for row in summary['monthly']],
+        "by_currency": {currency: _amounts(totals) for (currency,), totals in summary['by_currency'].items()},
+        "by_gateway": [
+            dict(_amounts(totals), gateway=gateway, currency=currency)
+            for (gateway, currency), totals in summary['by_gateway'].items()
+        ],
+        "active_subscriptions": summary['subscriptions'],
+    })
+
+
 @owner_only 
 def subscription_management(request):
     """
@@ -59,6 +84,33 @@ def billing_settings(request):
     return render(request, 'billing/settings.html', context)
 
 
+def _performance():
+    config = profiling_settings()
+    return {
+        "window_seconds": config['window'],
+        "sample_rate": config['sample_rate'],
+        "slow_ms": config['slow_ms'],
+        "routes": route_stats(),
+        "gateways": gateway_stats(),
+    }
+
+
+@owner_only
+def performance(request):
+    """
+    Request timings per page and payment gateway health - only accessible to Uncle-T36
+    """
+    return render(request, 'billing/performance.html', {'performance': _performance()})
+
+
+@owner_only
+def performance_stats(request):
+    """
+    Request timings per page as JSON - only accessible to Uncle-T36
+    """
+    return JsonResponse(_performance())
+
+
 def not_authorized(request):
     """
     Not authorized page for users who are not the owner
@@ -68,3 +120,23 @@ def not_authorized(request):
         'support_email': settings.SUPPORT_EMAIL,
     }
     return render(request, 'billing/not_authorized.html', context)
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """
+    Stripe webhook endpoint: verifies the signature and stores the event for
+    `manage.py process_webhooks`, so Stripe gets its 200 straight away
+    """
+    try:
+        verify(
+            request.body,
+            request.headers.get('Stripe-Signature'),
+            settings.STRIPE_WEBHOOK_SECRET,
+            tolerance=settings.STRIPE_WEBHOOK_TOLERANCE,
+        )
+        record_event(request.body)
+    except (SignatureError, InvalidEvent) as e:
+        return HttpResponseBadRequest(str(e))
+    return HttpResponse(status=200)
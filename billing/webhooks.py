@@ -0,0 +1,349 @@
+"""
+Inbox for Stripe webhooks.
+
+The webhook view verifies the signature, stores the raw event with
+``record_event`` and returns at once. ``manage.py process_webhooks`` claims
+pending events in batches, oldest first, and applies them: tier changes go
+to ``Subscription``, payments and refunds to ``billing.rollups`` and
+receipts are queued in the email outbox. Events are
+keyed by their Stripe id, so a redelivered event is dropped on insert, and
+each event is applied in its own transaction together with being marked
+processed; if the worker's claim has been taken over by then, the
+transaction is rolled back. An event that fails is retried after an
+exponential backoff, so it does not hold up the events behind it.
+"""
+
+import json
+import statistics
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from notifications.outbox import enqueue_email
+
+from .models import Payment, Subscription, WebhookEvent
+from .rollups import record_payment
+
+CLAIM_LEASE = timedelta(minutes=5)
+# Processed events looked at for the lag figures in inbox_stats().
+LAG_SAMPLE_SIZE = 200
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+class ClaimLost(Exception):
+    """The claim on an event expired and another worker took it over."""
+
+
+def record_event(payload):
+    """Store a verified event body (bytes). Redeliveries are ignored.
+    Returns the event id."""
+    try:
+        event = json.loads(payload)
+        event_id, event_type = event['id'], event['type']
+    except (ValueError, KeyError, TypeError):
+        raise InvalidEvent("Not a Stripe event")
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(event_id=event_id, event_type=event_type, payload=payload.decode('utf-8'))],
+        ignore_conflicts=True,
+    )
+    return event_id
+
+
+def _claimable(now):
+    # A pending event's claimed_until is when a failed event may be retried.
+    return (
+        Q(status=WebhookEvent.PENDING, claimed_until__isnull=True)
+        | Q(status=WebhookEvent.PENDING, claimed_until__lte=now)
+        | Q(status=WebhookEvent.PROCESSING, claimed_until__lt=now)
+    )
+
+
+def retry_delay(attempts):
+    base = settings.WEBHOOK_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+    return timedelta(seconds=min(base, settings.WEBHOOK_RETRY_MAX_SECONDS))
+
+
+def claim_batch(batch_size=None):
+    """Claim up to ``batch_size`` events for this worker, oldest first."""
+    batch_size = batch_size or settings.WEBHOOK_BATCH_SIZE
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        ids = list(
+            WebhookEvent.objects.filter(_claimable(now))
+            .order_by('received_at', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        WebhookEvent.objects.filter(_claimable(now), id__in=ids).update(
+            status=WebhookEvent.PROCESSING,
+            claim_token=token,
+            claimed_until=now + CLAIM_LEASE,
+        )
+    return list(
+        WebhookEvent.objects.filter(claim_token=token, status=WebhookEvent.PROCESSING).order_by('received_at', 'id')
+    )
+
+
+def event_object(event):
+    return (event.get('data') or {}).get('object') or {}
+
+
+class UserLookup:
+    """Finds the user an event belongs to. Built once per batch with three
+    queries (by id, email and Stripe customer) instead of per event."""
+
+    def __init__(self, objects):
+        ids, emails, customers = set(), set(), set()
+        for obj in objects:
+            user_id, email, customer = self.references(obj)
+            if user_id:
+                ids.add(user_id)
+            if email:
+                emails.add(email)
+            if customer:
+                customers.add(customer)
+        User = get_user_model()
+        self.by_id = User.objects.in_bulk(ids) if ids else {}
+        self.by_email = {
+            user.email.lower(): user for user in User.objects.filter(email__in=emails)
+        } if emails else {}
+        self.by_customer = {
+            sub.stripe_customer_id: sub.user
+            for sub in Subscription.objects.select_related('user').filter(stripe_customer_id__in=customers)
+        } if customers else {}
+
+    @staticmethod
+    def references(obj):
+        metadata = obj.get('metadata') or {}
+        raw_id = obj.get('client_reference_id') or metadata.get('user_id')
+        try:
+            user_id = int(raw_id) if raw_id else None
+        except (TypeError, ValueError):
+            user_id = None
+        email = obj.get('customer_email') or (obj.get('customer_details') or {}).get('email')
+        return user_id, (email or '').lower() or None, obj.get('customer')
+
+    def remember(self, obj, user):
+        """Let later events in the batch find ``user`` by this customer id."""
+        if obj.get('customer'):
+            self.by_customer.setdefault(obj['customer'], user)
+
+    def find(self, obj):
+        user_id, email, customer = self.references(obj)
+        return self.by_id.get(user_id) or self.by_customer.get(customer) or self.by_email.get(email)
+
+
+def format_amount(minor_units, currency):
+    return f"{Decimal(minor_units or 0) / 100:.2f} {(currency or '').upper()}".strip()
+
+
+def update_subscription(user, obj, **fields):
+    subscription, _ = Subscription.objects.get_or_create(user=user)
+    if obj.get('customer'):
+        subscription.stripe_customer_id = obj['customer']
+    for name, value in fields.items():
+        setattr(subscription, name, value)
+    subscription.save()
+    return subscription
+
+
+def queue_receipt(event, obj, user, amount):
+    recipient = user.email or obj.get('customer_email') or (obj.get('customer_details') or {}).get('email')
+    if not recipient:
+        return
+    created = datetime.fromtimestamp(event.get('created') or timezone.now().timestamp(), tz=dt_timezone.utc)
+    enqueue_email(
+        'billing_receipt',
+        {'user_name': user.get_full_name() or user.get_username(), 'amount': amount, 'date': f"{created:%Y-%m-%d}"},
+        recipient,
+        idempotency_key=f"stripe:{event['id']}:receipt",
+    )
+
+
+def _timestamp(value):
+    return datetime.fromtimestamp(value, tz=dt_timezone.utc) if value else None
+
+
+def record_stripe_payment(event, obj, user, minor_units, tier):
+    if not minor_units:
+        return
+    record_payment(
+        'stripe',
+        obj.get('id') or event['id'],
+        Decimal(minor_units) / 100,
+        obj.get('currency') or settings.DEFAULT_CURRENCY,
+        occurred_at=_timestamp(event.get('created')),
+        tier=tier,
+        user=user,
+        reference=obj.get('payment_intent') or '',
+    )
+
+
+def _period_end(obj):
+    end = obj.get('current_period_end')
+    if end is None:
+        lines = (obj.get('lines') or {}).get('data') or []
+        end = ((lines[0].get('period') or {}).get('end')) if lines else None
+    return _timestamp(end)
+
+
+def handle_checkout_completed(event, obj, user):
+    if obj.get('payment_status') not in (None, 'paid', 'no_payment_required'):
+        return
+    fields = {'status': 'active'}
+    if settings.AUTO_ACTIVATE_ON_PAYMENT:
+        fields['tier'] = settings.PREMIUM_TIER
+    if obj.get('subscription'):
+        fields['stripe_subscription_id'] = obj['subscription']
+    subscription = update_subscription(user, obj, **fields)
+    # Subscription checkouts are paid and receipted by the invoice.paid that follows.
+    if obj.get('mode') == 'payment':
+        record_stripe_payment(event, obj, user, obj.get('amount_total'), subscription.tier)
+        queue_receipt(event, obj, user, format_amount(obj.get('amount_total'), obj.get('currency')))
+
+
+def handle_invoice_paid(event, obj, user):
+    fields = {'status': 'active', 'current_period_end': _period_end(obj)}
+    if settings.AUTO_ACTIVATE_ON_PAYMENT:
+        fields['tier'] = settings.PREMIUM_TIER
+    if obj.get('subscription'):
+        fields['stripe_subscription_id'] = obj['subscription']
+    subscription = update_subscription(user, obj, **fields)
+    record_stripe_payment(event, obj, user, obj.get('amount_paid'), subscription.tier)
+    queue_receipt(event, obj, user, format_amount(obj.get('amount_paid'), obj.get('currency')))
+
+
+# Subscription statuses that no longer grant the paid tier.
+LAPSED_STATUSES = {'canceled', 'unpaid', 'incomplete_expired'}
+
+
+def handle_subscription_changed(event, obj, user):
+    status = 'canceled' if event['type'] == 'customer.subscription.deleted' else obj.get('status', '')
+    fields = {'status': status, 'stripe_subscription_id': obj.get('id', ''), 'current_period_end': _period_end(obj)}
+    if status in LAPSED_STATUSES:
+        fields['tier'] = settings.DEFAULT_TIER
+    update_subscription(user, obj, **fields)
+
+
+def handle_charge_refunded(event, obj, user):
+    # amount_refunded is cumulative; each refund is recorded once, by its id.
+    tier = Subscription.objects.filter(user=user).values_list('tier', flat=True).first() or settings.DEFAULT_TIER
+    for refund in (obj.get('refunds') or {}).get('data') or []:
+        record_payment(
+            'stripe',
+            refund['id'],
+            Decimal(refund.get('amount') or 0) / 100,
+            refund.get('currency') or obj.get('currency') or settings.DEFAULT_CURRENCY,
+            occurred_at=_timestamp(refund.get('created') or event.get('created')),
+            kind=Payment.REFUND,
+            tier=tier,
+            user=user,
+            reference=obj.get('id', ''),
+        )
+
+
+HANDLERS = {
+    'checkout.session.completed': handle_checkout_completed,
+    'invoice.paid': handle_invoice_paid,
+    'invoice.payment_succeeded': handle_invoice_paid,
+    'customer.subscription.updated': handle_subscription_changed,
+    'customer.subscription.deleted': handle_subscription_changed,
+    'charge.refunded': handle_charge_refunded,
+}
+
+
+def apply_event(row, event, users):
+    """Run the handler for one event. Events of other types, or for users
+    we do not know, are marked processed without doing anything."""
+    handler = HANDLERS.get(row.event_type)
+    if handler is None:
+        return
+    obj = event_object(event)
+    user = users.find(obj)
+    if user is not None:
+        handler(event, obj, user)
+        users.remember(obj, user)
+
+
+def process_batch(rows):
+    """Apply claimed events in order. Returns ``(processed, failed)``."""
+    events = {}
+    for row in rows:
+        try:
+            events[row.pk] = json.loads(row.payload)
+        except ValueError:
+            events[row.pk] = None
+    users = UserLookup(event_object(event) for event in events.values() if event)
+
+    processed = failed = 0
+    for row in rows:
+        claimed = WebhookEvent.objects.filter(pk=row.pk, claim_token=row.claim_token)
+        try:
+            with transaction.atomic():
+                if events[row.pk] is None:
+                    raise InvalidEvent("Payload is not JSON")
+                apply_event(row, events[row.pk], users)
+                marked = claimed.update(
+                    status=WebhookEvent.PROCESSED,
+                    processed_at=timezone.now(),
+                    attempts=row.attempts + 1,
+                    claimed_until=None,
+                    last_error='',
+                )
+                if not marked:
+                    raise ClaimLost(row.event_id)
+            processed += 1
+        except ClaimLost:
+            # The worker that holds the claim now applies the event.
+            continue
+        except Exception as e:
+            attempts = row.attempts + 1
+            retry = attempts < settings.WEBHOOK_MAX_ATTEMPTS
+            claimed.update(
+                status=WebhookEvent.PENDING if retry else WebhookEvent.FAILED,
+                attempts=attempts,
+                claimed_until=timezone.now() + retry_delay(attempts) if retry else None,
+                last_error=f"{type(e).__name__}: {e}",
+            )
+            failed += 1
+    return processed, failed
+
+
+def process_webhooks(batch_size=None):
+    """Claim and apply one batch. Returns ``(processed, failed)``."""
+    rows = claim_batch(batch_size)
+    if not rows:
+        return 0, 0
+    return process_batch(rows)
+
+
+def inbox_stats():
+    """Events per status, the age in seconds of the oldest unprocessed event,
+    and receive-to-processed lag over the most recent processed events."""
+    now = timezone.now()
+    stats = {status: 0 for status, _ in WebhookEvent.STATUS_CHOICES}
+    for row in WebhookEvent.objects.values('status').annotate(count=Count('id')):
+        stats[row['status']] = row['count']
+    oldest = WebhookEvent.objects.filter(
+        status__in=[WebhookEvent.PENDING, WebhookEvent.PROCESSING]
+    ).aggregate(oldest=Min('received_at'))['oldest']
+    stats['oldest_pending_age_seconds'] = (now - oldest).total_seconds() if oldest else None
+
+    recent = WebhookEvent.objects.filter(status=WebhookEvent.PROCESSED).order_by('-processed_at').values_list(
+        'received_at', 'processed_at'
+    )[:LAG_SAMPLE_SIZE]
+    lags = sorted((processed - received).total_seconds() for received, processed in recent)
+    stats['lag_p50_seconds'] = statistics.median(lags) if lags else None
+    stats['lag_max_seconds'] = lags[-1] if lags else None
+    return stats
@@ -0,0 +1,230 @@
+"""
+Logging and latency metrics for the email subsystem.
+
+All email modules log through the ``legacygrid.email`` logger. Its records
+go through a ``QueueHandler`` to a ``QueueListener`` thread that does the
+file I/O, so a slow disk never stalls a send. The root logger is left alone.
+
+Each send is timed per phase (render, connect, tls, login, send, plus any
+time spent waiting on the rate limiter). The timings are added to in-memory
+histograms per SMTP provider, readable with ``metrics.snapshot()``, and
+emitted as one structured INFO record per send.
+"""
+
+import atexit
+import bisect
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('legacygrid.email')
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def configure_email_logging(filename='email_error.log', level=logging.ERROR, handlers=()):
+    """Route ``legacygrid.email`` records to ``filename`` (and any extra
+    ``handlers``) through a background listener thread. Calling it again
+    replaces the previous configuration. Pass ``level=logging.INFO`` to also
+    write the per-send timing records."""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+
+        file_handler = logging.FileHandler(filename, encoding='utf-8', delay=True)
+        file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+        records = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(
+            records, file_handler, *handlers, respect_handler_level=True
+        )
+        _listener.start()
+        logger.addHandler(logging.handlers.QueueHandler(records))
+        logger.setLevel(level)
+        logger.propagate = False
+        return _listener
+
+
+def ensure_email_logging():
+    """Configure the default file logging unless the logger already has
+    handlers (set up by the application or an earlier call)."""
+    if not logger.handlers:
+        configure_email_logging()
+
+
+def stop_email_logging():
+    """Flush pending records and stop the listener thread."""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+
+atexit.register(stop_email_logging)
+
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is open.
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram. Recording is O(log buckets) and the
+    memory use is constant however many sends are recorded."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def merge(self, other):
+        """Add the samples recorded in ``other``."""
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given percentile (the
+        maximum seen for the open-ended last bucket)."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                if index < len(BUCKET_BOUNDS_MS):
+                    return min(BUCKET_BOUNDS_MS[index], self.max_ms)
+                return self.max_ms
+        return self.max_ms
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else None,
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max_ms,
+        }
+
+
+class EmailMetrics:
+    """Histograms per ``(provider, phase)`` plus sent/failed counters per provider."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._outcomes = {}
+
+    def record(self, provider, phases, ok):
+        with self._lock:
+            for phase, seconds in phases.items():
+                histogram = self._histograms.get((provider, phase))
+                if histogram is None:
+                    histogram = self._histograms[(provider, phase)] = LatencyHistogram()
+                histogram.record(seconds * 1000)
+            outcome = self._outcomes.setdefault(provider, {'sent': 0, 'failed': 0})
+            outcome['sent' if ok else 'failed'] += 1
+
+    def snapshot(self):
+        """``{provider: {'sent', 'failed', 'phases': {phase: summary}}}``"""
+        with self._lock:
+            result = {}
+            for provider, outcome in self._outcomes.items():
+                result[provider] = dict(outcome, phases={})
+            for (provider, phase), histogram in self._histograms.items():
+                result.setdefault(provider, {'sent': 0, 'failed': 0, 'phases': {}})
+                result[provider]['phases'][phase] = histogram.summary()
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._outcomes.clear()
+
+
+metrics = EmailMetrics()
+
+_current = threading.local()
+
+
+class SendTimings:
+    """Phase durations (seconds) collected while one email is sent."""
+
+    def __init__(self):
+        self.phases = {}
+        self.ok = False
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+
+@contextmanager
+def phase(name):
+    """Time a phase of the send in progress on this thread; a no-op when no
+    send is being tracked (e.g. the pool used directly)."""
+    timings = getattr(_current, 'timings', None)
+    if timings is None:
+        yield
+        return
+    with timings.phase(name):
+        yield
+
+
+def add_phase(name, seconds):
+    timings = getattr(_current, 'timings', None)
+    if timings is not None and seconds:
+        timings.phases[name] = timings.phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def track_send(smtp_cfg, event_type, to_email):
+    """Collect phase timings for one send. On exit the timings go into the
+    histograms and one structured record is logged. The block sets
+    ``timings.ok`` to report the outcome; an exception counts as a failure."""
+    timings = SendTimings()
+    previous = getattr(_current, 'timings', None)
+    _current.timings = timings
+    started = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        _current.timings = previous
+        total = time.perf_counter() - started
+        provider = smtp_cfg.get('server', 'unknown')
+        metrics.record(provider, dict(timings.phases, total=total), timings.ok)
+        if logger.isEnabledFor(logging.INFO):
+            record = {
+                'event_type': event_type,
+                'to': to_email,
+                'provider': provider,
+                'ok': timings.ok,
+                'total_ms': round(total * 1000, 3),
+                'phases_ms': {name: round(s * 1000, 3) for name, s in timings.phases.items()},
+            }
+            logger.info("email_send %s", json.dumps(record), extra={'email': record})
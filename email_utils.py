@@ -1,26 +1,36 @@
-import smtplib
 from email.mime.text import MIMEText
-from string import Template
+
+from email_metrics import ensure_email_logging, logger, phase, track_send
+from rate_limit import send_rate_limited
+from smtp_pool import default_pool
+from template_cache import default_registry
+
+ensure_email_logging()
 
 def load_template(path):
-    with open(path, 'r', encoding='utf-8') as f:
-        return Template(f.read())
+    return default_registry.get(path).source
 
 def fill_template(template, data):
     return template.safe_substitute(data)
 
-def send_email(subject, body, recipient, sender, smtp_cfg):
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = sender
-    msg['To'] = recipient
+def send_email(subject, body, recipient, sender, smtp_cfg, session=None):
+    with track_send(smtp_cfg, None, recipient) as timings:
+        with timings.phase('render'):
+            msg = MIMEText(body)
+            msg['Subject'] = subject
+            msg['From'] = sender
+            msg['To'] = recipient
+            message = msg.as_string()
+
+        def send():
+            if session is None:
+                return default_pool.sendmail(smtp_cfg, sender, [recipient], message)
+            with phase('send'):
+                return session.sendmail(sender, [recipient], message)
 
-    try:
-        with smtplib.SMTP(smtp_cfg["server"], smtp_cfg["port"]) as server:
-            server.starttls()
-            server.login(smtp_cfg["user"], smtp_cfg["password"])
-            server.sendmail(sender, [recipient], msg.as_string())
-    except Exception as e:
-        with open('email_error.log', 'a') as log:
-            log.write(str(e) + '\n')
-        raise
+        try:
+            send_rate_limited(smtp_cfg, send)
+        except Exception as e:
+            logger.error(f"Failed to send email to {recipient}: {e}")
+            raise
+        timings.ok = True
@@ -0,0 +1,20 @@
+"""
+ASGI config for legacygrid_school_management project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server, e.g. ``uvicorn legacygrid_school_management.asgi:application``,
+so async views can wait on I/O without holding a worker thread.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'legacygrid_school_management.settings')
+# Read by the settings: no persistent database connections under ASGI.
+os.environ.setdefault('LEGACYGRID_SERVER', 'asgi')
+
+application = get_asgi_application()
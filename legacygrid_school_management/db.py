@@ -0,0 +1,152 @@
+"""
+Production database profile.
+
+``sqlite_database`` builds a ``DATABASES`` entry for a tuned SQLite file:
+
+* ``journal_mode=WAL``: readers work from a snapshot and never wait for a
+  writer, and a writer never waits for readers;
+* ``synchronous=NORMAL``: with WAL, commits are durable against crashes
+  of the process and the database cannot be corrupted; only the last
+  commits before a power loss may be lost. Saves an fsync per commit;
+* ``mmap_size``: reads go through the page cache instead of ``read()``;
+* ``busy_timeout``: a second writer waits for the lock instead of failing
+  at once with "database is locked";
+* ``BEGIN IMMEDIATE`` for transactions, so a transaction takes the write
+  lock when it starts instead of failing when it first writes;
+* persistent connections (``CONN_MAX_AGE``) with health checks, so the
+  pragmas run once per connection rather than once per request. Under
+  ASGI (``asgi.py`` sets ``LEGACYGRID_SERVER=asgi``) they are off, as
+  Django advises: sync ORM calls run in per-request threads there, and
+  connections kept open by finished requests would pile up.
+
+``PrimaryReplicaRouter`` sends reads made inside ``read_replica()`` (a
+view decorated with ``use_read_replica``, or a streamed body wrapped in
+``replica_reads``) to the ``replica`` alias, when one is configured, and
+everything else to ``default``. With SQLite the
+replica is the same file opened read-only on separate connections; with a
+server database it would be a streaming replica, so only use it for pages
+that can be a moment behind.
+"""
+
+import contextvars
+import os
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+
+SERVER_ENV = 'LEGACYGRID_SERVER'
+PERSISTENT_CONN_MAX_AGE = 600  # seconds
+
+PRIMARY = 'default'
+REPLICA = 'replica'
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('busy_timeout', 5000),  # milliseconds
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -20000),  # KiB
+)
+
+
+def init_command(pragmas=SQLITE_PRAGMAS):
+    return ';'.join(f"PRAGMA {name}={value}" for name, value in pragmas)
+
+
+def default_conn_max_age():
+    return 0 if os.environ.get(SERVER_ENV) == 'asgi' else PERSISTENT_CONN_MAX_AGE
+
+
+def sqlite_database(path, read_only=False, conn_max_age=None):
+    """A ``DATABASES`` entry for the SQLite file at ``path``."""
+    if conn_max_age is None:
+        conn_max_age = default_conn_max_age()
+    options = {'init_command': init_command(), 'timeout': 5}
+    if read_only:
+        name = f"file:{path}?mode=ro"
+    else:
+        name = str(path)
+        options['transaction_mode'] = 'IMMEDIATE'
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': conn_max_age,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': options,
+        # Tests run against the primary's test database.
+        'TEST': {'MIRROR': PRIMARY} if read_only else {},
+    }
+
+
+_use_replica = contextvars.ContextVar('legacygrid_use_replica', default=False)
+
+
+@contextmanager
+def read_replica():
+    """Route reads in the block to the replica."""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def use_read_replica(view):
+    """View decorator: the view's reads go to the replica. Works for sync
+    and async views; the async ORM copies the context into its threads."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(*args, **kwargs):
+            with read_replica():
+                return await view(*args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with read_replica():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def replica_reads(iterable):
+    """Iterate ``iterable`` (e.g. a streaming response body, consumed after
+    the view returned) with its reads going to the replica."""
+    iterator = iter(iterable)
+    while True:
+        with read_replica():
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def replica_available():
+    from django.conf import settings
+    from django.db import connections
+
+    if REPLICA not in settings.DATABASES:
+        return False
+    # Under the test runner the replica mirrors the primary's test database,
+    # and a second connection would not see a test's uncommitted data.
+    return connections[REPLICA].settings_dict['NAME'] != connections[PRIMARY].settings_dict['NAME']
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_available():
+            return REPLICA
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == PRIMARY
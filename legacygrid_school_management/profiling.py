@@ -0,0 +1,373 @@
+"""
+Request profiling.
+
+``ProfilingMiddleware`` times every request and keeps the timings per URL
+name (``schools:list``, ``billing:billing_dashboard``) in rolling windows:
+``window`` seconds of history made of ``slices`` ``LatencyHistogram``
+slices, so memory use is constant however busy the site is. A sample of
+requests (``sample_rate``) is also profiled in full:
+
+* ORM queries and their time: an execute wrapper on every database
+  connection adds to the profile of the request in progress, found through
+  a context variable, so queries the async ORM makes in worker threads are
+  counted too. Outside a profiled request it costs one context variable
+  lookup per query;
+* template render time, measured by the ``ProfiledTemplates`` backend;
+  nested renders count once;
+* cache hits and misses, counted by the ``ProfiledLocMemCache`` backend.
+
+When ``server_timing`` is on, responses carry a ``Server-Timing`` header
+(``total``; plus ``db``, ``tpl`` and ``cache`` for profiled requests) that
+browsers show in their network panel. It exposes timings to every client,
+so it is off by default outside DEBUG. Requests slower than ``slow_ms`` are
+logged to ``legacygrid.profiling`` at WARNING, with their slowest SQL
+statements when profiled.
+
+``route_stats()`` returns the percentiles; owners see them on the
+``billing:performance`` page. Streamed bodies are produced after the
+middleware returns and are not included in the timings.
+"""
+
+import contextvars
+import heapq
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates
+
+from email_metrics import LatencyHistogram
+
+logger = logging.getLogger('legacygrid.profiling')
+
+DEFAULTS = {
+    'sample_rate': 0.1,
+    'slow_ms': 1000,
+    'window': 3600,
+    'slices': 12,
+    'server_timing': False,
+    'slow_statements': 10,
+}
+
+UNRESOLVED = '<unresolved>'
+
+
+def profiling_settings():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_PROFILING', {})}
+
+
+class RequestProfile:
+    """Queries, template and cache activity of one profiled request. The
+    async ORM may add to it from other threads."""
+
+    def __init__(self, slow_statements=DEFAULTS['slow_statements']):
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.cache_hits = self.cache_misses = 0
+        self._rendering = 0
+        self._slowest = []  # heap of (seconds, n, sql)
+        self._keep = slow_statements
+
+    def add_query(self, sql, seconds):
+        with self._lock:
+            self.queries += 1
+            self.sql_seconds += seconds
+            if self._keep:
+                item = (seconds, self.queries, sql)
+                if len(self._slowest) < self._keep:
+                    heapq.heappush(self._slowest, item)
+                else:
+                    heapq.heappushpop(self._slowest, item)
+
+    def add_cache(self, hits, misses):
+        with self._lock:
+            self.cache_hits += hits
+            self.cache_misses += misses
+
+    @contextmanager
+    def rendering(self):
+        with self._lock:
+            self._rendering += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._rendering -= 1
+                if not self._rendering:
+                    self.template_seconds += elapsed
+
+    def slowest_statements(self):
+        """``[(seconds, sql)]``, slowest first."""
+        with self._lock:
+            return [(seconds, sql) for seconds, _, sql in sorted(self._slowest, reverse=True)]
+
+
+_profile = contextvars.ContextVar('legacygrid_request_profile', default=None)
+
+
+def current_profile():
+    """The profile of the request in progress, or None if it is not sampled."""
+    return _profile.get()
+
+
+def record_query(execute, sql, params, many, context):
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_hook(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        # First, so the wrappers of ``connection.execute_wrapper()`` blocks
+        # stay on top and are the ones popped when those blocks end.
+        connection.execute_wrappers.insert(0, record_query)
+
+
+connection_created.connect(install_query_hook, dispatch_uid='legacygrid_profiling_queries')
+
+
+def record_cache(hits=0, misses=0):
+    profile = _profile.get()
+    if profile is not None:
+        profile.add_cache(hits, misses)
+
+
+class ProfiledTemplate:
+
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        profile = _profile.get()
+        if profile is None:
+            return self._template.render(context, request)
+        with profile.rendering():
+            return self._template.render(context, request)
+
+
+class ProfiledTemplates(DjangoTemplates):
+    """``DjangoTemplates`` whose templates time their rendering for the
+    request profile."""
+
+    def from_string(self, template_code):
+        return ProfiledTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return ProfiledTemplate(super().get_template(template_name))
+
+
+_MISSING = object()
+
+
+class CacheProfilingMixin:
+    """Counts ``get`` hits and misses for the request profile. ``get_many``,
+    ``get_or_set`` and the async methods go through ``get`` in the built-in
+    local-memory and file backends."""
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        if value is _MISSING:
+            record_cache(misses=1)
+            return default
+        record_cache(hits=1)
+        return value
+
+
+class ProfiledLocMemCache(CacheProfilingMixin, LocMemCache):
+    pass
+
+
+class _Slice:
+    """Timings of one route during one slice of the window."""
+
+    def __init__(self, started):
+        self.started = started
+        self.wall = LatencyHistogram()
+        self.errors = self.slow = 0
+        self.sampled = self.queries = self.max_queries = 0
+        self.sql_ms = self.template_ms = 0.0
+        self.cache_hits = self.cache_misses = 0
+
+
+class RouteStats:
+    """Rolling timings for one URL name."""
+
+    def __init__(self, window, slices):
+        self.window = window
+        self.slice_seconds = window / slices
+        self.slices = deque(maxlen=slices)
+
+    def _slice(self, now):
+        started = now - now % self.slice_seconds
+        if not self.slices or self.slices[-1].started != started:
+            self.slices.append(_Slice(started))
+        return self.slices[-1]
+
+    def record(self, now, wall_ms, status, slow, profile):
+        current = self._slice(now)
+        current.wall.record(wall_ms)
+        current.errors += status >= 500
+        current.slow += slow
+        if profile is not None:
+            current.sampled += 1
+            current.queries += profile.queries
+            current.max_queries = max(current.max_queries, profile.queries)
+            current.sql_ms += profile.sql_seconds * 1000
+            current.template_ms += profile.template_seconds * 1000
+            current.cache_hits += profile.cache_hits
+            current.cache_misses += profile.cache_misses
+
+    def summary(self, now):
+        wall = LatencyHistogram()
+        totals = _Slice(None)
+        for part in self.slices:
+            if now - part.started >= self.window:
+                continue
+            wall.merge(part.wall)
+            for field in ('errors', 'slow', 'sampled', 'queries', 'sql_ms', 'template_ms', 'cache_hits', 'cache_misses'):
+                setattr(totals, field, getattr(totals, field) + getattr(part, field))
+            totals.max_queries = max(totals.max_queries, part.max_queries)
+        sampled = totals.sampled
+        lookups = totals.cache_hits + totals.cache_misses
+        return dict(
+            wall.summary(),
+            errors=totals.errors,
+            slow=totals.slow,
+            sampled=sampled,
+            mean_queries=totals.queries / sampled if sampled else None,
+            max_queries=totals.max_queries if sampled else None,
+            mean_sql_ms=totals.sql_ms / sampled if sampled else None,
+            mean_template_ms=totals.template_ms / sampled if sampled else None,
+            cache_hit_rate=totals.cache_hits / lookups if lookups else None,
+        )
+
+
+class RouteRegistry:
+    """``RouteStats`` per URL name, for this process."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, wall_ms, status, slow, profile, window, slices):
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = RouteStats(window, slices)
+            stats.record(self.clock(), wall_ms, status, slow, profile)
+
+    def snapshot(self):
+        """``{route: summary}``, for routes with requests in the window."""
+        with self._lock:
+            now = self.clock()
+            summaries = {route: stats.summary(now) for route, stats in self._routes.items()}
+        return {route: summary for route, summary in sorted(summaries.items()) if summary['count']}
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+registry = RouteRegistry()
+
+
+def route_stats():
+    return registry.snapshot()
+
+
+def server_timing(wall_ms, profile):
+    parts = [f'total;dur={wall_ms:.1f}']
+    if profile is not None:
+        parts.append(f'db;dur={profile.sql_seconds * 1000:.1f};desc="{profile.queries} queries"')
+        parts.append(f'tpl;dur={profile.template_seconds * 1000:.1f}')
+        parts.append(f'cache;desc="{profile.cache_hits} hits, {profile.cache_misses} misses"')
+    return ', '.join(parts)
+
+
+def log_slow_request(request, route, status, wall_ms, profile):
+    message = f"Slow request {request.method} {request.path} ({route}) {status} in {wall_ms:.0f} ms"
+    if profile is None:
+        logger.warning(message + " (not profiled)")
+        return
+    lines = [
+        f"{message}: {profile.queries} queries, {profile.sql_seconds * 1000:.0f} ms SQL, "
+        f"{profile.template_seconds * 1000:.0f} ms templates"
+    ]
+    lines.extend(f"  {seconds * 1000:8.1f} ms  {sql}" for seconds, sql in profile.slowest_statements())
+    logger.warning('\n'.join(lines))
+
+
+class ProfilingMiddleware:
+    """Put it first in ``MIDDLEWARE`` so the timings cover the other
+    middleware too."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = profiling_settings()
+        # Connections opened before this module was imported.
+        for connection in connections.all(initialized_only=True):
+            install_query_hook(connection)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started, profile, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, started, profile)
+
+    async def __acall__(self, request):
+        started, profile, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, started, profile)
+
+    def start(self):
+        profile = None
+        if random.random() < self.config['sample_rate']:
+            profile = RequestProfile(self.config['slow_statements'])
+        return time.perf_counter(), profile, _profile.set(profile)
+
+    def finish(self, request, response, started, profile):
+        wall_ms = (time.perf_counter() - started) * 1000
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match is not None else UNRESOLVED
+        slow = wall_ms >= self.config['slow_ms']
+        registry.record(
+            route, wall_ms, response.status_code, slow, profile, self.config['window'], self.config['slices']
+        )
+        if self.config['server_timing']:
+            response['Server-Timing'] = server_timing(wall_ms, profile)
+        if slow:
+            log_slow_request(request, route, response.status_code, wall_ms, profile)
+        return response
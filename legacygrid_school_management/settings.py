@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 
+from .db import sqlite_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -23,14 +25,17 @@ INSTALLED_APPS = [
     'schools',
     'billing',  # New billing app for payment management
     'account',  # <-- Added account app
+    'notifications',  # Email outbox and delivery worker
 ]
 
 MIDDLEWARE = [
+    'legacygrid_school_management.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'schools.middleware.TenantMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -39,7 +44,8 @@ ROOT_URLCONF = 'legacygrid_school_management.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for the request profile.
+        'BACKEND': 'legacygrid_school_management.profiling.ProfiledTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -48,20 +54,45 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'account.context_processors.roles',
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'legacygrid_school_management.wsgi.application'
+ASGI_APPLICATION = 'legacygrid_school_management.asgi.application'
 
 # Database
+# WAL, synchronous=NORMAL, mmap, busy timeout and persistent connections
+# (off under ASGI); see legacygrid_school_management/db.py. Reads in views
+# decorated with use_read_replica go to 'replica', a read-only connection to
+# the same file.
 DATABASES = {
+    'default': sqlite_database(BASE_DIR / 'db.sqlite3'),
+    'replica': sqlite_database(BASE_DIR / 'db.sqlite3', read_only=True),
+}
+DATABASE_ROUTERS = ['legacygrid_school_management.db.PrimaryReplicaRouter']
+
+# Cache
+# Local memory is per process; with several workers switch to
+# 'django.core.cache.backends.filebased.FileBasedCache' (LOCATION a directory)
+# so cache invalidation reaches every worker.
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # LocMemCache, counting hits and misses for the request profile.
+        'BACKEND': 'legacygrid_school_management.profiling.ProfiledLocMemCache',
+        'LOCATION': 'legacygrid',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
     }
 }
+SCHOOLS_CACHE_ALIAS = 'default'
+SCHOOLS_CACHE_TIMEOUT = 600
+# Schools are served at <subdomain>.TENANT_BASE_DOMAIN when set, e.g.
+# 'legacygrid.example.com'; otherwise the active school comes from the owner.
+TENANT_BASE_DOMAIN = None
+# Seconds a user's resolved roles stay cached (account.roles)
+ROLES_CACHE_TIMEOUT = 300
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -93,6 +124,8 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Background threads that generate school logo variants (schools.logos)
+LOGO_VARIANT_WORKERS = 2
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -107,6 +140,11 @@ STRIPE_SECRET_KEY = 'sk_test_your_stripe_secret_key_here'  # Add your actual sec
 STRIPE_PUBLIC_KEY = 'pk_test_your_stripe_public_key_here'  # Add your actual public key  
 STRIPE_PRICE_ID = 'price_your_stripe_price_id_here'  # Add your actual price ID
 STRIPE_WEBHOOK_SECRET = 'whsec_your_webhook_secret_here'  # Add your webhook secret
+STRIPE_WEBHOOK_TOLERANCE = 300  # seconds; older signatures are rejected as replays
+WEBHOOK_BATCH_SIZE = 100  # events applied per batch by `manage.py process_webhooks`
+WEBHOOK_MAX_ATTEMPTS = 5  # then the event is marked failed
+WEBHOOK_RETRY_BASE_SECONDS = 30  # doubles after every failed attempt
+WEBHOOK_RETRY_MAX_SECONDS = 3600
 DOMAIN = 'http://localhost:8000'  # Change to your domain in production
 
 # === OPENAI API SETTINGS ===
@@ -119,31 +157,51 @@ PAYMENT_GATEWAYS = {
         'public_key': STRIPE_PUBLIC_KEY,
         'currency': 'USD',
         'mode': 'test',  # change to 'live' when ready
+        'api_url': 'https://api.stripe.com/v1/',
     },
     'paypal': {
         'client_id': 'test-client-id',
         'client_secret': 'test-client-secret',
         'mode': 'sandbox',  # change to 'live'
+        'api_url': 'https://api-m.sandbox.paypal.com/',
     },
     # Zimbabwe Mobile Money Placeholders
     'ecocash': {
         'merchant_code': 'test-merchant',
         'api_url': 'https://api.sandbox.ecocash.co.zw/',
         'mode': 'test',
+        'timeout': 20,  # the sandbox is slow
     },
     'onemoney': {
         'merchant_code': 'test-merchant',
         'api_url': 'https://sandbox.onemoney.co.zw/api/',
         'mode': 'test',
+        'timeout': 20,
     },
     # Add more as needed
 }
+# HTTP client defaults for every gateway (billing.gateways); any key can
+# be overridden in the gateway's PAYMENT_GATEWAYS entry.
+PAYMENT_GATEWAY_CLIENT = {
+    'timeout': 10,            # seconds per call
+    'retries': 2,             # idempotent calls only, with jittered backoff
+    'max_connections': 8,     # concurrent keep-alive connections per gateway
+    'failure_threshold': 5,   # consecutive failures that open the circuit
+    'reset_timeout': 30,      # seconds before a trial call is let through
+}
 
 
 # === CURRENCY CONVERSION ===
 DEFAULT_CURRENCY = 'USD'
 SUPPORTED_CURRENCIES = ['USD', 'ZWL', 'ZAR', 'NGN', 'GBP', 'EUR']
 CURRENCY_CONVERSION_API_URL = 'https://api.exchangeratesapi.io/latest'  # Free for dev, use premium for live
+CURRENCY_RATE_SOURCE = {
+    'backend': 'billing.currency.HTTPRateSource',  # or 'billing.currency.FixtureRateSource' offline
+    'timeout': 10,
+}
+CURRENCY_RATES_TTL = 15 * 60  # seconds before rates are refreshed
+CURRENCY_RATES_STALE_TTL = 6 * 60 * 60  # serve older rates while refreshing in the background
+CURRENCY_RATES_STORE = BASE_DIR / 'currency_rates.json'  # last good table, for offline fallback
 
 # === SUBSCRIPTION TIERS ===
 SUBSCRIPTION_TIERS = {
@@ -161,6 +219,7 @@ SUBSCRIPTION_TIERS = {
 DEFAULT_TIER = 'free'
 PREMIUM_TIER = 'premium'
 AUTO_ACTIVATE_ON_PAYMENT = True  # instantly upgrades user tier on payment webhook
+ENTITLEMENT_CACHE_TIMEOUT = 300  # seconds a user's tier stays cached (billing.entitlements)
 
 # === AI SETTINGS ===
 AI_PROVIDER = 'openai'     # You pay for this one subscription only
@@ -183,6 +242,15 @@ LANGUAGE_TEMPLATES = {
 }
 SEND_SMS = True
 SEND_EMAIL = True
+SMS_GATEWAY = {
+    'backend': 'notifications.sms.HTTPSMSBackend',  # or 'notifications.sms.LocalSMSBackend' for testing
+    'url': 'https://sms.yourprovider.example/v1/messages',  # Add your SMS gateway URL
+    'api_key': 'your-sms-api-key-here',
+    'sender_id': 'LegacyGrid',
+    'batch_size': 100,  # messages per gateway request
+    'max_concurrent_batches': 4,
+    'timeout': 10,
+}
 
 # === PARENT PROFILE ===
 PARENT_LANGUAGE_FIELD = 'preferred_language'
@@ -194,5 +262,30 @@ ALLOW_ONLY_OWNER_BILLING = True  # Only Uncle-T36 can see/manage billing
 DOCUMENTATION_URL = 'https://github.com/Uncle-T36/legacygrid-school-management/blob/main/README.md'
 SUPPORT_EMAIL = 'support@legacygrid.co.zw'
 
+# === EMAIL OUTBOX ===
+# Used by `manage.py process_outbox` to deliver queued emails.
+EMAIL_SMTP_CONFIG = {
+    'server': 'smtp.yourprovider.com',  # Add your SMTP server
+    'port': 587,
+    'user': 'your@email.com',
+    'password': 'your_email_password',
+    'max_connections': 4,
+}
+EMAIL_FROM_ADDRESS = SUPPORT_EMAIL
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 8  # then the email is marked failed
+OUTBOX_RETRY_BASE_SECONDS = 30  # doubles after every failed attempt
+OUTBOX_RETRY_MAX_SECONDS = 3600
+
+# === REQUEST PROFILING ===
+# Every request is timed per URL name; a sample is profiled in full (queries,
+# templates, cache). Owners see the percentiles at /billing/dashboard/performance/.
+REQUEST_PROFILING = {
+    'sample_rate': 0.1,  # fraction of requests profiled in full
+    'slow_ms': 1000,  # log slower requests, with their slowest SQL when profiled
+    'window': 3600,  # seconds of history kept per URL name
+    'server_timing': DEBUG,  # Server-Timing header; shows timings to every client
+}
+
 # === DEMO MODE ===
 DEMO_MODE = True  # disables real payments until you switch to live mode
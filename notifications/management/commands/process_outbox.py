@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auto_emailer import warm_up_templates
+from notifications.outbox import outbox_stats, process_outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver queued emails from the outbox, retrying failures with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows claimed per batch.")
+        parser.add_argument('--once', action='store_true', help="Deliver due emails and exit.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--stats', action='store_true', help="Print queue depth and age, then exit.")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            for key, value in outbox_stats().items():
+                self.stdout.write(f"{key}: {value}")
+            return
+
+        missing = warm_up_templates()
+        for path in missing:
+            self.stderr.write(f"Template not found: {path}")
+
+        try:
+            while True:
+                sent, failed = process_outbox(options['batch_size'])
+                if sent or failed:
+                    self.stdout.write(f"Sent {sent}, failed {failed}")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,164 @@
+"""
+Durable outbox for event emails.
+
+Request handlers call ``enqueue_email`` which only writes a row and returns.
+The ``process_outbox`` management command claims due rows in batches, sends
+them through ``auto_emailer`` and reschedules failures with exponential
+backoff.
+"""
+
+import random
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from auto_emailer import send_event_emails_bulk
+
+from .models import OutboxEmail
+
+# A claimed row that is still 'sending' after this long belongs to a worker
+# that died mid-batch and is handed out again.
+CLAIM_LEASE = timedelta(minutes=5)
+
+
+def enqueue_email(event_type, payload, recipient, idempotency_key=None):
+    """Queue an event email. Returns ``(outbox_email, created)``; when
+    ``idempotency_key`` was already used, the existing row is returned and
+    nothing new is queued."""
+    if idempotency_key is None:
+        return OutboxEmail.objects.create(event_type=event_type, payload=payload, recipient=recipient), True
+    try:
+        with transaction.atomic():
+            email = OutboxEmail.objects.create(
+                event_type=event_type,
+                payload=payload,
+                recipient=recipient,
+                idempotency_key=idempotency_key,
+            )
+        return email, True
+    except IntegrityError:
+        return OutboxEmail.objects.get(idempotency_key=idempotency_key), False
+
+
+async def aenqueue_email(event_type, payload, recipient, idempotency_key=None):
+    """``enqueue_email`` for async views."""
+    return await sync_to_async(enqueue_email)(event_type, payload, recipient, idempotency_key)
+
+
+def enqueue_emails(emails):
+    """Queue many ``(event_type, payload, recipient, idempotency_key)``
+    emails with one insert. Keys already used are skipped."""
+    OutboxEmail.objects.bulk_create(
+        [
+            OutboxEmail(event_type=event_type, payload=payload, recipient=recipient, idempotency_key=key)
+            for event_type, payload, recipient, key in emails
+        ],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+
+def _claimable(now):
+    return (
+        Q(status=OutboxEmail.PENDING, next_attempt_at__lte=now)
+        | Q(status=OutboxEmail.SENDING, claimed_until__lt=now)
+    )
+
+
+def claim_batch(batch_size=None):
+    """Atomically mark up to ``batch_size`` due rows as being sent by this
+    worker and return them. Safe to run from several workers at once: a row
+    is only returned to the worker whose claim token was written."""
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        ids = list(
+            OutboxEmail.objects.filter(_claimable(now))
+            .order_by('next_attempt_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        OutboxEmail.objects.filter(_claimable(now), id__in=ids).update(
+            status=OutboxEmail.SENDING,
+            claim_token=token,
+            claimed_until=now + CLAIM_LEASE,
+        )
+    return list(OutboxEmail.objects.filter(claim_token=token, status=OutboxEmail.SENDING))
+
+
+def retry_delay(attempts):
+    """Exponential backoff with a little jitter so retries from one failed
+    batch do not all land in the same second."""
+    base = settings.OUTBOX_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+    delay = min(base, settings.OUTBOX_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(1.0, 1.1))
+
+
+def deliver_batch(emails):
+    """Send claimed rows and record the outcome. Returns ``(sent, failed)``."""
+    by_event = {}
+    for email in emails:
+        by_event.setdefault(email.event_type, []).append(email)
+
+    sent = failed = 0
+    for event_type, group in by_event.items():
+        rows = [(email.payload, email.recipient) for email in group]
+        summary = send_event_emails_bulk(
+            event_type, rows, settings.EMAIL_FROM_ADDRESS, settings.EMAIL_SMTP_CONFIG
+        )
+        now = timezone.now()
+        for email, result in zip(group, summary['results']):
+            email.attempts += 1
+            email.claimed_until = None
+            if result['sent']:
+                email.status = OutboxEmail.SENT
+                email.sent_at = now
+                email.last_error = ''
+                sent += 1
+            else:
+                email.last_error = result['error'] or ''
+                if email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                    email.status = OutboxEmail.FAILED
+                else:
+                    email.status = OutboxEmail.PENDING
+                    email.next_attempt_at = now + retry_delay(email.attempts)
+                failed += 1
+        # Only rows still under our claim: once the lease has run out another
+        # worker may have claimed a row, and its outcome is the one to keep.
+        by_token = {}
+        for email in group:
+            by_token.setdefault(email.claim_token, []).append(email)
+        for token, claimed in by_token.items():
+            OutboxEmail.objects.filter(claim_token=token).bulk_update(
+                claimed, ['status', 'attempts', 'claimed_until', 'sent_at', 'last_error', 'next_attempt_at']
+            )
+    return sent, failed
+
+
+def process_outbox(batch_size=None):
+    """Claim and deliver one batch. Returns ``(sent, failed)``."""
+    emails = claim_batch(batch_size)
+    if not emails:
+        return 0, 0
+    return deliver_batch(emails)
+
+
+def outbox_stats():
+    """Queue depth per status, how many rows are due now, and the age in
+    seconds of the oldest row still waiting to be sent."""
+    now = timezone.now()
+    stats = {status: 0 for status, _ in OutboxEmail.STATUS_CHOICES}
+    for row in OutboxEmail.objects.values('status').annotate(count=Count('id')):
+        stats[row['status']] = row['count']
+    waiting = OutboxEmail.objects.filter(status__in=[OutboxEmail.PENDING, OutboxEmail.SENDING])
+    summary = waiting.aggregate(oldest=Min('created_at'), due=Count('id', filter=_claimable(now)))
+    stats['due'] = summary['due']
+    stats['oldest_age_seconds'] = (now - summary['oldest']).total_seconds() if summary['oldest'] else None
+    return stats
@@ -0,0 +1,222 @@
+"""
+SMS channel mirroring the ``auto_emailer`` event API.
+
+Messages are rendered from ``SMS_TEMPLATE_MAP``, grouped into batches of
+``SMS_GATEWAY['batch_size']`` and handed to the configured backend, with up
+to ``SMS_GATEWAY['max_concurrent_batches']`` batches in flight at once.
+Nothing is sent unless ``settings.SEND_SMS`` is true.
+
+Backends implement ``send_batch(messages)`` where ``messages`` is a list of
+``(to_number, text)`` and return one ``(sent, error)`` pair per message.
+``HTTPSMSBackend`` posts batches to an HTTP gateway over keep-alive
+connections; ``LocalSMSBackend`` is an in-process stand-in for tests and
+benchmarks.
+"""
+
+import http.client
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from template_cache import default_registry
+
+logger = logging.getLogger(__name__)
+
+SMS_TEMPLATE_MAP = {
+    "payment_received": "templates/sms_school_fees_receipt.txt",
+    "registration_confirmation": "templates/sms_registration_confirmation.txt",
+}
+
+
+class HTTPSMSBackend:
+    """Posts each batch as one JSON request to ``SMS_GATEWAY['url']``.
+
+    Connections are kept alive and reused; each concurrent batch borrows its
+    own connection from a small pool, so steady traffic never reconnects.
+    """
+
+    def __init__(self, url, api_key='', sender_id='', timeout=10, **options):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        self.api_key = api_key
+        self.sender_id = sender_id
+        self.timeout = timeout
+        self._connections = queue.LifoQueue()
+
+    def _new_connection(self):
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def _post(self, connection, body):
+        connection.request('POST', self.path, body=body, headers={
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.api_key}',
+        })
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    def send_batch(self, messages):
+        body = json.dumps({
+            'sender': self.sender_id,
+            'messages': [{'to': to_number, 'text': text} for to_number, text in messages],
+        })
+        try:
+            connection, reused = self._connections.get_nowait(), True
+        except queue.Empty:
+            connection, reused = self._new_connection(), False
+        try:
+            try:
+                status, payload = self._post(connection, body)
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # The gateway closed an idle keep-alive connection before it
+                # read the request; retry once on a fresh one.
+                if not reused:
+                    raise
+                connection.close()
+                connection = self._new_connection()
+                status, payload = self._post(connection, body)
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            return [(False, str(e))] * len(messages)
+        self._connections.put(connection)
+        if 200 <= status < 300:
+            return [(True, None)] * len(messages)
+        return [(False, f"Gateway returned {status}: {payload[:200]!r}")] * len(messages)
+
+    def close(self):
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class LocalSMSBackend:
+    """In-process stand-in gateway. Records every accepted message in
+    ``sent``; ``latency`` (seconds per batch) and ``failure_rate`` simulate a
+    slow or flaky gateway."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, **options):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages):
+        if self.latency:
+            time.sleep(self.latency)
+        results = []
+        with self._lock:
+            self.batches += 1
+            for message in messages:
+                if self.failure_rate and random.random() < self.failure_rate:
+                    results.append((False, "Simulated gateway failure"))
+                else:
+                    self.sent.append(message)
+                    results.append((True, None))
+        return results
+
+    def close(self):
+        pass
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(gateway_cfg=None):
+    """Backend instance for ``gateway_cfg`` (default ``settings.SMS_GATEWAY``),
+    created once per process so keep-alive connections are reused."""
+    gateway_cfg = gateway_cfg or settings.SMS_GATEWAY
+    key = json.dumps(gateway_cfg, sort_keys=True, default=str)
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            options = {k: v for k, v in gateway_cfg.items()
+                       if k not in ('backend', 'batch_size', 'max_concurrent_batches')}
+            backend = _backends[key] = import_string(gateway_cfg['backend'])(**options)
+        return backend
+
+
+def get_sms_template(event_type):
+    template_path = SMS_TEMPLATE_MAP.get(event_type)
+    try:
+        if template_path:
+            return default_registry.get(template_path).source
+    except OSError:
+        pass
+    logger.error("SMS template for event '%s' not found.", event_type)
+    return None
+
+
+def send_event_sms(event_type, data, to_number, gateway_cfg=None):
+    """Send one SMS for ``event_type``. Returns True if the gateway accepted it."""
+    summary = send_event_sms_bulk(event_type, [(data, to_number)], gateway_cfg)
+    return summary['sent'] == 1
+
+
+def send_event_sms_bulk(event_type, rows, gateway_cfg=None):
+    """Send one SMS per ``(data, to_number)`` row in gateway-sized batches.
+
+    Returns a dict with a ``results`` list (one ``{'to_number', 'sent',
+    'error'}`` entry per row, in input order), ``sent``/``failed`` counts,
+    ``elapsed`` seconds, ``messages_per_second`` and ``batch_latencies``
+    (seconds per gateway call).
+    """
+    started = time.perf_counter()
+    rows = list(rows)
+    if not settings.SEND_SMS:
+        return _sms_summary([(to, False, "SMS sending is disabled") for _, to in rows], [], started)
+    template = get_sms_template(event_type)
+    if template is None:
+        return _sms_summary([(to, False, "template not found") for _, to in rows], [], started)
+    messages = [(to_number, template.safe_substitute(data).strip()) for data, to_number in rows]
+
+    gateway_cfg = gateway_cfg or settings.SMS_GATEWAY
+    backend = get_backend(gateway_cfg)
+    batch_size = gateway_cfg.get('batch_size', 100)
+    batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+
+    def send(batch):
+        batch_started = time.perf_counter()
+        try:
+            outcome = backend.send_batch(batch)
+        except Exception as e:
+            logger.error("SMS batch failed: %s", e)
+            outcome = [(False, str(e))] * len(batch)
+        return outcome, time.perf_counter() - batch_started
+
+    results = []
+    latencies = []
+    workers = max(1, min(gateway_cfg.get('max_concurrent_batches', 4), len(batches)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch, (outcome, latency) in zip(batches, executor.map(send, batches)):
+            latencies.append(latency)
+            for (to_number, _), (sent, error) in zip(batch, outcome):
+                results.append((to_number, sent, error))
+    return _sms_summary(results, latencies, started)
+
+
+def _sms_summary(results, latencies, started):
+    elapsed = time.perf_counter() - started
+    sent = sum(1 for _, ok, _ in results if ok)
+    return {
+        'results': [{'to_number': to, 'sent': ok, 'error': error} for to, ok, error in results],
+        'sent': sent,
+        'failed': len(results) - sent,
+        'elapsed': elapsed,
+        'messages_per_second': sent / elapsed if elapsed > 0 else 0.0,
+        'batch_latencies': latencies,
+    }
@@ -0,0 +1,159 @@
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import OutboxEmail
+from .outbox import claim_batch, deliver_batch, enqueue_email, outbox_stats, process_outbox
+from .sms import get_backend, send_event_sms, send_event_sms_bulk
+
+
+def bulk_result(rows, failing=()):
+    results = [
+        {'to_email': to_email, 'sent': to_email not in failing, 'error': 'refused' if to_email in failing else None}
+        for _, to_email in rows
+    ]
+    return {'results': results}
+
+
+@override_settings(OUTBOX_RETRY_BASE_SECONDS=30, OUTBOX_MAX_ATTEMPTS=2)
+class OutboxTests(TestCase):
+
+    def test_idempotency_key_prevents_duplicates(self):
+        first, created = enqueue_email('payment_received', {'amount': '500'}, 'parent@test.com', 'payment-1')
+        second, created_again = enqueue_email('payment_received', {'amount': '500'}, 'parent@test.com', 'payment-1')
+
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    @patch('notifications.outbox.send_event_emails_bulk')
+    def test_delivery_marks_sent_and_backs_off_failures(self, mock_bulk):
+        mock_bulk.side_effect = lambda event_type, rows, *args: bulk_result(rows, failing={'b@test.com'})
+        enqueue_email('payment_received', {}, 'a@test.com')
+        enqueue_email('payment_received', {}, 'b@test.com')
+
+        self.assertEqual(process_outbox(), (1, 1))
+
+        sent = OutboxEmail.objects.get(recipient='a@test.com')
+        retry = OutboxEmail.objects.get(recipient='b@test.com')
+        self.assertEqual(sent.status, OutboxEmail.SENT)
+        self.assertEqual(retry.status, OutboxEmail.PENDING)
+        self.assertEqual(retry.attempts, 1)
+        self.assertGreaterEqual(retry.next_attempt_at, timezone.now() + timedelta(seconds=29))
+        # Not due yet, so a second pass sends nothing.
+        self.assertEqual(process_outbox(), (0, 0))
+
+    @patch('notifications.outbox.send_event_emails_bulk')
+    def test_gives_up_after_max_attempts(self, mock_bulk):
+        mock_bulk.side_effect = lambda event_type, rows, *args: bulk_result(rows, failing={'b@test.com'})
+        email, _ = enqueue_email('payment_received', {}, 'b@test.com')
+        for _ in range(2):
+            OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            process_outbox()
+
+        self.assertEqual(OutboxEmail.objects.get(pk=email.pk).status, OutboxEmail.FAILED)
+
+    def test_abandoned_claims_are_reclaimed(self):
+        enqueue_email('payment_received', {}, 'a@test.com')
+        self.assertEqual(len(claim_batch()), 1)
+        self.assertEqual(claim_batch(), [])
+
+        OutboxEmail.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(claim_batch()), 1)
+
+    @patch('notifications.outbox.send_event_emails_bulk')
+    def test_expired_claim_does_not_overwrite_the_new_claim(self, mock_bulk):
+        enqueue_email('payment_received', {}, 'a@test.com')
+        stale = claim_batch()
+        OutboxEmail.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+        fresh = claim_batch()
+
+        mock_bulk.side_effect = lambda event_type, rows, *args: bulk_result(rows)
+        self.assertEqual(deliver_batch(fresh), (1, 0))
+        mock_bulk.side_effect = lambda event_type, rows, *args: bulk_result(rows, failing={'a@test.com'})
+        deliver_batch(stale)
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.SENT, 1))
+
+    def test_stats(self):
+        enqueue_email('payment_received', {}, 'a@test.com')
+        OutboxEmail.objects.create(event_type='payment_received', recipient='b@test.com', status=OutboxEmail.SENT)
+
+        stats = outbox_stats()
+
+        self.assertEqual(stats['pending'], 1)
+        self.assertEqual(stats['sent'], 1)
+        self.assertEqual(stats['due'], 1)
+        self.assertIsNotNone(stats['oldest_age_seconds'])
+
+
+LOCAL_GATEWAY = {
+    'backend': 'notifications.sms.LocalSMSBackend',
+    'batch_size': 2,
+    'max_concurrent_batches': 2,
+}
+
+
+class SMSTests(TestCase):
+
+    def setUp(self):
+        self.data = {'parent_name': 'John Doe', 'student_name': 'Jane Doe', 'amount': '500', 'date': '2025-09-15'}
+
+    @override_settings(SEND_SMS=True)
+    def test_bulk_send_batches_messages(self):
+        rows = [(self.data, f'+26377000000{i}') for i in range(5)]
+        summary = send_event_sms_bulk('payment_received', rows, LOCAL_GATEWAY)
+
+        backend = get_backend(LOCAL_GATEWAY)
+        self.assertEqual(summary['sent'], 5)
+        self.assertEqual([r['to_number'] for r in summary['results']], [to for _, to in rows])
+        self.assertEqual(len(summary['batch_latencies']), 3)
+        self.assertIn('payment of 500 for Jane Doe', backend.sent[-1][1])
+
+    @override_settings(SEND_SMS=False)
+    def test_disabled_by_setting(self):
+        self.assertFalse(send_event_sms('payment_received', self.data, '+263770000000', LOCAL_GATEWAY))
+
+    @override_settings(SEND_SMS=True)
+    def test_http_backend_reuses_keep_alive_connection(self):
+        connections = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                connections.append(self.client_address)
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                reply = json.dumps({'accepted': len(body['messages'])}).encode()
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        gateway = {
+            'backend': 'notifications.sms.HTTPSMSBackend',
+            'url': f'http://127.0.0.1:{server.server_port}/messages',
+            'batch_size': 2,
+            'max_concurrent_batches': 1,
+        }
+        rows = [(self.data, f'+26377000000{i}') for i in range(4)]
+
+        summary = send_event_sms_bulk('payment_received', rows, gateway)
+        get_backend(gateway).close()
+
+        self.assertEqual(summary['sent'], 4)
+        self.assertEqual(len(connections), 2)
+        self.assertEqual(len(set(connections)), 1)
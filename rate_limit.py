@@ -0,0 +1,230 @@
+"""
+Adaptive rate limiting for outbound mail.
+
+Each SMTP account (server + user) gets a token bucket refilled at the rate
+configured in ``smtp_cfg['rate_per_minute']``. When the provider answers
+with a throttling reply (421/450/451/452) the rate is cut in half; every
+successful send raises it again by a small step, up to the configured rate
+(additive increase, multiplicative decrease). Throughput settles just under
+the provider's limit instead of bursting into a lockout.
+
+Buckets are shared by all threads of a process. Set
+``smtp_cfg['rate_limit_store']`` to a file path to share them between
+worker processes through a small SQLite database.
+
+Configs without ``rate_per_minute`` are not rate limited.
+"""
+
+import smtplib
+import sqlite3
+import threading
+import time
+
+from email_metrics import add_phase
+
+# Reply codes providers use to tell a client to slow down: 421 service not
+# available / too many connections, 450/451/452 transient failures that
+# Gmail, Office 365 and most relays return for rate or quota limits.
+THROTTLE_CODES = frozenset({421, 450, 451, 452})
+
+# Never slow down below this fraction of the configured rate.
+MIN_RATE_FRACTION = 1 / 64
+# Successful sends needed to climb from a throttled rate back to the
+# configured rate after one halving.
+RECOVERY_SENDS = 50
+
+
+def throttle_code(exc):
+    """Return the throttling reply code carried by ``exc``, or None."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exc.recipients.values()]
+    elif isinstance(exc, smtplib.SMTPResponseException):
+        codes = [exc.smtp_code]
+    else:
+        return None
+    for code in codes:
+        if code in THROTTLE_CODES:
+            return code
+    return None
+
+
+class MemoryBucketState:
+    """State of a single bucket held in this process, guarded by a lock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def transact(self, key, fn):
+        with self._lock:
+            self._state, result = fn(self._state)
+            return result
+
+
+class SQLiteBucketState:
+    """State of every bucket stored in one SQLite file (one row per key) so
+    several worker processes draw from the same buckets. Every update runs
+    in a ``BEGIN IMMEDIATE`` transaction, which serializes writers across
+    processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL, rate REAL, updated REAL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def transact(self, key, fn):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, rate, updated FROM rate_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            state, result = fn(tuple(row) if row else None)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (key, tokens, rate, updated) VALUES (?, ?, ?, ?)",
+                (key,) + state,
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+
+class AdaptiveTokenBucket:
+    """Token bucket whose refill rate adapts to throttling replies.
+
+    ``rate`` is the configured (maximum) rate in messages per second and
+    ``burst`` the number of tokens the bucket holds when full. State is a
+    ``(tokens, rate, updated)`` tuple kept in ``state``.
+    """
+
+    def __init__(self, key, rate, burst=1, state=None, clock=time.time, sleep=time.sleep):
+        self.key = key
+        self.max_rate = rate
+        self.min_rate = rate * MIN_RATE_FRACTION
+        self.increase = rate / 2 / RECOVERY_SENDS
+        self.burst = burst
+        self.state = state or MemoryBucketState()
+        self.clock = clock
+        self.sleep = sleep
+
+    def _refill(self, state):
+        now = self.clock()
+        if state is None:
+            return self.burst, self.max_rate, now
+        tokens, rate, updated = state
+        tokens = min(self.burst, tokens + max(0.0, now - updated) * rate)
+        return tokens, rate, now
+
+    def _take(self, state):
+        tokens, rate, now = self._refill(state)
+        if tokens >= 1:
+            return (tokens - 1, rate, now), 0.0
+        return (tokens, rate, now), (1 - tokens) / rate
+
+    def try_acquire(self):
+        """Take a token if one is available. Returns 0 on success, otherwise
+        the number of seconds until the next token is due."""
+        return self.state.transact(self.key, self._take)
+
+    def acquire(self):
+        """Block until a token is available. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return waited
+            self.sleep(delay)
+            waited += delay
+
+    def on_success(self):
+        def grow(state):
+            tokens, rate, now = self._refill(state)
+            return (tokens, min(self.max_rate, rate + self.increase), now), None
+        self.state.transact(self.key, grow)
+
+    def on_throttle(self):
+        def shrink(state):
+            tokens, rate, now = self._refill(state)
+            # Drop saved-up tokens too, so the next send waits a full interval.
+            return (min(tokens, 0.0), max(self.min_rate, rate / 2), now), None
+        self.state.transact(self.key, shrink)
+
+    @property
+    def rate(self):
+        """Current refill rate in messages per second."""
+        def read(state):
+            state = self._refill(state)
+            return state, state[1]
+        return self.state.transact(self.key, read)
+
+
+class RateLimiter:
+    """Registry of buckets, one per SMTP server and account."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._stores = {}
+
+    def bucket_for(self, smtp_cfg):
+        """The bucket for ``smtp_cfg``, or None if it has no rate configured."""
+        per_minute = smtp_cfg.get('rate_per_minute')
+        if not per_minute:
+            return None
+        key = f"{smtp_cfg['server']}:{smtp_cfg['port']}:{smtp_cfg.get('user', '')}"
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = AdaptiveTokenBucket(
+                    key,
+                    per_minute / 60.0,
+                    burst=smtp_cfg.get('rate_burst', 1),
+                    state=self._state_for(smtp_cfg.get('rate_limit_store')),
+                )
+            return bucket
+
+    def _state_for(self, path):
+        if not path:
+            return None
+        store = self._stores.get(path)
+        if store is None:
+            store = self._stores[path] = SQLiteBucketState(path)
+        return store
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+default_limiter = RateLimiter()
+
+
+def send_rate_limited(smtp_cfg, send):
+    """Run ``send()`` once the account's bucket allows it, and feed the
+    outcome back into the bucket. Exceptions from ``send`` propagate."""
+    bucket = default_limiter.bucket_for(smtp_cfg)
+    if bucket is None:
+        return send()
+    add_phase('rate_wait', bucket.acquire())
+    try:
+        result = send()
+    except Exception as exc:
+        if throttle_code(exc) is not None:
+            bucket.on_throttle()
+        raise
+    bucket.on_success()
+    return result
@@ -0,0 +1,179 @@
+"""
+Caching for the school directory.
+
+Rendered directory pages are cached under a key that includes a directory
+*version*. ``post_save``/``post_delete`` signals on ``School`` bump the
+version, so every cached page goes stale at once without anything having
+to be deleted. The bump time is the directory's Last-Modified, and the
+version feeds the ETag, so browsers revalidate with a 304. A view reads
+the version once, with ``directory_state()``, and uses it for both the
+validators and the page key, so a bump in between cannot pair a new ETag
+with an old page or the reverse.
+
+Card fragments are cached per school under a digest of the fields the card
+shows. A page rebuilt after an edit therefore only re-renders the cards
+that changed.
+
+Use a cache shared by all workers (e.g. ``FileBasedCache``) when running
+more than one process. With ``LocMemCache`` each process has its own
+version, and a bump is only seen by the process that made it.
+"""
+
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+VERSION_KEY = 'schools:directory:version'
+MODIFIED_KEY = 'schools:directory:modified'
+
+
+def get_cache():
+    return caches[getattr(settings, 'SCHOOLS_CACHE_ALIAS', 'default')]
+
+
+def page_timeout():
+    return getattr(settings, 'SCHOOLS_CACHE_TIMEOUT', 600)
+
+
+class CacheStats:
+    """Hit/miss counters per kind of cached object, for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, kind, hits=0, misses=0):
+        with self._lock:
+            counts = self._counts.setdefault(kind, {'hits': 0, 'misses': 0})
+            counts['hits'] += hits
+            counts['misses'] += misses
+
+    def snapshot(self):
+        """``{kind: {'hits', 'misses', 'hit_rate'}}``"""
+        with self._lock:
+            result = {}
+            for kind, counts in self._counts.items():
+                total = counts['hits'] + counts['misses']
+                result[kind] = dict(counts, hit_rate=counts['hits'] / total if total else None)
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+stats = CacheStats()
+
+
+def directory_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock so ETags from before a cache restart never
+        # match; add() so concurrent cold starts agree on one value.
+        now = time.time()
+        cache.add(VERSION_KEY, int(now * 1000), timeout=None)
+        cache.add(MODIFIED_KEY, int(now), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def directory_last_modified():
+    """Unix time of the last change to any school (as far as the cache knows)."""
+    cache = get_cache()
+    modified = cache.get(MODIFIED_KEY)
+    if modified is None:
+        directory_version()
+        modified = cache.get(MODIFIED_KEY, int(time.time()))
+    return modified
+
+
+def directory_state():
+    """``(version, last_modified)``. The time is read first: a bump between
+    the two reads then pairs a new version with an older time, which only
+    makes clients revalidate sooner."""
+    state = get_cache().get_many([MODIFIED_KEY, VERSION_KEY])
+    if VERSION_KEY not in state or MODIFIED_KEY not in state:
+        return directory_version(), directory_last_modified()
+    return state[VERSION_KEY], state[MODIFIED_KEY]
+
+
+def bump_directory_version():
+    cache = get_cache()
+    now = time.time()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(now * 1000), timeout=None)
+    cache.set(MODIFIED_KEY, int(now), timeout=None)
+
+
+def page_key(kind, params, version=None):
+    """Key for a cached page of ``kind`` with the given request parameters,
+    under ``version`` (the current directory version by default)."""
+    raw = json.dumps(sorted(params.items()), separators=(',', ':'))
+    digest = hashlib.blake2b(raw.encode('utf-8'), digest_size=12).hexdigest()
+    if version is None:
+        version = directory_version()
+    return f'schools:{kind}:{version}:{digest}'
+
+
+def page_etag(kind, params, version=None):
+    """ETag for a page: changes whenever the directory version does."""
+    return page_key(kind, params, version).split(':', 2)[2].replace(':', '-')
+
+
+def cached_page(kind, params, build, version=None):
+    """Return the cached value for this page, calling ``build()`` on a miss."""
+    cache = get_cache()
+    key = page_key(kind, params, version)
+    value = cache.get(key)
+    if value is not None:
+        stats.record(kind, hits=1)
+        return value
+    stats.record(kind, misses=1)
+    value = build()
+    cache.set(key, value, page_timeout())
+    return value
+
+
+async def acached_page(kind, params, build, version=None):
+    """``cached_page`` for async views: ``build()`` returns an awaitable."""
+    cache = get_cache()
+    key = page_key(kind, params, version)
+    value = await cache.aget(key)
+    if value is not None:
+        stats.record(kind, hits=1)
+        return value
+    stats.record(kind, misses=1)
+    value = await build()
+    await cache.aset(key, value, page_timeout())
+    return value
+
+
+def card_key(school, fields):
+    values = [getattr(school, field) for field in fields]
+    raw = json.dumps([getattr(value, 'name', value) for value in values], default=str, separators=(',', ':'))
+    return f'schools:card:{school.pk}:' + hashlib.blake2b(raw.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def cached_cards(schools, fields, render_card):
+    """Return the rendered card for each school, rendering only cache misses."""
+    cache = get_cache()
+    keys = [card_key(school, fields) for school in schools]
+    found = cache.get_many(keys)
+    missing = {}
+    cards = []
+    for key, school in zip(keys, schools):
+        card = found.get(key)
+        if card is None:
+            card = missing[key] = render_card(school)
+        cards.append(card)
+    if missing:
+        cache.set_many(missing, page_timeout())
+    stats.record('card', hits=len(found), misses=len(missing))
+    return cards
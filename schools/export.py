@@ -0,0 +1,133 @@
+"""
+Streaming export of the school directory.
+
+Rows are read with ``QuerySet.iterator(chunk_size=...)`` and encoded as CSV
+or JSON Lines a block at a time, optionally gzip-compressed as they go. Only
+one block is ever held in memory, so the same generators back both the
+owner-only download (``StreamingHttpResponse``) and ``manage.py
+export_schools``. The download holds a school owner's own schools;
+superusers and the billing owner get every school.
+
+Pass ``since`` to export only rows changed at or after a timestamp. Take
+the ``as_of`` time of one export as the ``since`` of the next to pick up
+every later change.
+"""
+
+import csv
+import datetime
+import io
+import json
+import zlib
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import School
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson'}
+COLUMNS = ('id', 'name', 'address', 'subdomain', 'owner', 'logo', 'created_at', 'updated_at')
+DEFAULT_CHUNK_SIZE = 2000
+# Rows encoded into one yielded block.
+ROWS_PER_BLOCK = 500
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_since(value):
+    """Parse an ISO date or datetime; naive values are in the current time zone."""
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        day = parse_date(value) if moment is None else None
+    except ValueError:
+        # Well formed but impossible, like '2021-13-01'.
+        raise ExportError(f"Invalid timestamp: {value!r}") from None
+    if moment is None:
+        if day is None:
+            raise ExportError(f"Invalid timestamp: {value!r}")
+        moment = datetime.datetime.combine(day, datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_queryset(name=None, owner=None, since=None):
+    """Schools to export, oldest id first."""
+    queryset = School.objects.order_by('id')
+    if name:
+        queryset = queryset.filter(name__icontains=name)
+    if owner:
+        queryset = queryset.filter(owner__username=owner)
+    if since:
+        queryset = queryset.filter(updated_at__gte=since)
+    return queryset.values_list(
+        'id', 'name', 'address', 'subdomain', 'owner__username', 'logo', 'created_at', 'updated_at'
+    )
+
+
+def iter_records(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    for pk, name, address, subdomain, owner, logo, created_at, updated_at in queryset.iterator(chunk_size):
+        yield (
+            pk, name, address, subdomain or '', owner,
+            default_storage.url(logo) if logo else '',
+            created_at.isoformat(), updated_at.isoformat(),
+        )
+
+
+def _blocks(records):
+    block = []
+    for record in records:
+        block.append(record)
+        if len(block) >= ROWS_PER_BLOCK:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def iter_csv(records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for block in _blocks(records):
+        writer.writerows(block)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_jsonl(records):
+    for block in _blocks(records):
+        yield ''.join(
+            json.dumps(dict(zip(COLUMNS, record)), ensure_ascii=False) + '\n' for record in block
+        ).encode('utf-8')
+
+
+def gzip_stream(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(fmt='csv', compress=False, chunk_size=DEFAULT_CHUNK_SIZE, **filters):
+    """Byte chunks of the export in ``fmt``; see ``export_queryset`` for filters."""
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format: {fmt!r}")
+    records = iter_records(export_queryset(**filters), chunk_size)
+    chunks = iter_csv(records) if fmt == 'csv' else iter_jsonl(records)
+    return gzip_stream(chunks) if compress else chunks
+
+
+def export_filename(fmt, compress=False, as_of=None):
+    stamp = (as_of or timezone.now()).strftime('%Y%m%dT%H%M%SZ')
+    return f"schools-{stamp}.{fmt}" + ('.gz' if compress else '')
@@ -0,0 +1,186 @@
+"""
+Bulk import of schools from CSV or JSON Lines.
+
+Rows are streamed from the file one at a time, validated, and inserted with
+``bulk_create`` in batches, each batch in its own transaction. Memory use
+depends on the batch size, not the file size. Each batch's transaction
+also saves the position reached to an ``ImportCheckpoint`` row, so the
+checkpoint never runs ahead of or behind the committed rows. A run that
+fails part-way can then be restarted with ``resume=True`` and carries on
+after the last committed batch, without importing any row twice.
+
+Columns: ``name`` (required), ``owner`` (a username, required),
+``address`` and ``subdomain`` (optional). ``.gz`` files are decompressed
+on the fly.
+"""
+
+import csv
+import gzip
+import json
+import os
+import time
+from collections import namedtuple
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_slug
+from django.db import transaction
+
+from .cache import bump_directory_version
+from .models import ImportCheckpoint, School
+from .search import index_rows
+
+FORMATS = ('csv', 'jsonl')
+DEFAULT_BATCH_SIZE = 500
+
+ImportResult = namedtuple('ImportResult', 'imported invalid resumed_from elapsed')
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    raise ValueError(f"Cannot tell the format of {path}; pass csv or jsonl")
+
+
+def open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def read_rows(path, fmt=None):
+    """Yield ``(row_number, dict)`` for each record, numbered from 1.
+    Unparseable JSON lines are yielded as ``(row_number, RowError)``."""
+    fmt = fmt or detect_format(path)
+    with open_text(path) as stream:
+        if fmt == 'csv':
+            for number, row in enumerate(csv.DictReader(stream), 1):
+                yield number, row
+            return
+        number = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, RowError(f"invalid JSON: {e}")
+                continue
+            yield number, row if isinstance(row, dict) else RowError("expected a JSON object")
+
+
+def _text(row, field, max_length, required=False):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f"{field} is required")
+    if len(value) > max_length:
+        raise RowError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def build_school(row, owner_ids):
+    """Validate one row and return an unsaved ``School``; raises ``RowError``."""
+    if isinstance(row, Exception):
+        raise row
+    name = _text(row, 'name', 255, required=True)
+    username = _text(row, 'owner', 150, required=True)
+    owner_id = owner_ids.get(username)
+    if owner_id is None:
+        raise RowError(f"unknown owner {username!r}")
+    subdomain = _text(row, 'subdomain', 63).lower() or None
+    if subdomain:
+        try:
+            validate_slug(subdomain)
+        except ValidationError:
+            raise RowError(f"invalid subdomain {subdomain!r}")
+    return School(name=name, owner_id=owner_id, address=_text(row, 'address', 255), subdomain=subdomain)
+
+
+def _drop_taken_subdomains(batch, on_error):
+    """Reject rows whose subdomain is already used, so one clash cannot fail
+    the whole batch. Returns the remaining rows."""
+    wanted = {school.subdomain for _, school in batch if school.subdomain}
+    if not wanted:
+        return batch
+    taken = set(School.objects.filter(subdomain__in=wanted).values_list('subdomain', flat=True))
+    kept = []
+    for number, school in batch:
+        if school.subdomain and school.subdomain in taken:
+            on_error(number, f"subdomain {school.subdomain!r} is already taken")
+            continue
+        if school.subdomain:
+            taken.add(school.subdomain)
+        kept.append((number, school))
+    return kept
+
+
+def import_schools(path, fmt=None, batch_size=DEFAULT_BATCH_SIZE, checkpoint=None, resume=False,
+                   dry_run=False, on_error=None, on_progress=None):
+    """Import schools from ``path``; returns an ``ImportResult``.
+
+    ``checkpoint`` names the run's ``ImportCheckpoint``; it defaults to the
+    file's absolute path. ``on_error(row_number, message)`` is called for
+    each rejected row and ``on_progress(imported, rows_per_second)`` after
+    each batch."""
+    on_error = on_error or (lambda number, message: None)
+    source = os.path.abspath(path)
+    checkpoint = checkpoint or source
+    state = ImportCheckpoint.objects.filter(name=checkpoint).first() if resume else None
+    if state and state.path != source:
+        raise ValueError(f"Checkpoint {checkpoint} belongs to {state.path}")
+    resumed_from = state.row if state else 0
+    imported = initially_imported = state.imported if state else 0
+    invalid = 0
+
+    User = get_user_model()
+    owner_ids = dict(User.objects.values_list(User.USERNAME_FIELD, 'id'))
+    started = time.perf_counter()
+
+    def flush(batch, last_row):
+        nonlocal imported, invalid
+        checked = _drop_taken_subdomains(batch, on_error)
+        invalid += len(batch) - len(checked)
+        batch = checked
+        if not dry_run:
+            with transaction.atomic():
+                created = School.objects.bulk_create([school for _, school in batch])
+                # bulk_create sends no signals: keep search and caches in step.
+                index_rows((school.pk, school.name, school.address) for school in created)
+                ImportCheckpoint.objects.update_or_create(
+                    name=checkpoint, defaults={'path': source, 'row': last_row, 'imported': imported + len(batch)}
+                )
+                transaction.on_commit(bump_directory_version)
+        imported += len(batch)
+        if on_progress:
+            elapsed = time.perf_counter() - started
+            on_progress(imported, (imported - initially_imported) / elapsed if elapsed else 0.0)
+
+    batch, last_row = [], resumed_from
+    for number, row in read_rows(path, fmt):
+        if number <= resumed_from:
+            continue
+        last_row = number
+        try:
+            batch.append((number, build_school(row, owner_ids)))
+        except RowError as e:
+            invalid += 1
+            on_error(number, str(e))
+        if len(batch) >= batch_size:
+            flush(batch, last_row)
+            batch = []
+    if batch or last_row > resumed_from:
+        flush(batch, last_row)
+
+    if not dry_run:
+        ImportCheckpoint.objects.filter(name=checkpoint).delete()
+    return ImportResult(imported, invalid, resumed_from, time.perf_counter() - started)
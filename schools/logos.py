@@ -0,0 +1,121 @@
+"""
+Pre-sized logo variants for the school directory.
+
+Uploaded logos are kept as-is, and square WebP variants are generated at
+the widths in ``LOGO_VARIANT_WIDTHS`` (80px for the directory card, plus
+160px and 320px for 2x/4x screens). Generation runs on a background thread
+pool after the upload's transaction commits, so the ``school_profile`` POST
+never waits on Pillow. ``manage.py backfill_logo_variants`` processes
+existing logos on a process pool. Logos and variants are read and written
+through ``default_storage``, so they need not be on the local disk.
+
+``School.logo_variants`` records which upload the variants were made from,
+so a stale set is never served for a newer logo.
+"""
+
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+
+LOGO_VARIANT_WIDTHS = (80, 160, 320)
+LOGO_VARIANT_QUALITY = 80
+LOGO_VARIANT_DIR = 'school_logos/variants'
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_name(logo_name, width):
+    stem = os.path.splitext(os.path.basename(logo_name))[0]
+    return f"{LOGO_VARIANT_DIR}/{stem}_{width}.webp"
+
+
+def render_variants(source, widths=LOGO_VARIANT_WIDTHS):
+    """Return ``{width: webp_bytes}``: a square, centre-cropped WebP of the
+    image bytes ``source`` for each width. No storage or database access,
+    so it can run in a worker process."""
+    from PIL import Image, ImageOps
+
+    rendered = {}
+    with Image.open(io.BytesIO(source)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        for width in widths:
+            variant = ImageOps.fit(image, (width, width), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            variant.save(out, 'WEBP', quality=LOGO_VARIANT_QUALITY, method=4)
+            rendered[width] = out.getvalue()
+    return rendered
+
+
+def read_logo(logo_name):
+    with default_storage.open(logo_name, 'rb') as f:
+        return f.read()
+
+
+def save_variants(logo_name, rendered):
+    """Write rendered variants to storage, replacing older ones; returns
+    ``{width: name}``."""
+    names = {}
+    for width, data in rendered.items():
+        name = variant_name(logo_name, width)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        names[width] = default_storage.save(name, ContentFile(data))
+    return names
+
+
+def record_variants(school_id, logo_name, names):
+    """Store the generated variants, unless the logo changed meanwhile."""
+    from .cache import bump_directory_version
+    from .models import School
+
+    variants = {'source': logo_name}
+    variants.update({str(width): name for width, name in names.items()})
+    if School.objects.filter(pk=school_id, logo=logo_name).update(logo_variants=variants):
+        # update() sends no signals; cached cards must pick up the srcset.
+        bump_directory_version()
+
+
+def generate_variants(school_id, logo_name):
+    names = save_variants(logo_name, render_variants(read_logo(logo_name)))
+    record_variants(school_id, logo_name, names)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'LOGO_VARIANT_WORKERS', 2),
+                thread_name_prefix='logo-variants',
+            )
+        return _executor
+
+
+def _generate_in_background(school_id, logo_name):
+    # Pool threads live on between jobs: handle their database connection
+    # the way Django does around a request.
+    close_old_connections()
+    try:
+        generate_variants(school_id, logo_name)
+    except Exception:
+        logger.exception("Failed to generate logo variants for school %s", school_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(school):
+    """Queue variant generation for ``school``'s current logo once the
+    surrounding transaction commits."""
+    school_id, logo_name = school.pk, school.logo.name
+    transaction.on_commit(lambda: _get_executor().submit(_generate_in_background, school_id, logo_name))
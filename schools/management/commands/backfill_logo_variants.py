@@ -0,0 +1,63 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+
+from schools.logos import read_logo, record_variants, render_variants, save_variants
+from schools.models import School
+
+
+class Command(BaseCommand):
+    help = "Generate missing WebP logo variants for existing schools, in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count).")
+        parser.add_argument('--force', action='store_true', help="Regenerate variants that already exist.")
+
+    def handle(self, *args, **options):
+        pending = []
+        for pk, logo, variants in School.objects.exclude(logo='').exclude(logo__isnull=True).values_list(
+            'id', 'logo', 'logo_variants'
+        ).iterator():
+            if options['force'] or (variants or {}).get('source') != logo:
+                pending.append((pk, logo))
+        if not pending:
+            self.stdout.write("All logo variants are up to date.")
+            return
+
+        started = time.perf_counter()
+        done = failed = 0
+        workers = options['workers'] or os.cpu_count() or 1
+        # Decoding and resizing is CPU-bound, so it runs in processes; only
+        # this process touches storage and the database. A few logos per
+        # worker are read ahead, not the whole backlog.
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            queue, futures = iter(pending), {}
+            while True:
+                for pk, logo in queue:
+                    try:
+                        futures[executor.submit(render_variants, read_logo(logo))] = (pk, logo)
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"School {pk}: {logo}: {e}")
+                        continue
+                    if len(futures) >= workers * 2:
+                        break
+                if not futures:
+                    break
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pk, logo = futures.pop(future)
+                    try:
+                        record_variants(pk, logo, save_variants(logo, future.result()))
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"School {pk}: {logo}: {e}")
+                        continue
+                    done += 1
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated variants for {done} logos ({failed} failed) in {elapsed:.2f}s"
+        ))
@@ -0,0 +1,53 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from legacygrid_school_management.db import replica_reads
+from schools.export import DEFAULT_CHUNK_SIZE, FORMATS, ExportError, export_chunks, parse_since
+
+
+class Command(BaseCommand):
+    help = "Stream the school directory as CSV or JSON Lines, optionally gzipped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--gzip', action='store_true', help="Compress the output.")
+        parser.add_argument('--output', '-o', default='-', help="File to write (default: stdout).")
+        parser.add_argument('--since', help="Only rows changed at or after this ISO date/time.")
+        parser.add_argument('--name', help="Only schools whose name contains this text.")
+        parser.add_argument('--owner', help="Only schools owned by this username.")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Rows fetched per query.")
+
+    def handle(self, *args, **options):
+        as_of = timezone.now()
+        started = time.perf_counter()
+        try:
+            chunks = export_chunks(
+                options['format'],
+                compress=options['gzip'],
+                chunk_size=options['chunk_size'],
+                name=options['name'],
+                owner=options['owner'],
+                since=parse_since(options['since']),
+            )
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        written = 0
+        out = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            for chunk in replica_reads(chunks):
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+            else:
+                out.flush()
+
+        self.stderr.write(
+            f"Wrote {written} bytes in {time.perf_counter() - started:.2f}s; "
+            f"next incremental export: --since {as_of.isoformat()}"
+        )
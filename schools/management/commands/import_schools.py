@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from schools.importer import DEFAULT_BATCH_SIZE, FORMATS, import_schools
+
+
+class Command(BaseCommand):
+    help = "Import schools from a CSV or JSON Lines file (optionally .gz) in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File with name, owner, address and subdomain columns.")
+        parser.add_argument('--format', choices=FORMATS, default=None, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Rows inserted per transaction.")
+        parser.add_argument('--checkpoint', default=None, help="Checkpoint name (default: the file's absolute path).")
+        parser.add_argument('--resume', action='store_true', help="Continue after the last committed batch.")
+        parser.add_argument('--dry-run', action='store_true', help="Validate only; nothing is written.")
+
+    def handle(self, *args, **options):
+        def on_error(row, message):
+            self.stderr.write(f"Row {row}: {message}")
+
+        def on_progress(imported, rate):
+            self.stdout.write(f"Imported {imported} schools ({rate:.0f} rows/s)")
+
+        try:
+            result = import_schools(
+                options['path'],
+                fmt=options['format'],
+                batch_size=max(1, options['batch_size']),
+                checkpoint=options['checkpoint'],
+                resume=options['resume'],
+                dry_run=options['dry_run'],
+                on_error=on_error,
+                on_progress=on_progress,
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        if result.resumed_from:
+            self.stdout.write(f"Resumed after row {result.resumed_from}")
+        verb = "Validated" if options['dry_run'] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {result.imported} schools, {result.invalid} rows rejected, in {result.elapsed:.2f}s"
+        ))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from schools.search import fts_enabled, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for schools."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows read and inserted per batch.")
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            self.stdout.write("Full-text index is only used on SQLite; nothing to rebuild.")
+            return
+        started = time.perf_counter()
+        total = rebuild_index(options['chunk_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} schools in {elapsed:.2f}s"))
@@ -0,0 +1,44 @@
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.functional import SimpleLazyObject
+
+from .tenancy import aget_school, reset_current_school, resolve_school, set_current_school
+
+
+class TenantMiddleware:
+    """Attach the active school as ``request.school`` and scope tenant-owned
+    queries to it. Resolved lazily, at most once per request. Must come
+    after ``AuthenticationMiddleware``.
+
+    Async views use ``await request.aschool()``: resolving the school may
+    query the database, which ``request.school`` would do on the event loop."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self.process_request(request)
+        try:
+            return self.get_response(request)
+        finally:
+            reset_current_school(token)
+
+    async def __acall__(self, request):
+        token = self.process_request(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            reset_current_school(token)
+
+    def process_request(self, request):
+        request.school = SimpleLazyObject(lambda: resolve_school(request))
+        request.aschool = partial(aget_school, request)
+        return set_current_school(request.school)
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='school',
+            index=models.Index(fields=['name', 'id'], name='school_name_id_idx'),
+        ),
+    ]
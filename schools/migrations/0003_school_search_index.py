@@ -0,0 +1,36 @@
+from django.db import migrations
+
+CREATE_FTS_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS schools_school_fts USING fts5("
+    "name, address, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    School = apps.get_model('schools', 'School')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(CREATE_FTS_SQL)
+        cursor.executemany(
+            "INSERT INTO schools_school_fts (rowid, name, address) VALUES (%s, %s, %s)",
+            list(School.objects.values_list('id', 'name', 'address')),
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS schools_school_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0002_school_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0003_school_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='school',
+            name='logo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0004_school_logo_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='school',
+            name='subdomain',
+            field=models.SlugField(blank=True, max_length=63, null=True, unique=True),
+        ),
+    ]
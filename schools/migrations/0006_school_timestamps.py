@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0005_school_subdomain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='school',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='school',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
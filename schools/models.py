@@ -1,11 +1,62 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 class School(models.Model):
     name = models.CharField(max_length=255)
     logo = models.ImageField(upload_to='school_logos/', blank=True, null=True)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="owned_schools")
     address = models.CharField(max_length=255, blank=True)
+    # Serves the school at <subdomain>.<TENANT_BASE_DOMAIN>.
+    subdomain = models.SlugField(max_length=63, unique=True, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Indexed for incremental exports (rows changed since a timestamp).
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # WebP thumbnails keyed by width, plus the 'source' logo they were made
+    # from; filled in by schools.logos after an upload.
+    logo_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Supports the (name, id) keyset ordering of the directory.
+            models.Index(fields=['name', 'id'], name='school_name_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+    def ready_logo_variants(self):
+        """``[(width, url)]`` for variants made from the current logo."""
+        from django.core.files.storage import default_storage
+
+        variants = self.logo_variants or {}
+        if not self.logo or variants.get('source') != self.logo.name:
+            return []
+        return sorted(
+            (int(width), default_storage.url(name)) for width, name in variants.items() if width != 'source'
+        )
+
+    @property
+    def logo_thumbnail_url(self):
+        variants = self.ready_logo_variants()
+        if variants:
+            return variants[0][1]
+        return self.logo.url if self.logo else None
+
+    @property
+    def logo_srcset(self):
+        return ', '.join(f'{url} {width}w' for width, url in self.ready_logo_variants())
+
+
+class ImportCheckpoint(models.Model):
+    """Progress of a ``manage.py import_schools`` run, saved in the
+    transaction of each batch so ``--resume`` never imports a row twice."""
+
+    name = models.CharField(max_length=500, unique=True)
+    path = models.CharField(max_length=500)
+    row = models.PositiveIntegerField(default=0)
+    imported = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} (after row {self.row})"
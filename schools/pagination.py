@@ -0,0 +1,72 @@
+"""
+Keyset pagination for the school directory.
+
+Pages are ordered by ``(name, id)`` and the cursor encodes the last row of
+the previous page, so fetching any page is one indexed range scan no matter
+how deep it is (unlike OFFSET, which reads and discards every earlier row).
+"""
+
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(school):
+    raw = json.dumps([school.name, school.pk], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(name, id)`` from a cursor string; raises ``InvalidCursor``."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        name, pk = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as e:
+        raise InvalidCursor(str(e))
+    if not isinstance(name, str) or not isinstance(pk, int):
+        raise InvalidCursor("Malformed cursor")
+    return name, pk
+
+
+def parse_page_size(value):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _page_query(queryset, cursor, page_size):
+    queryset = queryset.order_by('name', 'id')
+    if cursor:
+        name, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(name__gt=name) | Q(name=name, id__gt=pk))
+    # One extra row tells us whether another page exists without a COUNT.
+    return queryset[:page_size + 1]
+
+
+def _split_page(rows, page_size):
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def keyset_page(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Return ``(rows, next_cursor)`` for the page after ``cursor``.
+    ``next_cursor`` is None on the last page."""
+    return _split_page(list(_page_query(queryset, cursor, page_size)), page_size)
+
+
+async def akeyset_page(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """``keyset_page`` with the async ORM, for async views."""
+    return _split_page([row async for row in _page_query(queryset, cursor, page_size)], page_size)
@@ -0,0 +1,128 @@
+"""
+Full-text search over school names and addresses.
+
+On SQLite the schools are mirrored into an FTS5 virtual table (rowid =
+school id) with prefix indexes, so type-ahead queries like ``"chis hig"``
+are answered from the index and ranked with bm25, name matches weighing
+more than address matches. ``post_save``/``post_delete`` signals keep the
+table in sync; ``manage.py rebuild_school_search`` rebuilds it in bulk.
+
+Other databases fall back to ``icontains`` filtering ordered by name.
+"""
+
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import School
+
+# Created by migration 0003_school_search_index.
+FTS_TABLE = 'schools_school_fts'
+# bm25 column weights: (name, address).
+NAME_WEIGHT = 10.0
+ADDRESS_WEIGHT = 1.0
+MAX_RESULTS = 50
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_enabled(using=None):
+    return (using or connection).vendor == 'sqlite'
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text or '')
+
+
+def build_match_query(text):
+    """Turn user input into an FTS5 query where every word must match as a
+    prefix, for type-ahead. Words are quoted so FTS5 operators in the input
+    are treated as text."""
+    tokens = tokenize(text)
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def index_school(school):
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [school.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, address) VALUES (%s, %s, %s)",
+            [school.pk, school.name, school.address],
+        )
+
+
+def remove_school(school_id):
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [school_id])
+
+
+def index_rows(rows):
+    """Insert ``(id, name, address)`` rows that are not in the index yet,
+    e.g. right after a ``bulk_create`` (which sends no signals)."""
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, address) VALUES (%s, %s, %s)", list(rows)
+        )
+
+
+def rebuild_index(chunk_size=2000):
+    """Recreate the index from the schools table. Returns the rows indexed."""
+    if not fts_enabled():
+        return 0
+    total = 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        batch = []
+        for row in School.objects.values_list('id', 'name', 'address').iterator(chunk_size=chunk_size):
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                index_rows(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            index_rows(batch)
+            total += len(batch)
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return total
+
+
+def search_schools(text, limit=20, fields=('id', 'name', 'address', 'logo')):
+    """Return up to ``limit`` schools matching ``text``, best match first."""
+    limit = max(1, min(limit, MAX_RESULTS))
+    if not fts_enabled():
+        return _search_fallback(text, limit, fields)
+    match = build_match_query(text)
+    if match is None:
+        return []
+    columns = ', '.join(f's."{field}"' for field in fields)
+    # Rank and limit inside the FTS table first, so only the top rows are
+    # joined back to the schools table.
+    return list(School.objects.raw(
+        f"SELECT {columns} FROM ("
+        f"  SELECT rowid, bm25({FTS_TABLE}, {NAME_WEIGHT}, {ADDRESS_WEIGHT}) AS score"
+        f"  FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY score LIMIT %s"
+        f") f JOIN {School._meta.db_table} s ON s.id = f.rowid "
+        f"ORDER BY f.score, s.name",
+        [match, limit],
+    ))
+
+
+def _search_fallback(text, limit, fields):
+    tokens = tokenize(text)
+    if not tokens:
+        return []
+    queryset = School.objects.only(*fields)
+    for token in tokens:
+        queryset = queryset.filter(Q(name__icontains=token) | Q(address__icontains=token))
+    return list(queryset.order_by('name', 'id')[:limit])
@@ -0,0 +1,33 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_directory_version
+from .logos import schedule_variants
+from .models import School
+from .search import index_school, remove_school
+
+
+@receiver(post_save, sender=School)
+def update_search_index(sender, instance, **kwargs):
+    index_school(instance)
+
+
+@receiver(post_save, sender=School)
+def queue_logo_variants(sender, instance, raw=False, **kwargs):
+    if raw or not instance.logo:
+        return
+    if (instance.logo_variants or {}).get('source') != instance.logo.name:
+        schedule_variants(instance)
+
+
+@receiver(post_delete, sender=School)
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_school(instance.pk)
+
+
+@receiver(post_save, sender=School)
+@receiver(post_delete, sender=School)
+def invalidate_directory_cache(sender, **kwargs):
+    # After commit, so a page rebuilt under the new version sees the change.
+    transaction.on_commit(bump_directory_version)
@@ -0,0 +1,167 @@
+"""
+The active school ("tenant") for a request.
+
+``TenantMiddleware`` attaches ``request.school``: the school named by the
+request's subdomain (when ``TENANT_BASE_DOMAIN`` is set; None unless the
+signed-in user owns it), else the school
+the signed-in owner picked with ``switch_school`` (kept in the session),
+else their first school. Owner-to-school and subdomain-to-school mappings,
+as well as the school rows themselves, are cached under the directory
+version from ``schools.cache``, so any change to a school invalidates them.
+Async views use ``await request.aschool()``, which resolves it in a thread.
+
+The active school is also kept in a context variable for the duration of
+the request, and ``TenantScopedManager`` uses it to filter tenant-owned
+models automatically. Outside a request (shell, management commands)
+nothing is filtered.
+"""
+
+import contextvars
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import models
+from django.utils.functional import SimpleLazyObject, empty
+
+from .cache import directory_version, get_cache, page_timeout
+
+SESSION_KEY = 'active_school_id'
+
+_UNSET = object()
+_current_school = contextvars.ContextVar('current_school', default=_UNSET)
+
+
+class _Active:
+    # asgiref compares context values when it copies contexts between the
+    # event loop and its threads; a lazy school compared directly would be
+    # resolved there, on the event loop. This holder compares by identity.
+    __slots__ = ('school',)
+
+    def __init__(self, school):
+        self.school = school
+
+
+def get_current_school():
+    """The active school, None when the request has none, or ``_UNSET``
+    outside a request."""
+    active = _current_school.get()
+    return active if active is _UNSET else active.school
+
+
+def set_current_school(school):
+    """Make ``school`` (or a lazy object resolving to it) the active school;
+    returns a token for ``reset_current_school``."""
+    return _current_school.set(_Active(school))
+
+
+def reset_current_school(token):
+    _current_school.reset(token)
+
+
+def _cached(key, load):
+    cache = get_cache()
+    key = f'schools:tenant:{directory_version()}:{key}'
+    value = cache.get(key, _UNSET)
+    if value is _UNSET:
+        value = load()
+        cache.set(key, value, page_timeout())
+    return value
+
+
+def owned_school_ids(user):
+    """Ids of the schools ``user`` owns, oldest first."""
+    from .models import School
+
+    if not getattr(user, 'is_authenticated', False):
+        return []
+    return _cached(f'owner:{user.pk}', lambda: list(
+        School.objects.filter(owner_id=user.pk).order_by('id').values_list('id', flat=True)
+    ))
+
+
+def school_for_subdomain(subdomain):
+    from .models import School
+
+    return _cached(f'subdomain:{subdomain}', lambda: (
+        School.objects.filter(subdomain=subdomain).values_list('id', flat=True).first()
+    ))
+
+
+def get_school(school_id):
+    from .models import School
+
+    return _cached(f'school:{school_id}', lambda: School.objects.filter(pk=school_id).first())
+
+
+def subdomain_from_host(host, base_domain):
+    """``'chisipite'`` for ``'chisipite.example.com'`` when the base domain
+    is ``'example.com'``; None for the bare domain or other hosts."""
+    host = host.split(':', 1)[0].lower()
+    base_domain = base_domain.lower().lstrip('.')
+    if not host.endswith('.' + base_domain):
+        return None
+    subdomain = host[:-len(base_domain) - 1]
+    return subdomain if subdomain and '.' not in subdomain else None
+
+
+def resolve_school(request):
+    """Work out the active school for ``request`` (see the module docstring)."""
+    base_domain = getattr(settings, 'TENANT_BASE_DOMAIN', None)
+    if base_domain:
+        subdomain = subdomain_from_host(request.get_host(), base_domain)
+        if subdomain:
+            school_id = school_for_subdomain(subdomain)
+            # Only the school's owner works inside it; anyone else gets no
+            # active school rather than someone else's.
+            if school_id and school_id in owned_school_ids(getattr(request, 'user', None)):
+                return get_school(school_id)
+            return None
+
+    owned = owned_school_ids(getattr(request, 'user', None))
+    if not owned:
+        return None
+    school_id = request.session.get(SESSION_KEY) if hasattr(request, 'session') else None
+    if school_id not in owned:
+        school_id = owned[0]
+    return get_school(school_id)
+
+
+async def aget_school(request):
+    """``request.school`` for async views (``await request.aschool()``).
+    Resolving it may query the database, so that runs in a thread."""
+    school = request.school
+    if isinstance(school, SimpleLazyObject):
+        if school._wrapped is empty:
+            await sync_to_async(school._setup)()
+        school = school._wrapped
+    return school
+
+
+def switch_school(request, school_id):
+    """Make one of the user's own schools the active one. Returns False if
+    the user does not own it."""
+    if school_id not in owned_school_ids(request.user):
+        return False
+    request.session[SESSION_KEY] = school_id
+    return True
+
+
+class TenantScopedManager(models.Manager):
+    """Manager that limits queries to the active school.
+
+    Inside a request with no active school it returns nothing; outside a
+    request it does not filter. Keep a plain ``models.Manager`` alongside
+    for cross-tenant work."""
+
+    def __init__(self, tenant_field='school'):
+        super().__init__()
+        self.tenant_field = tenant_field
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        school = get_current_school()
+        if school is _UNSET:
+            return queryset
+        if not school:
+            return queryset.none()
+        return queryset.filter(**{self.tenant_field: school.pk})
@@ -0,0 +1,474 @@
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from account.roles import OWNER_GROUP
+
+from .cache import VERSION_KEY, bump_directory_version, get_cache, stats as cache_stats
+from .importer import import_schools
+from .logos import LOGO_VARIANT_WIDTHS, _generate_in_background, generate_variants
+from .middleware import TenantMiddleware
+from .models import ImportCheckpoint, School
+from .pagination import decode_cursor, encode_cursor
+from .search import rebuild_index, search_schools
+from .tenancy import SESSION_KEY, TenantScopedManager, resolve_school
+
+
+class SchoolDirectoryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', 'owner@test.com', 'testpass')
+        names = ['Chisipite', 'Avondale', 'Borrowdale', 'Avondale', 'Highlands', 'Eastlea', 'Greendale']
+        School.objects.bulk_create(
+            [School(name=name, owner=cls.owner, address=f'{i} Main Road') for i, name in enumerate(names)]
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def fetch_all(self, page_size):
+        url = reverse('schools:list_json')
+        seen, cursor, pages = [], None, 0
+        while True:
+            params = {'page_size': page_size}
+            if cursor:
+                params['cursor'] = cursor
+            with self.assertNumQueries(1):
+                data = self.client.get(url, params).json()
+            pages += 1
+            self.assertLessEqual(len(data['results']), page_size)
+            seen.extend((row['name'], row['id']) for row in data['results'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return seen, pages
+
+    def test_pages_cover_every_school_in_order(self):
+        seen, pages = self.fetch_all(page_size=3)
+
+        expected = list(School.objects.order_by('name', 'id').values_list('name', 'id'))
+        self.assertEqual(seen, expected)
+        self.assertEqual(pages, 3)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse('schools:list_json'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_pages_are_cached_until_a_school_changes(self):
+        url = reverse('schools:list_json')
+        cache_stats.reset()
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(cache_stats.snapshot()['list_json'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+        school = School.objects.get(name='Avondale', address='1 Main Road')
+        school.name = 'Aaron Park'
+        with self.captureOnCommitCallbacks(execute=True):
+            school.save()
+        self.assertEqual(self.client.get(url).json()['results'][0]['name'], 'Aaron Park')
+
+    def test_conditional_get_returns_304(self):
+        url = reverse('schools:list_json')
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, {'page_size': 2}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            School.objects.first().delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    async def test_served_over_asgi(self):
+        response = await self.async_client.get(reverse('schools:list_json'), {'page_size': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertIsNotNone(response.json()['next_cursor'])
+
+    def test_validators_and_page_use_one_version(self):
+        url = reverse('schools:list_json')
+        first = self.client.get(url)
+        cache_stats.reset()
+        directory_cache = get_cache()
+        real_get, real_get_many = directory_cache.get, directory_cache.get_many
+        bumped = []
+
+        def after_version_read(keys, value):
+            if VERSION_KEY in keys and not bumped:
+                bumped.append(True)
+                bump_directory_version()  # another worker saves a school
+            return value
+
+        def get(key, *args, **kwargs):
+            return after_version_read([key], real_get(key, *args, **kwargs))
+
+        def get_many(keys, *args, **kwargs):
+            return after_version_read(keys, real_get_many(keys, *args, **kwargs))
+
+        with mock.patch.object(directory_cache, 'get', get), mock.patch.object(directory_cache, 'get_many', get_many):
+            second = self.client.get(url)
+        self.assertTrue(bumped)
+        # The page cached under the version in the ETag is the one served.
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(cache_stats.snapshot()['list_json']['hits'], 1)
+
+    def test_cursor_round_trip(self):
+        school = School.objects.first()
+        self.assertEqual(decode_cursor(encode_cursor(school)), (school.name, school.pk))
+
+
+class SchoolSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', 'owner@test.com', 'testpass')
+        cls.chisipite = School.objects.create(name='Chisipite Senior School', address='Harare', owner=cls.owner)
+        cls.harare_high = School.objects.create(name='Harare High', address='Mbare', owner=cls.owner)
+        cls.highlands = School.objects.create(name='Highlands Primary', address='Harare', owner=cls.owner)
+
+    def search(self, query):
+        response = self.client.get(reverse('schools:search'), {'q': query})
+        return [row['name'] for row in response.json()['results']]
+
+    def test_prefix_matches_for_type_ahead(self):
+        self.assertEqual(self.search('chis'), ['Chisipite Senior School'])
+        self.assertEqual(self.search('high prim'), ['Highlands Primary'])
+
+    def test_name_matches_rank_above_address_matches(self):
+        self.assertEqual(self.search('harare')[0], 'Harare High')
+
+    def test_index_follows_saves_and_deletes(self):
+        self.chisipite.name = 'Gateway High'
+        self.chisipite.save()
+        self.assertEqual(self.search('chis'), [])
+        self.assertEqual(self.search('gatew'), ['Gateway High'])
+
+        self.harare_high.delete()
+        self.assertNotIn('Harare High', self.search('harare'))
+
+    def test_operators_in_input_are_treated_as_text(self):
+        self.assertEqual(self.search('"OR NEAR('), [])
+        self.assertEqual(self.search(''), [])
+
+    def test_rebuild_index(self):
+        self.assertEqual(rebuild_index(chunk_size=2), 3)
+        self.assertEqual(self.search('highlands'), ['Highlands Primary'])
+
+
+def png_upload(name='crest.png', size=(600, 400)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class SchoolLogoVariantTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.owner = User.objects.create_user('owner', 'owner@test.com', 'testpass')
+
+    def test_upload_queues_variants_after_commit(self):
+        with mock.patch('schools.logos._get_executor') as executor:
+            with self.captureOnCommitCallbacks() as callbacks:
+                school = School.objects.create(name='Chisipite', owner=self.owner, logo=png_upload())
+            executor.return_value.submit.assert_not_called()
+            for callback in callbacks:
+                callback()
+        executor.return_value.submit.assert_called_once_with(
+            _generate_in_background, school.pk, school.logo.name
+        )
+
+    def test_variants_are_square_webp_and_used_in_srcset(self):
+        with self.captureOnCommitCallbacks():
+            school = School.objects.create(name='Chisipite', owner=self.owner, logo=png_upload())
+        self.assertEqual(school.logo_srcset, '')
+        self.assertEqual(school.logo_thumbnail_url, school.logo.url)
+
+        generate_variants(school.pk, school.logo.name)
+        school.refresh_from_db()
+
+        for width in LOGO_VARIANT_WIDTHS:
+            with Image.open(os.path.join(self.media_root, school.logo_variants[str(width)])) as variant:
+                self.assertEqual((variant.format, variant.size), ('WEBP', (width, width)))
+        self.assertEqual([width for width, _ in school.ready_logo_variants()], list(LOGO_VARIANT_WIDTHS))
+        self.assertIn('160w', school.logo_srcset)
+        self.assertTrue(school.logo_thumbnail_url.endswith('_80.webp'))
+
+    def test_stale_variants_are_not_served_for_a_new_logo(self):
+        with self.captureOnCommitCallbacks():
+            school = School.objects.create(name='Chisipite', owner=self.owner, logo=png_upload())
+        generate_variants(school.pk, school.logo.name)
+        school.refresh_from_db()
+
+        school.logo = png_upload('new-crest.png')
+        with mock.patch('schools.signals.schedule_variants') as schedule:
+            school.save()
+        schedule.assert_called_once_with(school)
+        self.assertEqual(school.logo_srcset, '')
+
+    @override_settings(STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_variants_work_on_storage_without_local_paths(self):
+        with self.captureOnCommitCallbacks():
+            school = School.objects.create(name='Chisipite', owner=self.owner, logo=png_upload())
+        generate_variants(school.pk, school.logo.name)
+        school.refresh_from_db()
+        with default_storage.open(school.logo_variants['80']) as f, Image.open(f) as variant:
+            self.assertEqual((variant.format, variant.size), ('WEBP', (80, 80)))
+
+        School.objects.filter(pk=school.pk).update(logo_variants={})
+        call_command('backfill_logo_variants', workers=1, stdout=io.StringIO())
+        self.assertEqual(School.objects.get(pk=school.pk).logo_variants['source'], school.logo.name)
+
+    def test_profile_upload_edits_the_active_school(self):
+        owner = User.objects.create_superuser('admin', 'admin@test.com', 'testpass')
+        school = School.objects.create(name='Chisipite', owner=owner)
+        self.client.force_login(owner)
+        with mock.patch('schools.signals.schedule_variants') as schedule:
+            response = self.client.post(
+                reverse('schools:school_profile'), {'name': 'Chisipite College', 'logo': png_upload()}
+            )
+        self.assertRedirects(response, reverse('schools:school_profile'), fetch_redirect_response=False)
+        school.refresh_from_db()
+        self.assertEqual(school.name, 'Chisipite College')
+        self.assertTrue(school.logo.name.endswith('.png'))
+        schedule.assert_called_once()
+
+
+class TenantTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', 'owner@test.com', 'testpass')
+        cls.other = User.objects.create_user('other', 'other@test.com', 'testpass')
+        cls.first = School.objects.create(name='Chisipite', owner=cls.owner, subdomain='chisipite')
+        cls.second = School.objects.create(name='Highlands', owner=cls.owner)
+        cls.foreign = School.objects.create(name='Avondale', owner=cls.other, subdomain='avondale')
+
+    def setUp(self):
+        cache.clear()
+
+    def request_for(self, user, host='testserver', session=None):
+        request = RequestFactory().get('/', HTTP_HOST=host)
+        request.user = User.objects.get(pk=user.pk)
+        request.session = session if session is not None else {}
+        return request
+
+    def test_owner_of_several_schools_gets_the_first_then_their_choice(self):
+        session = {}
+        self.assertEqual(resolve_school(self.request_for(self.owner, session=session)), self.first)
+
+        self.client.force_login(self.owner)
+        response = self.client.post(reverse('schools:switch'), {'school_id': self.second.pk})
+        self.assertRedirects(response, reverse('schools:school_profile'), fetch_redirect_response=False)
+        session[SESSION_KEY] = self.client.session[SESSION_KEY]
+        self.assertEqual(resolve_school(self.request_for(self.owner, session=session)), self.second)
+
+        response = self.client.post(reverse('schools:switch'), {'school_id': self.foreign.pk})
+        self.assertEqual(response.status_code, 404)
+
+    def test_resolution_is_cached(self):
+        resolve_school(self.request_for(self.owner))
+        request = self.request_for(self.owner)
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_school(request), self.first)
+
+    @override_settings(TENANT_BASE_DOMAIN='legacygrid.test', ALLOWED_HOSTS=['.legacygrid.test'])
+    def test_subdomain_selects_the_school(self):
+        request = self.request_for(self.other, host='avondale.legacygrid.test')
+        self.assertEqual(resolve_school(request), self.foreign)
+        self.assertIsNone(resolve_school(self.request_for(self.other, host='nowhere.legacygrid.test')))
+        # Another owner's subdomain gives no active school.
+        self.assertIsNone(resolve_school(self.request_for(self.owner, host='avondale.legacygrid.test')))
+
+    @override_settings(TENANT_BASE_DOMAIN='legacygrid.test', ALLOWED_HOSTS=['.legacygrid.test'])
+    def test_cannot_edit_another_owners_school_through_its_subdomain(self):
+        self.owner.groups.add(Group.objects.get_or_create(name=OWNER_GROUP)[0])
+        self.client.force_login(self.owner)
+        response = self.client.post(
+            reverse('schools:school_profile'), {'name': 'Hijacked'}, HTTP_HOST='avondale.legacygrid.test'
+        )
+        self.assertEqual(response.status_code, 404)
+        self.foreign.refresh_from_db()
+        self.assertEqual(self.foreign.name, 'Avondale')
+
+    def test_scoped_manager_follows_the_active_school(self):
+        scoped = TenantScopedManager(tenant_field='id')
+        scoped.model = School
+        self.assertEqual(scoped.count(), 3)
+
+        seen = {}
+
+        def view(request):
+            seen['schools'] = list(scoped.all())
+            return HttpResponse()
+
+        TenantMiddleware(view)(self.request_for(self.owner))
+        self.assertEqual(seen['schools'], [self.first])
+        TenantMiddleware(view)(self.request_for(User.objects.create_user('nobody')))
+        self.assertEqual(seen['schools'], [])
+        self.assertEqual(scoped.count(), 3)
+
+
+class SchoolImportTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('district', 'district@test.com', 'testpass')
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def write_csv(self, rows):
+        path = os.path.join(self.tmp, 'schools.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, ['name', 'owner', 'address', 'subdomain'])
+            writer.writeheader()
+            writer.writerows(rows)
+        return path
+
+    def test_csv_import_validates_and_indexes(self):
+        path = self.write_csv([
+            {'name': 'Chisipite', 'owner': 'district', 'address': 'Harare', 'subdomain': 'chisipite'},
+            {'name': '', 'owner': 'district'},
+            {'name': 'Ghost School', 'owner': 'nobody'},
+            {'name': 'Copycat', 'owner': 'district', 'subdomain': 'chisipite'},
+            {'name': 'Highlands', 'owner': 'district', 'address': 'Harare'},
+        ])
+        errors = []
+        result = import_schools(path, batch_size=2, on_error=lambda row, message: errors.append(row))
+
+        self.assertEqual((result.imported, result.invalid), (2, 3))
+        self.assertEqual(sorted(errors), [2, 3, 4])
+        self.assertEqual(sorted(School.objects.values_list('name', flat=True)), ['Chisipite', 'Highlands'])
+        self.assertEqual([s.name for s in search_schools('highl')], ['Highlands'])
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_jsonl_import_resumes_after_a_failed_batch(self):
+        path = os.path.join(self.tmp, 'schools.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            for i in range(7):
+                f.write(json.dumps({'name': f'School {i}', 'owner': 'district'}) + '\n')
+
+        real_bulk_create = School.objects.bulk_create
+        calls = []
+
+        def failing_bulk_create(objs, *args, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 2:
+                raise RuntimeError("database went away")
+            return real_bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(School.objects, 'bulk_create', side_effect=failing_bulk_create):
+            with self.assertRaises(RuntimeError):
+                import_schools(path, batch_size=3)
+        self.assertEqual(School.objects.count(), 3)
+        self.assertEqual(ImportCheckpoint.objects.get().row, 3)
+
+        result = import_schools(path, batch_size=3, resume=True)
+        self.assertEqual((result.resumed_from, result.imported), (3, 7))
+        self.assertEqual(
+            sorted(School.objects.values_list('name', flat=True)), [f'School {i}' for i in range(7)]
+        )
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_checkpoint_commits_with_its_batch(self):
+        path = self.write_csv([{'name': f'School {i}', 'owner': 'district'} for i in range(4)])
+        with mock.patch('schools.importer.index_rows', side_effect=[None, RuntimeError("disk full")]):
+            with self.assertRaises(RuntimeError):
+                import_schools(path, batch_size=2)
+        self.assertEqual(School.objects.count(), 2)
+        self.assertEqual(ImportCheckpoint.objects.get().row, 2)
+
+    def test_command_reports_progress(self):
+        path = self.write_csv([{'name': 'Avondale', 'owner': 'district'}])
+        out = io.StringIO()
+        call_command('import_schools', path, stdout=out)
+        self.assertIn('rows/s', out.getvalue())
+        self.assertIn('Imported 1 schools, 0 rows rejected', out.getvalue())
+
+
+class SchoolExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_superuser('owner', 'owner@test.com', 'testpass')
+        cls.old = School.objects.create(name='Chisipite', owner=cls.owner, address='Harare, Borrowdale')
+        cls.new = School.objects.create(name='Highlands', owner=cls.owner, subdomain='highlands')
+        School.objects.filter(pk=cls.old.pk).update(updated_at=datetime(2020, 1, 1, tzinfo=timezone.utc))
+
+    def export(self, **params):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('schools:export'), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_export(self):
+        response, body = self.export()
+        self.assertIn('attachment; filename="schools-', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(body.decode('utf-8'))))
+        self.assertEqual([row['name'] for row in rows], ['Chisipite', 'Highlands'])
+        self.assertEqual(rows[0]['address'], 'Harare, Borrowdale')
+        self.assertEqual(rows[1]['owner'], 'owner')
+
+    def test_gzipped_jsonl_since_timestamp(self):
+        response, body = self.export(format='jsonl', gzip='1', since='2021-01-01')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        records = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+        self.assertEqual([(r['name'], r['subdomain']) for r in records], [('Highlands', 'highlands')])
+
+    def test_export_requires_an_owner(self):
+        self.client.force_login(User.objects.create_user('teacher'))
+        self.assertEqual(self.client.get(reverse('schools:export')).status_code, 302)
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(reverse('schools:export'), {'since': 'yesterday'}).status_code, 400)
+
+    def test_school_owners_export_only_their_own_schools(self):
+        other = User.objects.create_user('other', 'other@test.com', 'testpass')
+        other.groups.add(Group.objects.get_or_create(name=OWNER_GROUP)[0])
+        School.objects.create(name='Avondale', owner=other)
+        self.client.force_login(other)
+        response = self.client.get(reverse('schools:export'), {'owner': 'owner'})
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual([(row['name'], row['owner']) for row in rows], [('Avondale', 'other')])
+
+    def test_impossible_dates_are_rejected(self):
+        self.client.force_login(self.owner)
+        for since in ('2021-13-01', '2021-01-01T25:00'):
+            with self.subTest(since=since):
+                self.assertEqual(self.client.get(reverse('schools:export'), {'since': since}).status_code, 400)
+        with self.assertRaisesMessage(CommandError, "Invalid timestamp: '2021-02-30'"):
+            call_command('export_schools', since='2021-02-30', stdout=io.StringIO())
+
+    def test_command_writes_file(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        path = os.path.join(tmp, 'schools.csv')
+        call_command('export_schools', output=path, name='high', stderr=io.StringIO())
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual([row['name'] for row in csv.DictReader(f)], ['Highlands'])
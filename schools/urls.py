@@ -1,9 +1,13 @@
 from django.urls import path
-from .views import school_profile, school_list
+from .views import school_profile, school_list, school_list_json, school_search, switch_active_school, school_export
 
 app_name = 'schools'
 
 urlpatterns = [
     path('profile/', school_profile, name='school_profile'),
+    path('switch/', switch_active_school, name='switch'),
     path('list/', school_list, name='list'),
+    path('list/json/', school_list_json, name='list_json'),
+    path('search/', school_search, name='search'),
+    path('export/', school_export, name='export'),
 ]
\ No newline at end of file
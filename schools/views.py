@@ -1,27 +1,169 @@
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import user_passes_test, login_required
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
+from django.views.decorators.http import condition, require_GET, require_POST
+from account.roles import is_billing_owner, is_owner
+from legacygrid_school_management.db import replica_reads, use_read_replica
+from .export import CONTENT_TYPES, ExportError, export_chunks, export_filename, parse_since
+from .cache import acached_page, cached_cards, directory_state, page_etag
 from .models import School
 from .forms import SchoolLogoForm
+from .pagination import InvalidCursor, akeyset_page, parse_page_size
+from .search import search_schools
+from .tenancy import switch_school
+
+# Only the fields a directory card shows.
+CARD_FIELDS = ('id', 'name', 'address', 'logo', 'logo_variants')
 
 def home(request):
     return render(request, "home.html")
 
-def is_owner(user):
-    return user.is_superuser or user.groups.filter(name='Owner').exists()
+def save_if_valid(form):
+    if not form.is_valid():
+        return False
+    form.save()
+    return True
 
 @login_required
 @user_passes_test(is_owner)
-def school_profile(request):
-    school = School.objects.get(owner=request.user)
+async def school_profile(request):
+    school = await request.aschool()
+    user = await request.auser()
+    if not school or school.owner_id != user.pk:
+        raise Http404("No school is set up for this account.")
     if request.method == "POST":
+        # Edit a fresh row: request.school may come from the cache.
+        school = await School.objects.aget(pk=school.pk)
         form = SchoolLogoForm(request.POST, request.FILES, instance=school)
-        if form.is_valid():
-            form.save()
-            return redirect('school_profile')
+        # Validation and the save (which queues logo variants) query the database.
+        if await sync_to_async(save_if_valid)(form):
+            return redirect('schools:school_profile')
     else:
         form = SchoolLogoForm(instance=school)
-    return render(request, "schools/profile.html", {"form": form, "school": school})
+    # The context processors look up the user's roles.
+    return await sync_to_async(render)(request, "schools/profile.html", {"form": form, "school": school})
+
+@login_required
+@require_POST
+def switch_active_school(request):
+    try:
+        school_id = int(request.POST.get('school_id', ''))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid school")
+    if not switch_school(request, school_id):
+        raise Http404("No such school.")
+    return redirect('schools:school_profile')
+
+def directory_params(request):
+    return {
+        'cursor': request.GET.get('cursor') or '',
+        'page_size': parse_page_size(request.GET.get('page_size')),
+    }
+
+async def directory_page(params):
+    queryset = School.objects.only(*CARD_FIELDS)
+    return await akeyset_page(queryset, params['cursor'], params['page_size'])
+
+def request_directory_state(request):
+    """The directory version and modified time, read once per request so the
+    validators and the cached page agree."""
+    if not hasattr(request, 'directory_state'):
+        request.directory_state = directory_state()
+    return request.directory_state
+
+def directory_modified(request, *args, **kwargs):
+    _, modified = request_directory_state(request)
+    return datetime.fromtimestamp(modified, tz=timezone.utc)
+
+def directory_etag(kind):
+    def etag(request, *args, **kwargs):
+        version, _ = request_directory_state(request)
+        return page_etag(kind, directory_params(request), version)
+    return etag
 
-def school_list(request):
-    schools = School.objects.all()
-    return render(request, "schools/list.html", {"schools": schools})
\ No newline at end of file
+def render_card(school):
+    return render_to_string("schools/_card.html", {"school": school})
+
+async def render_directory(params):
+    schools, next_cursor = await directory_page(params)
+    # Cards and the page render from the loaded rows without queries.
+    cards = cached_cards(schools, CARD_FIELDS, render_card)
+    # Rendered without the request: the cached page must not carry anything
+    # user-specific.
+    return render_to_string("schools/list.html", {"cards": cards, "next_cursor": next_cursor})
+
+@use_read_replica
+@condition(etag_func=directory_etag('list'), last_modified_func=directory_modified)
+async def school_list(request):
+    params = directory_params(request)
+    version, _ = request_directory_state(request)
+    try:
+        html = await acached_page('list', params, lambda: render_directory(params), version)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor")
+    return HttpResponse(html)
+
+def school_card(school):
+    return {
+        "id": school.pk,
+        "name": school.name,
+        "address": school.address,
+        "logo": school.logo_thumbnail_url,
+        "logo_srcset": school.logo_srcset,
+    }
+
+async def directory_json(params):
+    schools, next_cursor = await directory_page(params)
+    return {"results": [school_card(s) for s in schools], "next_cursor": next_cursor}
+
+@use_read_replica
+@condition(etag_func=directory_etag('list_json'), last_modified_func=directory_modified)
+async def school_list_json(request):
+    params = directory_params(request)
+    version, _ = request_directory_state(request)
+    try:
+        data = await acached_page('list_json', params, lambda: directory_json(params), version)
+    except InvalidCursor:
+        return JsonResponse({"error": "Invalid cursor"}, status=400)
+    return JsonResponse(data)
+
+@use_read_replica
+def school_search(request):
+    query = request.GET.get('q', '')
+    limit = parse_page_size(request.GET.get('limit'))
+    schools = search_schools(query, limit, fields=CARD_FIELDS)
+    return JsonResponse({"query": query, "results": [school_card(s) for s in schools]})
+
+@login_required
+@user_passes_test(is_owner)
+@require_GET
+def school_export(request):
+    fmt = request.GET.get('format', 'csv')
+    compress = request.GET.get('gzip') in ('1', 'true')
+    as_of = datetime.now(timezone.utc)
+    owner = request.GET.get('owner')
+    if not (request.user.is_superuser or is_billing_owner(request.user)):
+        # A school owner exports only their own schools.
+        owner = request.user.get_username()
+    try:
+        chunks = export_chunks(
+            fmt,
+            compress=compress,
+            name=request.GET.get('name'),
+            owner=owner,
+            since=parse_since(request.GET.get('since')),
+        )
+    except ExportError as e:
+        return HttpResponseBadRequest(str(e))
+    # The body is produced after the view returns; keep its reads on the replica.
+    response = StreamingHttpResponse(
+        replica_reads(chunks), content_type='application/gzip' if compress else CONTENT_TYPES[fmt]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(fmt, compress, as_of)}"'
+    # Pass back as ?since= to fetch only rows changed after this export.
+    response['X-Export-As-Of'] = as_of.isoformat()
+    return response
@@ -2,5 +2,7 @@ smtp_cfg = {
     'server': 'smtp.yourprovider.com',    # e.g., smtp.gmail.com
     'port': 587,                          # 465 for SSL, 587 for TLS
     'user': 'your@email.com',             # your email address
-    'password': 'your_email_password'     # your email password or app password
+    'password': 'your_email_password',    # your email password or app password
+    'max_connections': 4,                 # parallel sessions allowed by your provider
+    'rate_per_minute': 60,                # provider's sending limit; omit to disable rate limiting
 }
\ No newline at end of file
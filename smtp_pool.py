@@ -0,0 +1,255 @@
+"""
+Pooled SMTP sessions shared by auto_emailer and email_utils.
+
+Opening an SMTP connection costs a TCP connect, a STARTTLS handshake and a
+LOGIN round trip. The pool keeps authenticated sessions alive per
+``smtp_cfg`` so consecutive sends reuse them, checks an idle session with
+NOOP/RSET before handing it out again, and drops sessions that have been
+idle for too long.
+
+Usage for a batch of messages (one session for the whole batch):
+
+    with smtp_session(smtp_cfg) as server:
+        for msg in messages:
+            server.sendmail(...)
+"""
+
+import hashlib
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from email_metrics import phase
+
+# Sessions idle for longer than this are closed instead of reused. Most
+# providers drop idle connections after a few minutes anyway.
+DEFAULT_IDLE_TIMEOUT = 60
+# Upper bound of idle sessions kept per SMTP account.
+DEFAULT_MAX_IDLE = 4
+# Sessions open at the same time against one SMTP server, unless the config
+# sets ``max_connections``. Providers reject or throttle clients that open
+# many parallel connections.
+DEFAULT_MAX_CONNECTIONS = 4
+
+
+def is_connection_error(exc):
+    """True when ``exc`` means the session itself is unusable. SMTP protocol
+    errors (refused recipients, rejected data) subclass OSError too, but the
+    session survives those and can be reused after RSET."""
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPException)
+
+
+def pool_key(smtp_cfg):
+    """Sessions are shared between configs with the same server and
+    credentials; after a password change, sessions logged in with the old
+    one are not reused. The key holds a digest, not the password."""
+    credentials = f"{smtp_cfg.get('user') or ''}\0{smtp_cfg.get('password') or ''}"
+    digest = hashlib.sha256(credentials.encode('utf-8')).hexdigest()
+    return (smtp_cfg['server'], smtp_cfg['port'], smtp_cfg.get('user'), digest)
+
+
+def server_key(smtp_cfg):
+    """The concurrency cap applies per SMTP server, whatever the account."""
+    return (smtp_cfg['server'], smtp_cfg['port'])
+
+
+def max_connections(smtp_cfg):
+    return smtp_cfg.get('max_connections') or DEFAULT_MAX_CONNECTIONS
+
+
+def open_connection(smtp_cfg):
+    """Connect, upgrade to TLS and log in using the settings in ``smtp_cfg``."""
+    with phase('connect'):
+        server = smtplib.SMTP(smtp_cfg['server'], smtp_cfg['port'])
+    try:
+        if smtp_cfg.get('starttls', True):
+            with phase('tls'):
+                server.starttls()
+        if smtp_cfg.get('user'):
+            with phase('login'):
+                server.login(smtp_cfg['user'], smtp_cfg['password'])
+    except Exception:
+        close_quietly(server)
+        raise
+    return server
+
+
+def close_quietly(server):
+    try:
+        server.quit()
+    except Exception:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+
+def is_alive(server):
+    """Cheap liveness probe for an idle session: RSET clears any half-finished
+    transaction and NOOP confirms the server still answers."""
+    try:
+        if server.rset()[0] != 250:
+            return False
+        return server.noop()[0] == 250
+    except Exception:
+        return False
+
+
+class ServerSlots:
+    """Sessions lent out against one SMTP server. The limit only ever goes
+    down, to the lowest ``max_connections`` asked for."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._changed = threading.Condition()
+
+    def acquire(self, limit):
+        with self._changed:
+            self.limit = min(self.limit, limit)
+            while self.in_use >= self.limit:
+                self._changed.wait()
+            self.in_use += 1
+
+    def release(self):
+        with self._changed:
+            self.in_use -= 1
+            self._changed.notify()
+
+
+class SMTPConnectionPool:
+    """Thread-safe pool of authenticated SMTP sessions keyed by ``smtp_cfg``.
+
+    At most ``max_connections(smtp_cfg)`` sessions per server are lent out at
+    once; further ``acquire`` calls block until a session is released. All
+    accounts on a server share one cap: the lowest ``max_connections`` of
+    the configs seen for it. A thread already holding a session must send
+    over it rather than acquire a second one.
+    """
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_idle=DEFAULT_MAX_IDLE):
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+        self.connections_opened = 0
+
+    def _slot(self, smtp_cfg):
+        key = server_key(smtp_cfg)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = ServerSlots(max_connections(smtp_cfg))
+            return slot
+
+    def acquire(self, smtp_cfg):
+        """Return a live session, reusing an idle one when possible."""
+        slot = self._slot(smtp_cfg)
+        slot.acquire(max_connections(smtp_cfg))
+        try:
+            return self._checkout(smtp_cfg)
+        except BaseException:
+            slot.release()
+            raise
+
+    def _checkout(self, smtp_cfg):
+        key = pool_key(smtp_cfg)
+        while True:
+            with self._lock:
+                sessions = self._idle.get(key)
+                if not sessions:
+                    break
+                server, released_at = sessions.pop()
+            if time.monotonic() - released_at > self.idle_timeout:
+                close_quietly(server)
+                continue
+            if is_alive(server):
+                return server
+            close_quietly(server)
+        server = open_connection(smtp_cfg)
+        with self._lock:
+            self.connections_opened += 1
+        return server
+
+    def release(self, smtp_cfg, server, discard=False):
+        """Hand a session back to the pool, or close it if it is broken or
+        the pool already holds enough idle sessions for this account."""
+        try:
+            if not discard:
+                key = pool_key(smtp_cfg)
+                with self._lock:
+                    sessions = self._idle.setdefault(key, [])
+                    if len(sessions) < self.max_idle:
+                        sessions.append((server, time.monotonic()))
+                        return
+            close_quietly(server)
+        finally:
+            self._slot(smtp_cfg).release()
+
+    @contextmanager
+    def session(self, smtp_cfg):
+        """Borrow one session for the duration of the ``with`` block."""
+        server = self.acquire(smtp_cfg)
+        try:
+            yield server
+        except BaseException as exc:
+            # Unless the connection broke, the session is still fine and the
+            # RSET before its next use clears any half-finished transaction.
+            self.release(smtp_cfg, server, discard=is_connection_error(exc))
+            raise
+        else:
+            self.release(smtp_cfg, server)
+
+    def sendmail(self, smtp_cfg, from_addr, to_addrs, msg):
+        """Send one message over a pooled session. A reused session that was
+        dropped by the server between the liveness check and the send is
+        replaced with a fresh connection and the send is retried once."""
+        for attempt in (1, 2):
+            server = self.acquire(smtp_cfg)
+            try:
+                with phase('send'):
+                    result = server.sendmail(from_addr, to_addrs, msg)
+            except BaseException as exc:
+                self.release(smtp_cfg, server, discard=is_connection_error(exc))
+                if attempt == 1 and isinstance(exc, smtplib.SMTPServerDisconnected):
+                    continue
+                raise
+            self.release(smtp_cfg, server)
+            return result
+
+    def expire_idle(self):
+        """Close every idle session older than ``idle_timeout``."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, sessions in self._idle.items():
+                keep = []
+                for server, released_at in sessions:
+                    if now - released_at > self.idle_timeout:
+                        expired.append(server)
+                    else:
+                        keep.append((server, released_at))
+                self._idle[key] = keep
+        for server in expired:
+            close_quietly(server)
+        return len(expired)
+
+    def close_all(self):
+        with self._lock:
+            sessions = [server for idle in self._idle.values() for server, _ in idle]
+            self._idle.clear()
+        for server in sessions:
+            close_quietly(server)
+
+
+# Process-wide pool used by the send functions.
+default_pool = SMTPConnectionPool()
+
+
+def smtp_session(smtp_cfg):
+    """Context manager borrowing one session from the default pool."""
+    return default_pool.session(smtp_cfg)
@@ -0,0 +1,85 @@
+"""
+Process-wide cache of parsed email templates.
+
+Email templates are plain text files whose first line is ``Subject: ...``.
+The registry reads each file once, splits it into separate subject and body
+``string.Template`` objects, and only reads it again when the file's mtime
+changes. The number of cached templates is bounded (least recently used
+entries are evicted first).
+"""
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from string import Template
+
+DEFAULT_MAX_TEMPLATES = 64
+
+
+class CompiledTemplate(namedtuple('CompiledTemplate', 'path mtime source subject body')):
+    """A template file parsed once: ``source`` is the whole file, ``subject``
+    and ``body`` are the pre-split parts used for emails."""
+
+    __slots__ = ()
+
+    def render(self, data):
+        """Return ``(subject, body)`` with ``data`` substituted."""
+        return self.subject.safe_substitute(data), self.body.safe_substitute(data)
+
+
+def compile_template(text, path=None, mtime=None):
+    lines = text.splitlines()
+    subject = lines[0].replace("Subject: ", "") if lines else ""
+    body = "\n".join(lines[1:]).strip()
+    return CompiledTemplate(path, mtime, Template(text), Template(subject), Template(body))
+
+
+class TemplateRegistry:
+    """Thread-safe LRU cache of ``CompiledTemplate`` keyed by file path."""
+
+    def __init__(self, max_templates=DEFAULT_MAX_TEMPLATES):
+        self.max_templates = max_templates
+        self._lock = threading.Lock()
+        self._templates = OrderedDict()
+        self.loads = 0
+
+    def get(self, path):
+        """Return the compiled template for ``path``, reloading it if the file
+        changed since it was cached. Raises ``OSError`` if the file is missing."""
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._templates.get(path)
+            if cached is not None and cached.mtime == mtime:
+                self._templates.move_to_end(path)
+                return cached
+
+        with open(path, 'r', encoding='utf-8') as f:
+            compiled = compile_template(f.read(), path, mtime)
+
+        with self._lock:
+            self.loads += 1
+            self._templates[path] = compiled
+            self._templates.move_to_end(path)
+            while len(self._templates) > self.max_templates:
+                self._templates.popitem(last=False)
+        return compiled
+
+    def warm_up(self, paths):
+        """Load every template in ``paths``; returns the paths that failed."""
+        missing = []
+        for path in paths:
+            try:
+                self.get(path)
+            except OSError:
+                missing.append(path)
+        return missing
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+    def __len__(self):
+        return len(self._templates)
+
+
+default_registry = TemplateRegistry()
@@ -1,6 +1,18 @@
+import asyncio
+import threading
 import unittest
 from unittest.mock import patch, MagicMock
+import os
+import tempfile
+import logging
 import auto_emailer
+import email_metrics
+import rate_limit
+import smtp_pool
+import template_cache
+from benchmarks.smtp_sink import SMTPSink
+
+PAYMENT_TEMPLATE = template_cache.compile_template("Subject: Payment Received for $student_name\nBody text")
 
 class TestAutoEmailer(unittest.TestCase):
 
@@ -19,14 +31,14 @@ class TestAutoEmailer(unittest.TestCase):
         }
         self.to_email = "parent@email.com"
         self.from_email = "school@email.com"
+        smtp_pool.default_pool.close_all()
+
+    def tearDown(self):
+        smtp_pool.default_pool.close_all()
 
-    @patch("auto_emailer.smtplib.SMTP")
-    @patch("auto_emailer.os.path.exists", return_value=True)
-    @patch("auto_emailer.load_template")
-    def test_send_event_email_success(self, mock_load_template, mock_exists, mock_smtp):
-        mock_template = MagicMock()
-        mock_template.safe_substitute.return_value = "Subject: Payment Received\nBody text"
-        mock_load_template.return_value = mock_template
+    @patch("smtp_pool.smtplib.SMTP")
+    @patch("auto_emailer.get_event_template", return_value=PAYMENT_TEMPLATE)
+    def test_send_event_email_success(self, mock_get_template, mock_smtp):
 
         result = auto_emailer.send_event_email(
             "payment_received",
@@ -38,10 +50,10 @@ class TestAutoEmailer(unittest.TestCase):
 
         self.assertTrue(result)
         mock_smtp.assert_called_with(self.smtp_cfg['server'], self.smtp_cfg['port'])
-        mock_template.safe_substitute.assert_called_with(self.data)
+        sent_message = mock_smtp.return_value.sendmail.call_args[0][2]
+        self.assertIn("Subject: Payment Received for Jane Doe", sent_message)
 
-    @patch("auto_emailer.os.path.exists", return_value=False)
-    def test_send_event_email_missing_template(self, mock_exists):
+    def test_send_event_email_missing_template(self):
         result = auto_emailer.send_event_email(
             "unknown_event",
             self.data,
@@ -51,13 +63,9 @@ class TestAutoEmailer(unittest.TestCase):
         )
         self.assertFalse(result)
 
-    @patch("auto_emailer.smtplib.SMTP", side_effect=Exception("SMTP failure"))
-    @patch("auto_emailer.os.path.exists", return_value=True)
-    @patch("auto_emailer.load_template")
-    def test_send_event_email_smtp_failure(self, mock_load_template, mock_exists, mock_smtp):
-        mock_template = MagicMock()
-        mock_template.safe_substitute.return_value = "Subject: Payment Received\nBody text"
-        mock_load_template.return_value = mock_template
+    @patch("smtp_pool.smtplib.SMTP", side_effect=Exception("SMTP failure"))
+    @patch("auto_emailer.get_event_template", return_value=PAYMENT_TEMPLATE)
+    def test_send_event_email_smtp_failure(self, mock_get_template, mock_smtp):
 
         result = auto_emailer.send_event_email(
             "payment_received",
@@ -68,5 +76,301 @@ class TestAutoEmailer(unittest.TestCase):
         )
         self.assertFalse(result)
 
+    @patch("smtp_pool.smtplib.SMTP")
+    @patch("auto_emailer.get_event_template", return_value=PAYMENT_TEMPLATE)
+    def test_send_event_email_reuses_pooled_session(self, mock_get_template, mock_smtp):
+        mock_smtp.return_value.rset.return_value = (250, b"OK")
+        mock_smtp.return_value.noop.return_value = (250, b"OK")
+
+        for _ in range(3):
+            self.assertTrue(auto_emailer.send_event_email(
+                "payment_received", self.data, self.to_email, self.from_email, self.smtp_cfg
+            ))
+
+        mock_smtp.assert_called_once_with(self.smtp_cfg['server'], self.smtp_cfg['port'])
+        mock_smtp.return_value.login.assert_called_once()
+        self.assertEqual(mock_smtp.return_value.sendmail.call_count, 3)
+
+    @patch("smtp_pool.smtplib.SMTP")
+    @patch("auto_emailer.get_event_template", return_value=PAYMENT_TEMPLATE)
+    def test_send_event_emails_bulk(self, mock_get_template, mock_smtp):
+        mock_smtp.return_value.rset.return_value = (250, b"OK")
+        mock_smtp.return_value.noop.return_value = (250, b"OK")
+        mock_smtp.return_value.sendmail.side_effect = [{}, {}, smtp_pool.smtplib.SMTPRecipientsRefused({}), {}]
+        rows = [(self.data, f"parent{i}@email.com") for i in range(4)]
+        cfg = dict(self.smtp_cfg, max_connections=1)
+
+        summary = auto_emailer.send_event_emails_bulk("payment_received", rows, self.from_email, cfg, max_workers=3)
+
+        self.assertEqual([r['to_email'] for r in summary['results']], [to for _, to in rows])
+        self.assertEqual(summary['sent'], 3)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(mock_smtp.call_count, 1)
+
+    def test_send_event_emails_bulk_missing_template(self):
+        rows = [(self.data, self.to_email)]
+        summary = auto_emailer.send_event_emails_bulk("unknown_event", rows, self.from_email, self.smtp_cfg)
+        self.assertEqual(summary['failed'], 1)
+        self.assertFalse(summary['results'][0]['sent'])
+
+    @patch("smtp_pool.smtplib.SMTP")
+    @patch("auto_emailer.get_event_template", return_value=PAYMENT_TEMPLATE)
+    def test_throttling_reply_slows_the_account_down(self, mock_get_template, mock_smtp):
+        mock_smtp.return_value.sendmail.side_effect = smtp_pool.smtplib.SMTPDataError(421, b"Too many messages")
+        cfg = dict(self.smtp_cfg, rate_per_minute=600)
+        rate_limit.default_limiter.reset()
+        bucket = rate_limit.default_limiter.bucket_for(cfg)
+
+        result = auto_emailer.send_event_email("payment_received", self.data, self.to_email, self.from_email, cfg)
+
+        self.assertFalse(result)
+        self.assertAlmostEqual(bucket.rate, 5.0)
+        rate_limit.default_limiter.reset()
+
+
+class TestAgainstSMTPSink(unittest.TestCase):
+
+    def setUp(self):
+        smtp_pool.default_pool.close_all()
+        self.sink = SMTPSink().start()
+        self.addCleanup(self.sink.stop)
+        self.addCleanup(smtp_pool.default_pool.close_all)
+        self.data = {"parent_name": "John Doe", "student_name": "Jane Doe", "amount": "500", "date": "2025-09-15"}
+
+    def test_pooled_sends_share_one_connection(self):
+        for i in range(3):
+            self.assertTrue(auto_emailer.send_event_email(
+                "payment_received", self.data, f"parent{i}@email.com", "school@email.com", self.sink.smtp_cfg
+            ))
+        self.assertEqual(self.sink.counts["messages"], 3)
+        self.assertEqual(self.sink.counts["connections"], 1)
+
+    def test_bulk_send(self):
+        rows = [(self.data, f"parent{i}@email.com") for i in range(10)]
+        cfg = dict(self.sink.smtp_cfg, max_connections=2)
+
+        summary = auto_emailer.send_event_emails_bulk("payment_received", rows, "school@email.com", cfg)
+
+        self.assertEqual(summary["sent"], 10)
+        self.assertLessEqual(self.sink.counts["connections"], 2)
+
+    def test_async_sends_run_concurrently(self):
+        async def send_all():
+            return await asyncio.gather(*(
+                auto_emailer.asend_event_email(
+                    "payment_received", self.data, f"parent{i}@email.com", "school@email.com", self.sink.smtp_cfg
+                )
+                for i in range(4)
+            ))
+
+        self.assertEqual(asyncio.run(send_all()), [True] * 4)
+        self.assertEqual(self.sink.counts["messages"], 4)
+
+    def test_send_records_phase_timings(self):
+        email_metrics.metrics.reset()
+        self.addCleanup(email_metrics.metrics.reset)
+        for i in range(2):
+            auto_emailer.send_event_email(
+                "payment_received", self.data, f"parent{i}@email.com", "school@email.com", self.sink.smtp_cfg
+            )
+
+        provider = email_metrics.metrics.snapshot()[self.sink.smtp_cfg["server"]]
+        self.assertEqual(provider["sent"], 2)
+        self.assertEqual(provider["phases"]["render"]["count"], 2)
+        self.assertEqual(provider["phases"]["send"]["count"], 2)
+        # The second send reuses the pooled session, so only one connect/login.
+        self.assertEqual(provider["phases"]["connect"]["count"], 1)
+        self.assertEqual(provider["phases"]["login"]["count"], 1)
+
+
+class TestEmailLogging(unittest.TestCase):
+
+    def test_records_are_written_by_the_listener(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "email.log")
+            email_metrics.configure_email_logging(path, level=logging.INFO)
+            try:
+                with email_metrics.track_send({"server": "smtp.test.com"}, "payment_received", "a@test.com") as timings:
+                    timings.ok = True
+                email_metrics.logger.error("Failed to send email to b@test.com: refused")
+            finally:
+                email_metrics.stop_email_logging()
+                email_metrics.configure_email_logging()
+
+            with open(path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        self.assertIn('"provider": "smtp.test.com"', lines[0])
+        self.assertIn("ERROR legacygrid.email Failed to send email to b@test.com", lines[1])
+        self.assertFalse(logging.getLogger("legacygrid.email").propagate)
+
+    def test_histogram_percentiles(self):
+        histogram = email_metrics.LatencyHistogram()
+        for ms in [3] * 90 + [40] * 9 + [700]:
+            histogram.record(ms)
+        self.assertEqual(histogram.percentile(0.50), 5)
+        self.assertEqual(histogram.percentile(0.95), 50)
+        self.assertEqual(histogram.percentile(0.99), 50)
+        self.assertEqual(histogram.percentile(1.0), 700)
+
+
+class TestAdaptiveTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    def make_bucket(self, state=None):
+        return rate_limit.AdaptiveTokenBucket(
+            "smtp.test.com", rate=2.0, state=state, clock=self.clock, sleep=self.sleep
+        )
+
+    def test_acquire_waits_for_the_next_token(self):
+        bucket = self.make_bucket()
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertAlmostEqual(bucket.acquire(), 0.5)
+
+    def test_throttle_halves_rate_and_success_recovers_slowly(self):
+        bucket = self.make_bucket()
+        bucket.on_throttle()
+        self.assertAlmostEqual(bucket.rate, 1.0)
+        bucket.on_success()
+        self.assertAlmostEqual(bucket.rate, 1.0 + bucket.increase)
+        for _ in range(rate_limit.RECOVERY_SENDS):
+            bucket.on_success()
+        self.assertAlmostEqual(bucket.rate, 2.0)
+
+    def test_sqlite_state_is_shared_between_buckets(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "buckets.sqlite3")
+            first = self.make_bucket(rate_limit.SQLiteBucketState(path))
+            second = self.make_bucket(rate_limit.SQLiteBucketState(path))
+
+            self.assertEqual(first.try_acquire(), 0.0)
+            self.assertAlmostEqual(second.try_acquire(), 0.5)
+            second.on_throttle()
+            self.assertAlmostEqual(first.rate, 1.0)
+
+    def test_throttle_code(self):
+        refused = smtp_pool.smtplib.SMTPRecipientsRefused({"a@test.com": (451, b"Rate limited")})
+        self.assertEqual(rate_limit.throttle_code(refused), 451)
+        self.assertIsNone(rate_limit.throttle_code(smtp_pool.smtplib.SMTPDataError(550, b"Rejected")))
+
+
+class TestTemplateRegistry(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(handle, "w") as f:
+            f.write("Subject: Receipt for $student_name\n\nPaid $amount.\n")
+        self.registry = template_cache.TemplateRegistry(max_templates=1)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_template_is_parsed_once(self):
+        first = self.registry.get(self.path)
+        second = self.registry.get(self.path)
+
+        self.assertIs(first, second)
+        self.assertEqual(self.registry.loads, 1)
+        self.assertEqual(first.render({"student_name": "Jane", "amount": "500"}), ("Receipt for Jane", "Paid 500."))
+
+    def test_template_reloads_when_mtime_changes(self):
+        self.registry.get(self.path)
+        with open(self.path, "w") as f:
+            f.write("Subject: Updated\nNew body")
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        self.assertEqual(self.registry.get(self.path).render({}), ("Updated", "New body"))
+        self.assertEqual(self.registry.loads, 2)
+
+    def test_warm_up_reports_missing_templates(self):
+        missing = self.registry.warm_up([self.path, self.path + ".missing"])
+        self.assertEqual(missing, [self.path + ".missing"])
+        self.assertEqual(len(self.registry), 1)
+
+
+class TestSMTPConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.smtp_cfg = {
+            'server': 'smtp.test.com',
+            'port': 587,
+            'user': 'user@test.com',
+            'password': 'password'
+        }
+        self.pool = smtp_pool.SMTPConnectionPool()
+
+    def tearDown(self):
+        self.pool.close_all()
+
+    @patch("smtp_pool.smtplib.SMTP")
+    def test_dead_session_is_replaced(self, mock_smtp):
+        stale, fresh = MagicMock(), MagicMock()
+        stale.rset.side_effect = smtp_pool.smtplib.SMTPServerDisconnected()
+        mock_smtp.side_effect = [stale, fresh]
+
+        with self.pool.session(self.smtp_cfg) as server:
+            self.assertIs(server, stale)
+        with self.pool.session(self.smtp_cfg) as server:
+            self.assertIs(server, fresh)
+        self.assertEqual(self.pool.connections_opened, 2)
+
+    @patch("smtp_pool.smtplib.SMTP")
+    def test_idle_session_expires(self, mock_smtp):
+        self.pool.idle_timeout = 0
+        with self.pool.session(self.smtp_cfg):
+            pass
+        with patch("smtp_pool.time.monotonic", return_value=smtp_pool.time.monotonic() + 1):
+            self.assertEqual(self.pool.expire_idle(), 1)
+        mock_smtp.return_value.quit.assert_called_once()
+
+    @patch("smtp_pool.smtplib.SMTP")
+    def test_sendmail_retries_once_after_disconnect(self, mock_smtp):
+        dropped, fresh = MagicMock(), MagicMock()
+        dropped.sendmail.side_effect = smtp_pool.smtplib.SMTPServerDisconnected()
+        mock_smtp.side_effect = [dropped, fresh]
+
+        self.pool.sendmail(self.smtp_cfg, "a@test.com", ["b@test.com"], "msg")
+
+        fresh.sendmail.assert_called_once_with("a@test.com", ["b@test.com"], "msg")
+
+    @patch("smtp_pool.smtplib.SMTP")
+    def test_sessions_are_not_reused_after_a_password_change(self, mock_smtp):
+        old, new = MagicMock(), MagicMock()
+        old.rset.return_value = old.noop.return_value = (250, b"OK")
+        mock_smtp.side_effect = [old, new]
+        with self.pool.session(self.smtp_cfg):
+            pass
+        with self.pool.session(dict(self.smtp_cfg, password='rotated')) as server:
+            self.assertIs(server, new)
+        new.login.assert_called_once_with('user@test.com', 'rotated')
+        self.assertNotIn('rotated', repr(smtp_pool.pool_key(dict(self.smtp_cfg, password='rotated'))))
+
+    @patch("smtp_pool.smtplib.SMTP")
+    def test_connection_cap_is_per_server_whatever_the_limit(self, mock_smtp):
+        one = dict(self.smtp_cfg, max_connections=1)
+        other = dict(self.smtp_cfg, user='other@test.com', max_connections=5)
+        with self.pool.session(one):
+            acquired = threading.Event()
+
+            def borrow():
+                with self.pool.session(other):
+                    acquired.set()
+
+            thread = threading.Thread(target=borrow)
+            thread.start()
+            self.assertFalse(acquired.wait(0.1))
+        thread.join(2)
+        self.assertTrue(acquired.is_set())
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from legacygrid_school_management import db
+
+
+def connect(path, pragmas):
+    connection = sqlite3.connect(path, timeout=0, isolation_level=None, check_same_thread=False)
+    for statement in db.init_command(pragmas).split(';'):
+        connection.execute(statement)
+    return connection
+
+
+class TestSQLiteProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'db.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def read_while_writing(self, pragmas):
+        """Hold an exclusive write transaction and time a read from another
+        thread. Returns ``(rows seen or the error, seconds taken)``."""
+        writer = connect(self.path, pragmas)
+        writer.execute("CREATE TABLE payment (id INTEGER PRIMARY KEY, amount TEXT)")
+        writer.execute("INSERT INTO payment (amount) VALUES ('10.00')")
+        reader = connect(self.path, pragmas)
+        writer.execute("BEGIN EXCLUSIVE")
+        writer.execute("INSERT INTO payment (amount) VALUES ('20.00')")
+        result = {}
+
+        def read():
+            started = time.perf_counter()
+            try:
+                result['rows'] = reader.execute("SELECT count(*) FROM payment").fetchone()[0]
+            except sqlite3.OperationalError as e:
+                result['rows'] = e
+            result['seconds'] = time.perf_counter() - started
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join(timeout=10)
+        writer.execute("COMMIT")
+        writer.close()
+        reader.close()
+        return result['rows'], result['seconds']
+
+    def test_readers_do_not_wait_for_a_writer_in_wal_mode(self):
+        rows, seconds = self.read_while_writing(db.SQLITE_PRAGMAS)
+        # The reader sees the last committed snapshot straight away.
+        self.assertEqual(rows, 1)
+        self.assertLess(seconds, 0.5)
+
+    def test_rollback_journal_blocks_readers(self):
+        pragmas = dict(db.SQLITE_PRAGMAS, journal_mode='DELETE', busy_timeout=300).items()
+        rows, seconds = self.read_while_writing(tuple(pragmas))
+        self.assertIsInstance(rows, sqlite3.OperationalError)
+        self.assertGreaterEqual(seconds, 0.25)
+
+    def test_pragmas_are_applied(self):
+        connection = connect(self.path, db.SQLITE_PRAGMAS)
+        self.assertEqual(connection.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        self.assertEqual(connection.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+        self.assertEqual(connection.execute("PRAGMA busy_timeout").fetchone()[0], 5000)
+        connection.close()
+
+    def test_database_entries(self):
+        primary = db.sqlite_database('/srv/db.sqlite3')
+        replica = db.sqlite_database('/srv/db.sqlite3', read_only=True)
+        self.assertEqual(primary['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertEqual(replica['NAME'], 'file:/srv/db.sqlite3?mode=ro')
+        self.assertNotIn('transaction_mode', replica['OPTIONS'])
+        self.assertEqual(replica['TEST'], {'MIRROR': 'default'})
+        self.assertGreater(primary['CONN_MAX_AGE'], 0)
+        with patch.dict(os.environ, {db.SERVER_ENV: 'asgi'}):
+            self.assertEqual(db.sqlite_database('/srv/db.sqlite3')['CONN_MAX_AGE'], 0)
+
+
+class TestReplicaRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.router = db.PrimaryReplicaRouter()
+        patcher = patch('legacygrid_school_management.db.replica_available', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_go_to_the_replica_only_when_asked(self):
+        self.assertEqual(self.router.db_for_read(None), 'default')
+        with db.read_replica():
+            self.assertEqual(self.router.db_for_read(None), 'replica')
+            self.assertEqual(self.router.db_for_write(None), 'default')
+        self.assertEqual(self.router.db_for_read(None), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'schools'))
+
+    def test_decorated_views_and_streamed_bodies(self):
+        view = db.use_read_replica(lambda request: self.router.db_for_read(None))
+        self.assertEqual(view(None), 'replica')
+
+        async def async_view(request):
+            await asyncio.sleep(0)
+            return self.router.db_for_read(None)
+
+        self.assertEqual(asyncio.run(db.use_read_replica(async_view)(None)), 'replica')
+
+        def body():
+            for _ in range(3):
+                yield self.router.db_for_read(None)
+
+        chunks = db.replica_reads(body())
+        self.assertEqual(next(chunks), 'replica')
+        # Between chunks the server's own code reads from the primary.
+        self.assertEqual(self.router.db_for_read(None), 'default')
+        self.assertEqual(list(chunks), ['replica', 'replica'])
+
+
+if __name__ == "__main__":
+    unittest.main()